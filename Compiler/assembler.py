@@ -0,0 +1,68 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+import llvmlite.binding as llvm
+
+from .optimizer import lower_coroutines
+from .target import create_target_machine, host_cpu
+
+
+class Assembler:
+    def __init__(self, triple=None, cpu=None, features=None, level=2):
+        if triple is None:
+            host, host_features = host_cpu()
+            cpu = host if cpu is None else cpu
+            features = host_features if features is None else features
+        self.cpu = cpu or ""
+        self.features = features or ""
+        # Objects are meant to end up in shared libraries, so code is always
+        # position independent.
+        self.machine = create_target_machine(level, triple, cpu, features, reloc="pic",
+                                             codemodel="default")
+
+    @property
+    def triple(self):
+        return self.machine.triple
+
+    def module(self, module):
+        if not isinstance(module, llvm.ModuleRef):
+            module = llvm.parse_assembly(str(module))
+            module.verify()
+        module.triple = self.machine.triple
+        module.data_layout = str(self.machine.target_data)
+        return lower_coroutines(module, self.machine)
+
+    def emit_object(self, module):
+        return self.machine.emit_object(self.module(module))
+
+    def emit_assembly(self, module):
+        return self.machine.emit_assembly(self.module(module))
+
+    def write_object(self, module, path):
+        data = self.emit_object(module)
+        with open(path, "wb") as file:
+            file.write(data)
+        return path
+
+    def write_assembly(self, module, path):
+        with open(path, "w") as file:
+            file.write(self.emit_assembly(module))
+        return path
+
+    def link_shared(self, objects, output, libraries=(), linker=None):
+        linker = linker or os.environ.get("CC") or "cc"
+        if shutil.which(linker) is None:
+            raise Exception(f"Linker not found: {linker}")
+        command = [linker, "-shared", "-o", output, *objects, *(f"-l{library}" for library in libraries)]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode:
+            raise Exception(f"Linking {output} failed:\n{result.stderr}")
+        return output
+
+    def build_shared(self, modules, output, libraries=(), linker=None):
+        with tempfile.TemporaryDirectory() as directory:
+            objects = [self.write_object(module, os.path.join(directory, f"module{index}.o"))
+                       for index, module in enumerate(modules)]
+            return self.link_shared(objects, output, libraries, linker)
@@ -0,0 +1,170 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+
+import llvmlite
+import ply
+
+from Parser.tables import cache_dir
+
+PACKAGES = ("Parser", "Semantic", "Compiler")
+
+
+@lru_cache(maxsize=None)
+def compiler_version():
+    # Any change to the compiler's own sources or to the libraries it
+    # generates code with invalidates every cached artifact.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digest = hashlib.sha256(f"ply={ply.__version__};llvmlite={llvmlite.__version__};".encode())
+    for package in PACKAGES:
+        for directory, subdirectories, files in os.walk(os.path.join(root, package)):
+            subdirectories[:] = sorted(name for name in subdirectories if name != "__pycache__")
+            for name in sorted(files):
+                if name.endswith(".py"):
+                    path = os.path.join(directory, name)
+                    digest.update(os.path.relpath(path, root).encode())
+                    with open(path, "rb") as file:
+                        digest.update(hashlib.sha256(file.read()).digest())
+    return digest.hexdigest()
+
+
+class CompilationCache:
+    # Entries are unpickled, so only the user running the compiler may
+    # write to the cache directory.
+    def __init__(self, directory=None, max_size=512 * 2**20):
+        self.directory = directory or os.path.join(cache_dir(), "build")
+        self.max_size = max_size
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        stat = os.stat(self.directory)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            raise Exception(f"Cache directory {self.directory} is writable by other users")
+
+    def key(self, source, **options):
+        if isinstance(source, str):
+            source = source.encode()
+        digest = hashlib.sha256(compiler_version().encode())
+        for name in sorted(options):
+            digest.update(f"{name}={options[name]!r};".encode())
+        digest.update(hashlib.sha256(source).digest())
+        return digest.hexdigest()
+
+    def path(self, key, kind):
+        return os.path.join(self.directory, key[:2], f"{key}.{kind}")
+
+    def get(self, key, kind):
+        path = self.path(key, kind)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        # The modification time doubles as the last use for LRU eviction.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def put(self, key, kind, data):
+        path = self.path(key, kind)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # Entries are written under a temporary name and renamed into place,
+        # so readers in other processes only ever see complete files.
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(data)
+            with self.lock():
+                # The total size lives in a counter file shared by every
+                # process, so the bound holds for the cache as a whole and
+                # no write has to scan the directory unless the counter says
+                # the cache is full. Replacing an entry only adds the
+                # difference in size.
+                total = self.total()
+                try:
+                    total -= os.stat(path).st_size
+                except FileNotFoundError:
+                    pass
+                os.replace(temporary, path)
+                total += len(data)
+                if total > self.max_size:
+                    total, _ = self._evict()
+                self.store_total(total)
+        finally:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+        return path
+
+    def entries(self):
+        for directory, _, files in os.walk(self.directory):
+            for name in files:
+                if name in ("lock", "size") or name.endswith(".tmp"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    @contextmanager
+    def lock(self):
+        with open(os.path.join(self.directory, "lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def total(self):
+        # Called under the lock.
+        try:
+            with open(os.path.join(self.directory, "size")) as file:
+                return int(file.read())
+        except (FileNotFoundError, ValueError):
+            return self.size()
+
+    def store_total(self, total):
+        with open(os.path.join(self.directory, "size"), "w") as file:
+            file.write(str(total))
+
+    def _evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        # Evicting down to a low-water mark leaves room for a run of writes
+        # before the next scan.
+        target = self.max_size * 3 // 4
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return total, removed
+
+    def evict(self):
+        # Evicts the least recently used entries down to the low-water mark
+        # and returns how many were removed.
+        with self.lock():
+            total, removed = self._evict()
+            self.store_total(total)
+        return removed
+
+    def clear(self):
+        with self.lock():
+            for _, _, path in list(self.entries()):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            self.store_total(0)
@@ -0,0 +1,173 @@
+import ctypes
+import ctypes.util
+import hashlib
+from functools import lru_cache
+
+import llvmlite.binding as llvm
+
+from . import runtime
+from .optimizer import Optimizer
+from .target import create_target_machine
+
+INTEGER_TYPES = {
+    1: ctypes.c_bool,
+    8: ctypes.c_int8,
+    16: ctypes.c_int16,
+    32: ctypes.c_int32,
+    64: ctypes.c_int64,
+}
+
+
+def ctype(type_ref):
+    kind = type_ref.type_kind
+    if kind == llvm.TypeKind.void:
+        return None
+    if kind == llvm.TypeKind.integer:
+        return INTEGER_TYPES[type_ref.type_width]
+    if kind == llvm.TypeKind.float:
+        return ctypes.c_float
+    if kind == llvm.TypeKind.double:
+        return ctypes.c_double
+    if kind == llvm.TypeKind.pointer:
+        return ctypes.c_void_p
+    raise TypeError(f"Unsupported type for a JIT entry point: {type_ref}")
+
+
+# Functions called from Python go through a guard with this suffix when
+# their module raises.
+GUARDED = ".guarded"
+
+
+def guards(module):
+    # An exception that nothing catches would unwind into Python, which
+    # the C++ runtime answers by terminating the process. Each guard calls
+    # its function and, if an exception reaches it, stores the name of its
+    # type through the extra last parameter instead.
+    lines = [f"declare i32 @{runtime.PERSONALITY}(...)", "declare ptr @__cxa_begin_catch(ptr)",
+             "declare void @__cxa_end_catch()", "declare ptr @__cxa_current_exception_type()"]
+    for function in module.functions:
+        if function.is_declaration or function.linkage != llvm.Linkage.external:
+            continue
+        function_type = function.global_value_type
+        rtype = str(function_type.get_function_return())
+        params = [str(param) for param in function_type.get_function_parameters()]
+        args = ", ".join(f"{param} %{index}" for index, param in enumerate(params))
+        call = f'invoke {rtype} @"{function.name}"({args}) to label %done unwind label %caught'
+        done, caught = ("ret void", "ret void") if rtype == "void" else \
+            (f"ret {rtype} %result", f"ret {rtype} zeroinitializer")
+        lines += [
+            f'declare {rtype} @"{function.name}"({", ".join(params)})',
+            f'define {rtype} @"{function.name}{GUARDED}"({", ".join(params + ["ptr"])} %raised) '
+            f"personality ptr @{runtime.PERSONALITY} {{",
+            "entry:",
+            f"  {call}" if rtype == "void" else f"  %result = {call}",
+            "done:",
+            f"  {done}",
+            "caught:",
+            "  %pad = landingpad {ptr, i32} catch ptr null",
+            "  %exception = extractvalue {ptr, i32} %pad, 0",
+            "  call ptr @__cxa_begin_catch(ptr %exception)",
+            "  %type = call ptr @__cxa_current_exception_type()",
+            "  %field = getelementptr ptr, ptr %type, i64 1",
+            "  %name = load ptr, ptr %field",
+            "  store ptr %name, ptr %raised",
+            "  call void @__cxa_end_catch()",
+            f"  {caught}",
+            "}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+@lru_cache(maxsize=None)
+def load_library(name):
+    path = ctypes.util.find_library(name)
+    if path is None:
+        raise Exception(f"Library not found: {name}")
+    llvm.load_library_permanently(path)
+
+
+class CompiledModule:
+    # One execution engine per module, so two snippets that both define
+    # main never resolve to each other's symbols.
+    def __init__(self, module, level):
+        self.module = module
+        if runtime.uses_exceptions(module):
+            load_library(runtime.EXCEPTION_LIBRARY)
+        self.engine = llvm.create_mcjit_compiler(module, create_target_machine(level, jit=True))
+        self.engine.finalize_object()
+        self.engine.run_static_constructors()
+        self.functions = {}
+        self.guarded = {function.name for function in module.functions if function.name.endswith(GUARDED)}
+
+    def function(self, name):
+        function = self.functions.get(name)
+        if function is None:
+            value = self.module.get_function(name)
+            function_type = value.global_value_type
+            restype = ctype(function_type.get_function_return())
+            argtypes = list(map(ctype, function_type.get_function_parameters()))
+            if name + GUARDED in self.guarded:
+                function = self._guarded(name, restype, argtypes)
+            else:
+                function = ctypes.CFUNCTYPE(restype, *argtypes)(self.engine.get_function_address(name))
+            # The code lives as long as the engine, so every entry point
+            # keeps its module alive.
+            function.owner = self
+            self.functions[name] = function
+        return function
+
+    def _guarded(self, name, restype, argtypes):
+        guard = ctypes.CFUNCTYPE(restype, *argtypes, ctypes.c_void_p)(
+            self.engine.get_function_address(name + GUARDED))
+
+        def function(*args):
+            raised = ctypes.c_char_p()
+            result = guard(*args, ctypes.byref(raised))
+            if raised.value is not None:
+                type_name = raised.value.decode().removeprefix("O.")
+                raise Exception(f"Uncaught exception: {type_name}")
+            return result
+        function.argtypes = tuple(argtypes)
+        function.restype = restype
+        return function
+
+    def __getitem__(self, name):
+        return self.function(name)
+
+    def __call__(self, *args, entry="main"):
+        return self.function(entry)(*args)
+
+
+class JIT:
+    # Compiled modules are kept for the most recent distinct modules only;
+    # entry points handed out keep their own module alive past eviction.
+    def __init__(self, level=2, capacity=64):
+        self.optimizer = Optimizer(level)
+        self.capacity = capacity
+        self.modules = {}
+
+    def compile(self, module):
+        ir_text = str(module)
+        key = hashlib.sha256(ir_text.encode()).digest()
+        compiled = self.modules.pop(key, None)
+        if compiled is not None:
+            self.modules[key] = compiled
+        else:
+            module = llvm.parse_assembly(ir_text)
+            module.verify()
+            module.triple = self.optimizer.target_machine.triple
+            module.data_layout = str(self.optimizer.target_machine.target_data)
+            self.optimizer.run(module)
+            if runtime.uses_exceptions(module):
+                module.link_in(llvm.parse_assembly(guards(module)))
+            compiled = self.modules[key] = CompiledModule(module, self.optimizer.level)
+            while len(self.modules) > self.capacity:
+                del self.modules[next(iter(self.modules))]
+        return compiled
+
+    def function(self, module, name="main"):
+        return self.compile(module).function(name)
+
+    def run(self, module, *args, entry="main"):
+        return self.compile(module).function(entry)(*args)
+
@@ -0,0 +1,242 @@
+import argparse
+import os
+import pickle
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import llvmlite.binding as llvm
+
+from Parser.lexer import Lexer
+from Parser.parser import ensure_newline_at_end, parser_function, syntax_errors
+from Semantic.analyzer import SemanticAnalyzer
+from Semantic.folder import ConstantFolder
+
+from . import runtime
+from .assembler import Assembler
+from .cache import CompilationCache
+from .ir_generator import IRGenerator
+from .optimizer import Optimizer
+
+# Distinct from the ".o" of native objects, which the driver may write
+# next to its sources.
+SUFFIX = ".ol"
+PRIMITIVE_TYPES = {"int", "double", "bool", "str"}
+
+# Includes are found with a scan of the raw text, so the dependency graph
+# is known before any module is parsed and every parse can run in parallel.
+_include = re.compile(r'^[ \t]*include[ \t]+("[^"\n]*"(?:[ \t]*\.[ \t]*"[^"\n]*")*)', re.M)
+_part = re.compile(r'"([^"\n]*)"')
+
+
+def includes(text):
+    return [_part.findall(match.group(1)) for match in _include.finditer(text)]
+
+
+def resolve(parts, directory, search_paths=()):
+    relative = os.path.join(*parts) + SUFFIX
+    for base in (directory, *search_paths):
+        path = os.path.join(base, relative)
+        if os.path.isfile(path):
+            return os.path.abspath(path)
+    raise Exception(f"Cannot find module '{'.'.join(parts)}'")
+
+
+def dependency_graph(paths, search_paths=()):
+    graph = {}
+    pending = [os.path.abspath(path) for path in paths]
+    while pending:
+        path = pending.pop()
+        if path in graph:
+            continue
+        with open(path) as file:
+            text = file.read()
+        directory = os.path.dirname(path)
+        try:
+            graph[path] = [resolve(parts, directory, search_paths) for parts in includes(text)]
+        except Exception as error:
+            raise Exception(f"{path}: {error}") from None
+        pending.extend(graph[path])
+    return graph
+
+
+def interface(tree):
+    # Top-level functions with primitive signatures are what other modules
+    # can call; everything else stays private to its module.
+    functions = []
+    for node in tree.body:
+        if node.tag == "fun_def" and node.rtype in PRIMITIVE_TYPES \
+                and all(param[0] in PRIMITIVE_TYPES for param in node.params):
+            functions.append((node.name, node.rtype, tuple(param[0] for param in node.params)))
+    return functions
+
+
+def open_cache(directory):
+    return CompilationCache(directory) if directory else None
+
+
+def parse_module(path, cache_directory=None):
+    with open(path, "rb") as file:
+        source = file.read()
+    cache = open_cache(cache_directory)
+    if cache is not None:
+        key = cache.key(source, phase="parse")
+        data = cache.get(key, "ast")
+        if data is not None:
+            return path, data, pickle.loads(data)[1]
+    lexer = Lexer()
+    tree = parser_function(ensure_newline_at_end(source.decode()), lexer=lexer)
+    errors = syntax_errors(tree, lexer)
+    if errors:
+        raise Exception(f"{path}: syntax error at line {errors[0][0]}")
+    functions = interface(tree)
+    data = pickle.dumps((tree, functions), pickle.HIGHEST_PROTOCOL)
+    if cache is not None:
+        cache.put(key, "ast", data)
+    return path, data, functions
+
+
+def analyze_module(path, data, externs, cache_directory=None):
+    # Calls are checked against the interfaces of the included modules, so
+    # the result depends on them as much as on the module's own source.
+    cache = open_cache(cache_directory)
+    if cache is not None:
+        key = cache.key(data, phase="analyze", externs=externs)
+        analyzed = cache.get(key, "ast")
+        if analyzed is not None:
+            return path, analyzed
+    tree, functions = pickle.loads(data)
+    try:
+        SemanticAnalyzer(externs).analyze(tree)
+    except Exception as error:
+        raise Exception(f"{path}: {error}") from None
+    data = pickle.dumps((tree, functions), pickle.HIGHEST_PROTOCOL)
+    if cache is not None:
+        cache.put(key, "ast", data)
+    return path, data
+
+
+def lower_module(path, data, externs, level, cache_directory=None):
+    cache = open_cache(cache_directory)
+    if cache is not None:
+        key = cache.key(data, phase="lower", externs=externs, level=level)
+        ir_text = cache.get(key, "ll")
+        if ir_text is not None:
+            return path, ir_text.decode()
+    tree, functions = pickle.loads(data)
+    generator = IRGenerator()
+    defined = {function[0] for function in functions}
+    for name, rtype, param_types in externs:
+        if name not in defined and name not in generator.module.globals:
+            generator.declare(name, rtype, param_types)
+    generator.generate(ConstantFolder().fold(tree) if level else tree)
+    for function in generator.module.functions:
+        # What the module does not export cannot clash with the private
+        # functions of other modules when they are linked.
+        if not function.is_declaration and not function.linkage and function.name not in defined:
+            function.linkage = "internal"
+    ir_text = str(generator.module)
+    if level:
+        ir_text = Optimizer(level).optimize(ir_text)
+    if cache is not None:
+        cache.put(key, "ll", ir_text.encode())
+    return path, ir_text
+
+
+class Driver:
+    def __init__(self, level=2, jobs=None, search_paths=(), cache_directory=None, lto=False):
+        self.level = level
+        self.jobs = jobs or os.cpu_count() or 1
+        self.search_paths = [os.path.abspath(path) for path in search_paths]
+        self.cache_directory = cache_directory
+        self.lto = lto
+        self.graph = {}
+        self.interfaces = {}
+
+    def map(self, executor, function, *iterables):
+        if executor is None:
+            return map(function, *iterables)
+        size = len(iterables[0])
+        return executor.map(function, *iterables,
+                            chunksize=max(1, size // (self.jobs * 4)))
+
+    def compile(self, paths):
+        self.graph = dependency_graph(paths, self.search_paths)
+        modules = sorted(self.graph)
+        count = len(modules)
+        executor = ProcessPoolExecutor(self.jobs) if self.jobs > 1 and count > 1 else None
+        try:
+            # Analyzing and lowering a module only need the signatures of
+            # the modules it includes, which parsing alone gives, so every
+            # phase runs over all modules at once rather than level by level
+            # of the graph.
+            parsed = {}
+            for path, data, functions in self.map(executor, parse_module, modules,
+                                                  [self.cache_directory] * count):
+                parsed[path] = data
+                self.interfaces[path] = functions
+            externs = [tuple(extern for dependency in self.graph[path]
+                             for extern in self.interfaces[dependency])
+                       for path in modules]
+            analyzed = dict(self.map(executor, analyze_module, modules,
+                                     [parsed[path] for path in modules], externs,
+                                     [self.cache_directory] * count))
+            lowered = dict(self.map(executor, lower_module, modules,
+                                    [analyzed[path] for path in modules], externs,
+                                    [self.level] * count, [self.cache_directory] * count))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return self.link([lowered[path] for path in modules])
+
+    def link(self, ir_texts):
+        linked = None
+        for ir_text in ir_texts:
+            module = llvm.parse_assembly(ir_text)
+            if linked is None:
+                linked = module
+            else:
+                linked.link_in(module)
+        linked.verify()
+        if self.lto and self.level:
+            Optimizer(self.level).run(linked)
+        return linked
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(prog="o", description="Compile O modules")
+    argparser.add_argument("sources", nargs="+")
+    argparser.add_argument("-o", "--output")
+    argparser.add_argument("-O", dest="level", default="2", choices=["0", "1", "2", "3"])
+    argparser.add_argument("-j", "--jobs", type=int)
+    argparser.add_argument("-I", dest="search_paths", action="append", default=[])
+    argparser.add_argument("--emit", default="ir", choices=["ir", "asm", "obj", "shared"])
+    argparser.add_argument("--lto", action="store_true",
+                           help="optimize the linked program as a whole")
+    argparser.add_argument("--cache-dir", help="reuse analyzed and lowered modules")
+    args = argparser.parse_args(argv)
+
+    driver = Driver(int(args.level), args.jobs, args.search_paths, args.cache_dir, args.lto)
+    try:
+        module = driver.compile(args.sources)
+    except Exception as error:
+        print(error, file=sys.stderr)
+        return 1
+    output = args.output or os.path.splitext(args.sources[0])[0] + {
+        "ir": ".ll", "asm": ".s", "obj": ".o", "shared": ".so"}[args.emit]
+    assembler = Assembler(level=driver.level) if args.emit != "ir" else None
+    if args.emit == "ir":
+        with open(output, "w") as file:
+            file.write(str(module))
+    elif args.emit == "asm":
+        assembler.write_assembly(module, output)
+    elif args.emit == "obj":
+        assembler.write_object(module, output)
+    else:
+        libraries = [runtime.EXCEPTION_LIBRARY] if runtime.uses_exceptions(module) else []
+        assembler.build_shared([module], output, libraries)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
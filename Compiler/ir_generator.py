@@ -1,39 +1,94 @@
+import re
+
 import llvmlite.ir as ir
 from llvmlite.binding import get_default_triple
 
+from Parser.nodes import dispatch_table, identity, is_node, object_entries
+from Semantic import types
+from Semantic.escape import EscapeAnalyzer
+from Semantic.folder import PLACEHOLDER
+
+from . import runtime, switch
+from .runtime import Runtime
 from .scope import ScopeStack
 
+INT_OPS = {'+': 'add', '-': 'sub', '*': 'mul', '/': 'sdiv', '%': 'srem'}
+FLOAT_OPS = {'+': 'fadd', '-': 'fsub', '*': 'fmul', '/': 'fdiv', '%': 'frem'}
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '0': '\0'}
+CONSTANTS = {'integer', 'double', 'boolean', 'string'}
+# Lookup tables with holes mark their cases in a mask of this many bits.
+MASK_BITS = 64
+_escape = re.compile(r"\\(.)")
+
+
+def unescape(text):
+    # String literals keep their escapes until they are lowered.
+    return _escape.sub(lambda match: ESCAPES.get(match.group(1), match.group(1)), text)
+
 
 class IRGenerator:
     def __init__(self):
-        self.module: ir.Module = ir.Module(name="module")
+        # Class types are named per module, so modules may define the same
+        # class independently.
+        self.module: ir.Module = ir.Module(name="module", context=ir.Context())
         self.module.triple = get_default_triple()
         self.builder: ir.IRBuilder = None
         self.func: ir.Function = None
-        self.current_instance: ir.AllocaInstr = None
-        self.switch_block: ir.SwitchInstr = None
+        self.current_instance: ir.Value = None
+        self.loops = []
+        self.handlers = []
+        self.coroutine = None
+        self.coroutines = {}
+        self.runtime = Runtime(self.module)
         self.scope = ScopeStack()
         self.classes = {}
+        self.strings = {}
+        self.stack_allocated = set()
+        self.owned_arrays = set()
+        # The allocas of the arrays each function owns.
+        self.owned = {}
+        self.dispatch = dispatch_table(self, "visit_", self.generic_visit)
 
     def generate(self, ast):
+        escapes = EscapeAnalyzer()
+        self.stack_allocated = escapes.analyze(ast)
+        self.owned_arrays = escapes.owned
         self.visit(ast)
+        self._at_exit()
         return str(self.module)
 
+    def declare(self, name, rtype, param_types):
+        func_type = ir.FunctionType(self._get_ir_type(rtype),
+                                    [self._get_ir_type(param_type) for param_type in param_types])
+        return ir.Function(self.module, func_type, name=name)
+
     def visit(self, node):
-        method_name = f"visit_{node[0]}"
-        method = getattr(self, method_name, self.generic_visit)
+        method = self.dispatch.get(node.__class__)
+        if method is None:
+            if isinstance(node, list):
+                method = self.generic_visit
+            else:
+                method = self.dispatch.get(node[0], self.generic_visit)
         return method(node)
 
     def generic_visit(self, node):
         for child in node if isinstance(node, list) else node[1]:
-            if isinstance(child, tuple):
+            if is_node(child):
                 self.visit(child)
 
     def visit_var_def(self, node):
         var_type, var_name, value = node[1:]
         initial_value = self.visit(value)
+        initial_value = self._convert(initial_value, self._type_of(value), var_type)
         ir_type = self._get_ir_type(var_type)
-        ptr = self.builder.alloca(ir_type, name=var_name)
+        ptr = self._alloca(ir_type, var_name)
+        if identity(node) in self.owned_arrays:
+            # The array held from the last time this definition ran, in a
+            # loop, is freed before the new one replaces it.
+            with self.builder.goto_entry_block():
+                self.builder.store(ir.Constant(ir_type, None), ptr)
+            self.owned.setdefault(self.builder.function, []).append(ptr)
+            self.runtime.free_array(self.builder, self.builder.load(ptr))
         self.builder.store(initial_value, ptr=ptr)
         self.scope.define(var_name, ptr)
 
@@ -42,12 +97,12 @@ class IRGenerator:
         param_types = [self._get_ir_type(param[0]) for param in params]
         return_type_ir = self._get_ir_type(rtype)
         func_type = ir.FunctionType(return_type_ir, param_types)
-        self.func = ir.Function(self.module, func_type, name=name)
+        self.func = function = ir.Function(self.module, func_type, name=name)
         block = self.func.append_basic_block(name='entry')
         self.builder = ir.IRBuilder(block)
         self.scope.enter()
         for idx, (param_type, param_name) in enumerate(params):
-            ptr = self.builder.alloca(self._get_ir_type(param_type), param_name)
+            ptr = self.builder.alloca(self._get_ir_type(param_type), name=param_name)
             self.builder.store(self.func.args[idx], ptr)
             self.scope.define(param_name, ptr)
         self.visit(body)
@@ -57,19 +112,67 @@ class IRGenerator:
                 self.builder.ret_void()
             else:
                 self.builder.ret(self._get_default_value(return_type_ir))
+        self._release(function)
+
+    def visit_async(self, node):
+        # An async function returns the handle of its coroutine, suspended
+        # before its body runs, to whoever starts or awaits it.
+        _, rtype, name, params, body = node[1][1:]
+        param_types = [self._get_ir_type(param[0]) for param in params]
+        self.func = ir.Function(self.module, ir.FunctionType(runtime.BYTE_PTR, param_types), name=name)
+        self.builder = ir.IRBuilder(self.func.append_basic_block(name='entry'))
+        result_type = None if rtype == 'void' else self._get_ir_type(rtype)
+        promise_type = self.coroutines[name] = runtime.promise_type(result_type)
+        promise = self.builder.alloca(promise_type, name="promise")
+        self.coroutine = self.runtime.coroutine(self.builder, promise)
+        self.scope.enter()
+        for idx, (param_type, param_name) in enumerate(params):
+            ptr = self._alloca(self._get_ir_type(param_type), param_name)
+            self.builder.store(self.func.args[idx], ptr)
+            self.scope.define(param_name, ptr)
+        self.runtime.suspend(self.builder, self.coroutine)
+        self.visit(body)
+        self.scope.leave()
+        if not self.builder.block.is_terminated:
+            self.builder.branch(self.coroutine.final)
+        # Every return of a coroutine goes through its final block.
+        self.builder.position_at_end(self.coroutine.final)
+        self._free_owned(self.owned.pop(self.func, ()))
+        self.runtime.finish(self.builder, self.coroutine)
+        self.coroutine = None
+
+    def visit_await(self, node):
+        _, call = node
+        func_name, args = call[1:]
+        if self.coroutine is None:
+            raise Exception("'await' outside of an async function")
+        if func_name == 'sleep' or func_name in runtime.EVENTS:
+            value = self.visit(args[0])
+            value = self._convert(value, self._type_of(args[0]), types.INT)
+            if func_name == 'sleep':
+                self.runtime.sleep(self.builder, self.coroutine, value)
+            else:
+                self.runtime.wait(self.builder, self.coroutine, value, func_name)
+            return None
+        promise_type = self.coroutines.get(func_name)
+        if promise_type is None:
+            raise Exception(f"Cannot await {func_name}")
+        func = self.module.globals[func_name]
+        task = self._call(func, self._arguments(func, args), name=f"{func_name}_task")
+        return self.runtime.await_task(self.builder, self.coroutine, task, promise_type)
 
     def visit_class_def(self, node):
         modifiers, name, base_class, body = node[1:]
-        class_type = ir.global_context.get_identified_type(name)
-        fields = [(field[2], self._get_ir_type(field[1])) for field in body if field[0] == 'var_def']
-        class_type.set_body(*[field[1] for field in fields])
+        class_type = self.module.context.get_identified_type(name)
+        fields = [field for field in body if field[0] == 'var_def']
+        class_type.set_body(*[self._get_ir_type(field[1]) for field in fields])
         self.classes[name] = {
             "type": class_type,
-            "fields": {field[0]: idx for idx, field in enumerate(fields)}
+            "fields": {field[2]: idx for idx, field in enumerate(fields)}
         }
-        for item in body:
-            if item[0] == 'class_ctor_def':
-                self._generate_constructor(name, class_type, item)
+        ctors = [item for item in body if item[0] == 'class_ctor_def']
+        for ctor_def in ctors or [('class_ctor_def', name, [], [])]:
+            self._generate_constructor(name, class_type, fields, ctor_def)
         for item in body:
             if item[0] == 'fun_def':
                 self._generate_method(name, class_type, item)
@@ -87,39 +190,68 @@ class IRGenerator:
             if not var_alloca:
                 raise Exception(f"Undefined variable: {var_name}")
             expr_value = self.visit(expr)
+            var_type = self._type_name(var_alloca.type.pointee)
             if op == "=":
+                expr_value = self._convert(expr_value, self._type_of(expr), var_type)
+                if var_alloca in self.owned.get(self.builder.function, ()):
+                    self.runtime.free_array(self.builder, self.builder.load(var_alloca))
                 self.builder.store(expr_value, var_alloca)
             else:
                 current_value = self.builder.load(var_alloca, var_name)
-                op_name = self._get_op_method(op[:-1])
-                method = getattr(self.builder, op_name)
-                if method:
-                    result = method(current_value, expr_value, f"{var_name}_{op_name}")
-                    self.builder.store(result, var_alloca)
+                result = self._arithmetic(op[:-1], current_value, var_type, expr_value,
+                                          self._type_of(expr), var_type, var_name)
+                self.builder.store(result, var_alloca)
 
     def visit_fun_call(self, node):
         func_name, args = node[1:]
+        if func_name in self.classes:
+            return self._construct(node)
         if self.current_instance:
             class_name = self.current_instance.type.pointee.name
-            func = self.module.get_global(f"{class_name}_{func_name}")
-            if not func:
-                raise Exception(f"Undefined method: {func_name} in class {class_name}")
-            arg_values = [self.visit(arg) for arg in args]
-            return self.builder.call(func, [self.current_instance] + arg_values, name=f"{func_name}_call")
-        else:
-            func = self.module.get_global(func_name)
-            if not func or not isinstance(func, ir.Function):
-                raise Exception(f"Undefined function: {func_name}")
-            arg_values = [self.visit(arg) for arg in args]
-            return self.builder.call(func, arg_values, name=f"{func_name}_call")
+            func = self.module.globals.get(f"{class_name}_{func_name}")
+            if func is not None:
+                arg_values = self._arguments(func, args, 1)
+                return self._call(func, [self.current_instance] + arg_values, name=f"{func_name}_call")
+        func = self.module.globals.get(func_name)
+        if func is None and func_name == 'push':
+            return self._push(*args)
+        if func is None and func_name == 'put':
+            return self._put(*args)
+        if not func or not isinstance(func, ir.Function):
+            raise Exception(f"Undefined function: {func_name}")
+        arg_values = self._arguments(func, args)
+        if func_name in self.coroutines:
+            self.runtime.spawn(self.builder, self._call(func, arg_values, name=f"{func_name}_task"))
+            return None
+        return self._call(func, arg_values, name=f"{func_name}_call")
 
     def visit_when_stmts(self, node):
-        stmts = node[1]
-        self.visit(stmts)
+        # The cases form a chain: the first one whose condition holds runs,
+        # and otherwise runs when none of them does.
+        cases = node[1] if len(node) == 2 and isinstance(node[1], list) else node[1:]
+        end_block = self.builder.append_basic_block(name="when_end")
+        for case in cases:
+            if case[0] == 'otherwise':
+                self.visit(case)
+                break
+            cond, stmts = case[1:]
+            value = self.visit(cond)
+            then_block = self.builder.append_basic_block(name="when")
+            next_block = self.builder.append_basic_block(name="when_next")
+            self.builder.cbranch(self._truth(value, self._type_of(cond)), then_block, next_block)
+            self.builder.position_at_end(then_block)
+            self.visit(stmts)
+            if not self.builder.block.is_terminated:
+                self.builder.branch(end_block)
+            self.builder.position_at_end(next_block)
+        if not self.builder.block.is_terminated:
+            self.builder.branch(end_block)
+        self.builder.position_at_end(end_block)
 
     def visit_when(self, node):
         cond, stmts = node[1:]
-        cond = self.visit(cond)
+        value = self.visit(cond)
+        cond = self._truth(value, self._type_of(cond))
         with self.builder.if_then(cond):
             self.visit(stmts)
 
@@ -130,81 +262,302 @@ class IRGenerator:
     def visit_for_stmt(self, node):
         var, iterable, stmts = node[1:]
         var_type, var_name = var
-        var_type = self._get_ir_type(var_type)
-        array = self.visit(iterable)
-        array_alloc = self.builder.alloca(array.type)
-        self.builder.store(array, array_alloc)
-        loop_var = self.builder.alloca(var_type, name=var_name)
-        loop_block = self.builder.append_basic_block(name="loop")
-        after_loop_block = self.builder.append_basic_block(name="after_loop")
-        self.builder.branch(loop_block)
-        self.builder.position_at_start(loop_block)
-        self.scope.enter()
-        self.scope.define(var_name, loop_var)
-        index_ptr = self.builder.alloca(ir.IntType(32), name="index")
-        self.builder.store(ir.Constant(ir.IntType(32), 0), index_ptr)
-        index = self.builder.load(index_ptr, "index")
-        element_ptr = self.builder.gep(array_alloc, [ir.Constant(ir.IntType(32), 0), index])
-        element = self.builder.load(element_ptr, "element")
-        self.builder.store(element, loop_var)
-        for stmt in stmts:
-            self.visit(stmt)
-        next_index = self.builder.add(index, ir.Constant(ir.IntType(32), 1), name="next_index")
-        self.builder.store(next_index, index_ptr)
-        end_cond = self.builder.icmp_signed("<", next_index, ir.Constant(ir.IntType(32), array.type.count))
-        self.builder.cbranch(end_cond, loop_block, after_loop_block)
-        self.builder.position_at_start(after_loop_block)
-        self.scope.leave()
+        loop_var = self._alloca(self._get_ir_type(var_type), var_name)
+
+        def body(element, element_type):
+            self.builder.store(self._convert(element, element_type, var_type), loop_var)
+            self.scope.enter()
+            self.scope.define(var_name, loop_var)
+            self.visit(stmts)
+            self.scope.leave()
+
+        self._iterate(iterable, body)
+
+    def visit_pass(self, node):
+        pass
+
+    def visit_skip(self, node):
+        if not self.loops:
+            raise Exception("'skip' outside of a loop")
+        self.builder.branch(self.loops[-1][0])
+        self.builder.position_at_end(self.builder.append_basic_block(name="after_skip"))
+
+    def visit_escape(self, node):
+        if not self.loops:
+            raise Exception("'escape' outside of a loop")
+        self.builder.branch(self.loops[-1][1])
+        self.builder.position_at_end(self.builder.append_basic_block(name="after_escape"))
 
     def visit_switch_stmt(self, node):
+        # Cases are sorted and dispatched on through a search tree, with
+        # dense runs of cases as jump tables, or as lookup tables when every
+        # case returns a constant. A value no case matches, like a case that
+        # ends, continues after the switch.
         expr, cases = node[1:]
-        expr_value = self.visit(expr)
-        default_block = self.builder.append_basic_block(name="switch_default")
-        self.switch_block = self.builder.switch(expr_value, default_block)
-        self.scope.enter()
+        value = self.visit(expr)
+        if not isinstance(value.type, ir.IntType):
+            raise Exception(f"Cannot switch on {value.type}")
+        labels = {}
+        for index, case in enumerate(cases):
+            label = self.visit(case[1])
+            if not isinstance(label, ir.Constant) or not isinstance(label.type, ir.IntType):
+                raise Exception("Case values must be integer constants")
+            if int(label.constant) in labels:
+                raise Exception(f"Duplicate case {int(label.constant)}")
+            labels[int(label.constant)] = index
+        values = {index: case_value for case_value, index in labels.items()}
+        end_block = self.builder.append_basic_block(name="switch_end")
+        blocks = {}
+
+        def target(index):
+            if index not in blocks:
+                blocks[index] = self.builder.append_basic_block(name=f"case_{values[index]}")
+            return blocks[index]
+
+        self._dispatch(value, switch.plan(labels.items()), target, end_block, self._case_results(cases))
+        for index, case in enumerate(cases):
+            if index in blocks:
+                self.builder.position_at_end(blocks[index])
+                self.scope.enter()
+                self.visit(case[2])
+                self.scope.leave()
+                if not self.builder.block.is_terminated:
+                    self.builder.branch(end_block)
+        self.builder.position_at_end(end_block)
+
+    def _dispatch(self, value, tree, target, default, results):
+        if isinstance(tree, switch.Branch):
+            below = self.builder.append_basic_block(name="switch_below")
+            above = self.builder.append_basic_block(name="switch_above")
+            pivot = ir.Constant(value.type, tree.pivot)
+            self.builder.cbranch(self.builder.icmp_signed("<", value, pivot), below, above)
+            self.builder.position_at_end(below)
+            self._dispatch(value, tree.left, target, default, results)
+            self.builder.position_at_end(above)
+            self._dispatch(value, tree.right, target, default, results)
+        elif isinstance(tree, switch.Table):
+            if results is not None and self._lookup(value, tree, results, default):
+                return
+            # LLVM lowers a switch this dense to a jump table.
+            instruction = self.builder.switch(value, default)
+            for case_value, index in tree.cases:
+                instruction.add_case(ir.Constant(value.type, case_value), target(index))
+        elif not tree.cases:
+            self.builder.branch(default)
+        else:
+            *first, last = tree.cases
+            for case_value, index in first:
+                next_block = self.builder.append_basic_block(name="switch_next")
+                matches = self.builder.icmp_signed("==", value, ir.Constant(value.type, case_value))
+                self.builder.cbranch(matches, target(index), next_block)
+                self.builder.position_at_end(next_block)
+            matches = self.builder.icmp_signed("==", value, ir.Constant(value.type, last[0]))
+            self.builder.cbranch(matches, target(last[1]), default)
+
+    def _case_results(self, cases):
+        # The constants the cases return, when that is all they do.
+        if self.coroutine is not None:
+            return None
+        return_type = self.builder.function.function_type.return_type
+        results = []
         for case in cases:
-            self.visit(case)
-        self.scope.leave()
-        self.builder.position_at_end(default_block)
-
-    def visit_case(self, node):
-        value, stmts = node[1:]
-        case_value = self.visit(value)
-        case_block = self.builder.append_basic_block(name=f"case_{case_value.constant}")
-        self.switch_block.add_case(case_value, case_block)
-        self.builder.position_at_end(case_block)
-        self.scope.enter()
-        for stmt in stmts:
-            self.visit(stmt)
-        self.scope.leave()
+            stmts = case[2]
+            if len(stmts) != 1 or stmts[0][0] != 'return' or not is_node(stmts[0][1]) \
+                    or stmts[0][1][0] not in CONSTANTS:
+                return None
+            result = self.visit(stmts[0][1])
+            if result.type != return_type:
+                return None
+            results.append(result)
+        return results
+
+    def _lookup(self, value, table, results, default):
+        # Values without a case in a table's range are holes, told apart
+        # by a mask; tables with holes too far apart for it stay jumps.
+        size = table.high - table.low + 1
+        entries = {case_value - table.low: results[index] for case_value, index in table.cases}
+        holes = len(entries) < size
+        if holes and size > MASK_BITS:
+            return False
+        element_type = results[0].type
+        array_type = ir.ArrayType(element_type, size)
+        variable = ir.GlobalVariable(self.module, array_type, name=self.module.get_unique_name("switch.table"))
+        variable.linkage = "private"
+        variable.global_constant = True
+        variable.unnamed_addr = True
+        variable.initializer = ir.Constant(array_type, [entries.get(offset, ir.Constant(element_type, None))
+                                                        for offset in range(size)])
+        offset = self.builder.sub(value, ir.Constant(value.type, table.low))
+        found = self.builder.icmp_unsigned("<=", offset, ir.Constant(value.type, size - 1))
+        if holes:
+            mask = sum(1 << offset for offset in entries)
+            bits = self.builder.lshr(ir.Constant(ir.IntType(MASK_BITS), mask),
+                                     self.builder.zext(offset, ir.IntType(MASK_BITS)))
+            marked = self.builder.trunc(bits, ir.IntType(1))
+            # The shift is poison out of range, which select does not pass on.
+            found = self.builder.select(found, marked, ir.Constant(ir.IntType(1), False))
+        lookup_block = self.builder.append_basic_block(name="switch_lookup")
+        self.builder.cbranch(found, lookup_block, default)
+        self.builder.position_at_end(lookup_block)
+        self.builder.ret(self.builder.load(self.builder.gep(variable, [ir.Constant(ir.IntType(32), 0), offset])))
+        return True
+
+    def visit_try(self, node):
+        body, handlers = node[1:]
+        # Calls in the body unwind to a landing pad that catches what its
+        # handlers and those of the trys around it in the function catch;
+        # a dispatch block then picks the handler by the matching clause.
+        # Entering and leaving the body costs nothing.
+        self.runtime.personality(self.builder.function)
+        exception_types = [None if name is None else self.runtime.exception_type(name)
+                           for _, name, _ in handlers]
+        outer = self.handlers[-1] if self.handlers else None
+        landing_block = self.builder.append_basic_block(name="landing")
+        dispatch_block = self.builder.append_basic_block(name="dispatch")
+        end_block = self.builder.append_basic_block(name="try_end")
+        clauses = exception_types + (outer[2] if outer else [])
+        incoming = []
+        self.handlers.append((landing_block, dispatch_block, clauses, incoming))
+        self.visit(body)
+        self.handlers.pop()
         if not self.builder.block.is_terminated:
-            self.builder.branch(self.switch_block)
+            self.builder.branch(end_block)
+        self.builder.position_at_end(landing_block)
+        pad = self.builder.landingpad(runtime.LANDING_PAD)
+        for clause in clauses:
+            # A null clause catches everything.
+            pad.add_clause(ir.CatchClause(ir.Constant(runtime.BYTE_PTR, None) if clause is None else clause))
+        incoming.append((pad, landing_block))
+        self.builder.branch(dispatch_block)
+        self.builder.position_at_end(dispatch_block)
+        exception = self.builder.phi(runtime.LANDING_PAD)
+        for value, block in incoming:
+            exception.add_incoming(value, block)
+        for (_, _, stmts), exception_type in zip(handlers, exception_types):
+            handler_block = self.builder.append_basic_block(name="except")
+            if exception_type is None:
+                self.builder.branch(handler_block)
+            else:
+                next_block = self.builder.append_basic_block(name="except_next")
+                self.builder.cbranch(self.runtime.selects(self.builder, exception, exception_type),
+                                     handler_block, next_block)
+            self.builder.position_at_end(handler_block)
+            self.runtime.catch(self.builder, exception)
+            self.visit(stmts)
+            if not self.builder.block.is_terminated:
+                self.builder.branch(end_block)
+            if exception_type is None:
+                break
+            self.builder.position_at_end(next_block)
+        else:
+            # Nothing here handles it: it goes on to the enclosing try or
+            # out to the caller.
+            if outer:
+                outer[3].append((exception, self.builder.block))
+                self.builder.branch(outer[1])
+            else:
+                self.builder.resume(exception)
+        self.builder.position_at_end(end_block)
+
+    def visit_raise(self, node):
+        self._call(self.runtime.function("o_raise"), [self.runtime.exception_type(node[1])])
+        self.builder.unreachable()
+        self.builder.position_at_end(self.builder.append_basic_block(name="after_raise"))
 
     def visit_binop(self, node):
-        op, lhs, rhs = node[1:]
-        lhs = self.visit(lhs)
-        rhs = self.visit(rhs)
-        method = getattr(self.builder, self._get_op_method(op))
-        if method:
-            return method(lhs, rhs)
-        else:
-            raise Exception(f"Unknown binary operator {op}")
+        op, lhs_node, rhs_node = node[1:]
+        if op == '+' and getattr(node, "type", None) == types.STR:
+            # A chain of concatenations allocates its result once.
+            return self._format([(self.visit(operand), types.STR) for operand in self._operands(node)])
+        lhs = self.visit(lhs_node)
+        rhs = self.visit(rhs_node)
+        lhs_type = self._type_of(lhs_node)
+        rhs_type = self._type_of(rhs_node)
+        result_type = getattr(node, "type", None) or types.arithmetic(op, lhs_type, rhs_type)
+        return self._arithmetic(op, lhs, lhs_type, rhs, rhs_type, result_type)
 
     def visit_comparison(self, node):
-        op, lhs, rhs = node[1:]
-        lhs = self.visit(lhs)
-        rhs = self.visit(rhs)
+        op, lhs_node, rhs_node = node[1:]
+        lhs = self.visit(lhs_node)
+        rhs = self.visit(rhs_node)
         valid_ops = {'==', '!=', '<', '<=', '>', '>='}
         if op not in valid_ops:
             raise ValueError(f"Invalid comparison operator: {op}")
+        lhs_type = self._type_of(lhs_node)
+        rhs_type = self._type_of(rhs_node)
+        if types.DOUBLE in (lhs_type, rhs_type):
+            lhs = self._convert(lhs, lhs_type, types.DOUBLE)
+            rhs = self._convert(rhs, rhs_type, types.DOUBLE)
+            return self.builder.fcmp_ordered(op, lhs, rhs)
         return self.builder.icmp_signed(op, lhs, rhs)
 
+    def visit_logical_or(self, node):
+        lhs_node, rhs_node = node[1:]
+        lhs = self.visit(lhs_node)
+        lhs = self._truth(lhs, self._type_of(lhs_node))
+        lhs_block = self.builder.block
+        rhs_block = self.builder.append_basic_block(name=node[0])
+        end_block = self.builder.append_basic_block(name=f"{node[0]}_end")
+        # The right operand is only evaluated when the left one does not
+        # decide the result.
+        if node[0] == 'logical_or':
+            self.builder.cbranch(lhs, end_block, rhs_block)
+        else:
+            self.builder.cbranch(lhs, rhs_block, end_block)
+        self.builder.position_at_end(rhs_block)
+        rhs = self.visit(rhs_node)
+        rhs = self._truth(rhs, self._type_of(rhs_node))
+        rhs_block = self.builder.block
+        self.builder.branch(end_block)
+        self.builder.position_at_end(end_block)
+        result = self.builder.phi(ir.IntType(1))
+        result.add_incoming(lhs, lhs_block)
+        result.add_incoming(rhs, rhs_block)
+        return result
+
+    visit_logical_and = visit_logical_or
+
+    def visit_inline_condition(self, node):
+        cond, true_node, false_node = node[1:]
+        value = self.visit(cond)
+        true_block = self.builder.append_basic_block(name="cond_true")
+        false_block = self.builder.append_basic_block(name="cond_false")
+        end_block = self.builder.append_basic_block(name="cond_end")
+        self.builder.cbranch(self._truth(value, self._type_of(cond)), true_block, false_block)
+        branches = []
+        for block, branch in ((true_block, true_node), (false_block, false_node)):
+            self.builder.position_at_end(block)
+            value = self.visit(branch)
+            branches.append((value, self._type_of(branch), self.builder.block))
+        result_type = getattr(node, "type", None) or types.unify(branches[0][1], branches[1][1])
+        incoming = []
+        for value, value_type, block in branches:
+            self.builder.position_at_end(block)
+            incoming.append((self._convert(value, value_type, result_type), block))
+            self.builder.branch(end_block)
+        self.builder.position_at_end(end_block)
+        result = self.builder.phi(incoming[0][0].type)
+        for value, block in incoming:
+            result.add_incoming(value, block)
+        return result
+
     def visit_return(self, node):
+        if self.coroutine is not None:
+            # Coroutines leave their result in their promise.
+            if node[1] is not None:
+                value = self.visit(node[1])
+                result_type = self._type_name(self.coroutine.promise.type.pointee.elements[1])
+                value = self._convert(value, self._type_of(node[1]), result_type)
+                self.runtime.set_field(self.builder, self.coroutine.promise, 1, value)
+            self.builder.branch(self.coroutine.final)
+            return
         try:
             value = self.visit(node[1])
-            self.builder.ret(value)
         except IndexError:
             self.builder.ret_void()
+            return
+        return_type = self._type_name(self.builder.function.function_type.return_type)
+        self.builder.ret(self._convert(value, self._type_of(node[1]), return_type))
 
     def visit_identifier(self, node):
         var_name = node[1]
@@ -221,12 +574,30 @@ class IRGenerator:
             return self.builder.load(field_ptr, var_name)
         raise Exception(f"Undefined variable: {var_name}")
 
-    def visit_range(self, node):
-        start, end = node[1:]
-        start_value = int(start[1])
-        end_value = int(end[1])
-        array = [(start[0], str(el)) for el in range(start_value, end_value)]
-        return self.visit(('array_literal', array))
+    def visit_array_range(self, node):
+        start, end = self.visit(node[1]), self.visit(node[2])
+        count = self.builder.sext(self.builder.sub(end, start), runtime.SIZE)
+        count = self.builder.select(self.builder.icmp_signed("<", count, ir.Constant(runtime.SIZE, 0)),
+                                    ir.Constant(runtime.SIZE, 0), count)
+        array = self.runtime.new_array(self.builder, ir.IntType(32), count)
+        self._counted_loop(start, end, lambda index: self.runtime.push(self.builder, array, index))
+        return array
+
+    def visit_array_comprehension(self, node):
+        # The element type is only known once the element has been lowered
+        # inside the loop; an empty array needs no element size, so the
+        # array starts out untyped and is cast afterwards.
+        array = self.runtime.new_array(self.builder, ir.IntType(8), ir.Constant(runtime.SIZE, 0))
+        element_type = types.element_of(getattr(node, "type", None))
+        pushed = []
+
+        def push(value, value_type):
+            value = self._convert(value, value_type, element_type or value_type)
+            self.runtime.push(self.builder, array, value)
+            pushed.append(value.type)
+
+        self._iterate(node, push)
+        return self.builder.bitcast(array, runtime.array_type(pushed[0]).as_pointer())
 
     def visit_integer(self, node):
         return ir.Constant(ir.IntType(32), int(node[1]))
@@ -235,57 +606,173 @@ class IRGenerator:
         return ir.Constant(ir.DoubleType(), float(node[1]))
 
     def visit_string(self, node):
-        return ir.Constant(ir.IntType(8).as_pointer(), node[1])
+        return self._string(unescape(node[1]))
+
+    def visit_template_string(self, node):
+        pieces = []
+        text = node[1]
+        position = 0
+        for match in PLACEHOLDER.finditer(text):
+            if match.start() > position:
+                pieces.append((self._string(unescape(text[position:match.start()])), types.STR))
+            value = self.visit(('identifier', match.group(1)))
+            pieces.append((value, self._type_name(value.type)))
+            position = match.end()
+        if position < len(text) or not pieces:
+            pieces.append((self._string(unescape(text[position:])), types.STR))
+        if len(pieces) == 1 and pieces[0][1] == types.STR:
+            return pieces[0][0]
+        return self._format(pieces)
 
     def visit_boolean(self, node):
         value = 1 if node[1] == 'True' else 0
         return ir.Constant(ir.IntType(1), value)
 
     def visit_array_literal(self, node):
-        elements = [self.visit(element) for element in node[1]]
-        array_type = ir.ArrayType(elements[0].type, len(elements))
-        return ir.Constant(array_type, elements)
+        values = [(self.visit(element), element) for element in node[1]]
+        element_type = types.element_of(getattr(node, "type", None))
+        if element_type is None:
+            element_type = self._type_name(values[0][0].type) if values else 'int'
+            if any(self._type_of(element) == types.DOUBLE for value, element in values):
+                element_type = types.DOUBLE
+        array = self.runtime.new_array(self.builder, self._get_ir_type(element_type),
+                                       ir.Constant(runtime.SIZE, len(values)))
+        if values:
+            # The buffer already has room for every element.
+            data = self.runtime.data(self.builder, array)
+            for index, (value, element) in enumerate(values):
+                value = self._convert(value, self._type_of(element), element_type)
+                self.builder.store(value, self.builder.gep(data, [ir.Constant(ir.IntType(32), index)]))
+            self.runtime.set_length(self.builder, array, ir.Constant(runtime.SIZE, len(values)))
+        return array
+
+    def visit_object_literal(self, node):
+        map_type = getattr(node, "type", None)
+        # Every entry is evaluated before the map is made, so the map can be
+        # allocated once at its final size.
+        entries = []
+        for entry in object_entries(node[1]):
+            if entry[0] == 'unpack':
+                source = self.visit(('identifier', entry[1]))
+                if not runtime.is_map(source.type):
+                    raise Exception(f"Cannot unpack {source.type}")
+                entries.append((None, source, self._type_name(source.type)))
+            else:
+                value = self.visit(entry[2])
+                entries.append((entry[1], value, self._type_of(entry[2])))
+        if not types.is_map(map_type):
+            map_type = self._infer_map_type(entries)
+        key_type, value_type = types.key_of(map_type), types.value_of(map_type)
+        count = ir.Constant(runtime.SIZE, sum(key is not None for key, _, _ in entries))
+        for key, value, _ in entries:
+            if key is None:
+                count = self.builder.add(count, self.runtime.length(self.builder, value))
+        result = self.runtime.new_map(self.builder, self._get_ir_type(key_type),
+                                      self._get_ir_type(value_type), count)
+        for key, value, entry_type in entries:
+            if key is None:
+                self.runtime.map_merge(self.builder, result, value)
+            else:
+                slot = self.runtime.map_slot(self.builder, result, self._map_key(key, key_type))
+                self.builder.store(self._convert(value, entry_type, value_type), slot)
+        return result
+
+    def visit_index(self, node):
+        target, key_node = node[1:]
+        container = self.visit(target)
+        key = self.visit(key_node)
+        if runtime.is_array(container.type):
+            return self.builder.load(self.runtime.element(self.builder, container, key))
+        if runtime.is_map(container.type):
+            # A missing key aborts, like an index out of bounds.
+            slot = self.runtime.map_find(self.builder, container, key)
+            return self.builder.load(self.runtime.check(self.builder, slot))
+        raise Exception(f"Cannot index {container.type}")
 
     def visit_lambda(self, node):
         params, body = node[1:]
         param_types = [self._get_ir_type(param[0]) for param in params]
-        func_type = ir.FunctionType(self._get_ir_type('int'), param_types)  # Assuming return type is int for simplicity
+        # Unannotated lambdas are assumed to return int.
+        rtype = types.return_of(getattr(node, "type", None)) or 'int'
+        func_type = ir.FunctionType(self._get_ir_type(rtype), param_types)
         func = ir.Function(self.module, func_type, name="lambda")
         
         block = func.append_basic_block(name="entry")
         self.builder = ir.IRBuilder(block)
+        # The body of a lambda is outside of any try or coroutine it is
+        # written in.
+        handlers, self.handlers = self.handlers, []
+        coroutine, self.coroutine = self.coroutine, None
         
         self.scope.enter()
         for idx, (param_type, param_name) in enumerate(params):
-            ptr = self.builder.alloca(self._get_ir_type(param_type), param_name)
+            ptr = self.builder.alloca(self._get_ir_type(param_type), name=param_name)
             self.builder.store(func.args[idx], ptr)
             self.scope.define(param_name, ptr)
         
         result = self.visit(body)
         self.builder.ret(result)
         self.scope.leave()
+        self.handlers = handlers
+        self.coroutine = coroutine
         # func.type = ir.FunctionType(result.type, param_types)
         
         return func
 
-    def _generate_constructor(self, class_name, class_type, ctor_def):
+    def _construct(self, node):
+        class_name, args = node[1:]
+        class_type = self.classes[class_name]["type"]
+        init = self.module.get_global(f"{class_name}_init")
+        arg_values = self._arguments(init, args, 1)
+        # Instances the escape analysis proved local live in the caller's
+        # frame; the others are allocated on the heap and, as nothing
+        # tracks who still refers to them, live until the program exits.
+        if identity(node) in self.stack_allocated:
+            instance = self._alloca(class_type, class_name.lower())
+        else:
+            instance = self.runtime.alloc(self.builder, class_type)
+        self._call(init, [instance] + arg_values)
+        return instance
+
+    def _generate_constructor(self, class_name, class_type, fields, ctor_def):
         _, _, ctor_args, ctor_body = ctor_def
         param_types = [self._get_ir_type(param[0]) for param in ctor_args]
-        func_type = ir.FunctionType(class_type.as_pointer(), param_types)
-        ctor = ir.Function(self.module, func_type, name=f"{class_name}_ctor")
-        entry_block = ctor.append_basic_block(name="entry")
-        self.builder = ir.IRBuilder(entry_block)
-        instance = self.builder.alloca(class_type)
-        self.current_instance = instance
+        # Constructors initialize storage their caller provides, so the
+        # caller decides where an instance lives.
+        init_type = ir.FunctionType(ir.VoidType(), [class_type.as_pointer()] + param_types)
+        init = ir.Function(self.module, init_type, name=f"{class_name}_init")
+        self.builder = ir.IRBuilder(init.append_basic_block(name="entry"))
+        self.current_instance = init.args[0]
+        for idx, field in enumerate(fields):
+            field_type = self._get_ir_type(field[1])
+            if len(field) > 3 and field[3] is not None:
+                value = self.visit(field[3])
+                value = self._convert(value, self._type_of(field[3]), field[1])
+            else:
+                value = self._get_default_value(field_type)
+            self.runtime.set_field(self.builder, self.current_instance, idx, value)
+        self.scope.enter()
         for idx, (param_type, param_name) in enumerate(ctor_args):
             ptr = self.builder.alloca(self._get_ir_type(param_type), name=param_name)
+            self.builder.store(init.args[idx + 1], ptr)
             self.scope.define(param_name, ptr)
         for statement in ctor_body:
             self.visit(statement)
+        self.scope.leave()
         if not self.builder.block.is_terminated:
-            self.builder.ret(self.current_instance)
+            self.builder.ret_void()
+        self._release(init)
         self.current_instance = None
 
+        # Callers outside the module get their instances from the heap and
+        # own them: they are released with free.
+        func_type = ir.FunctionType(class_type.as_pointer(), param_types)
+        ctor = ir.Function(self.module, func_type, name=f"{class_name}_ctor")
+        self.builder = ir.IRBuilder(ctor.append_basic_block(name="entry"))
+        instance = self.runtime.alloc(self.builder, class_type)
+        self.builder.call(init, [instance] + list(ctor.args))
+        self.builder.ret(instance)
+
     def _generate_method(self, class_name, class_type, method_def):
         _, _, return_type, method_name, args, method_body = method_def
         llvm_return_type = self._get_ir_type(return_type)
@@ -293,8 +780,7 @@ class IRGenerator:
         func = ir.Function(self.module, func_type, name=f"{class_name}_{method_name}")
         entry_block = func.append_basic_block(name="entry")
         self.builder = ir.IRBuilder(entry_block)
-        instance = self.builder.alloca(class_type)
-        self.current_instance = instance
+        self.current_instance = func.args[0]
         self.scope.enter()
         for idx, (arg_type, arg_name) in enumerate(args):
             ptr = self.builder.alloca(self._get_ir_type(arg_type), name=arg_name)
@@ -308,8 +794,223 @@ class IRGenerator:
                 self.builder.ret_void()
             else:
                 self.builder.ret(self._get_default_value(llvm_return_type))
+        self._release(func)
         self.current_instance = None
 
+    def _call(self, func, args, name=""):
+        # Calls that may raise are invokes inside a try and plain calls
+        # everywhere else.
+        if not self.handlers:
+            return self.builder.call(func, args, name=name)
+        normal_block = self.builder.append_basic_block(name="invoke_next")
+        result = self.builder.invoke(func, args, normal_block, self.handlers[-1][0], name=name)
+        self.builder.position_at_end(normal_block)
+        return result
+
+    def _arguments(self, func, args, offset=0):
+        param_types = func.function_type.args[offset:]
+        values = [self.visit(arg) for arg in args]
+        return [self._convert(value, self._type_of(arg), self._type_name(param_type))
+                for arg, value, param_type in zip(args, values, param_types)] + values[len(param_types):]
+
+    def _iterate(self, iterable, body):
+        # Ranges and comprehensions are never built in memory when they are
+        # iterated: each one becomes the loop itself and hands its elements
+        # to body one at a time, so a comprehension fuses with its source.
+        if iterable[0] == 'array_range':
+            start, end = iterable[1:]
+            start, end = self.visit(start), self.visit(end)
+            self._counted_loop(start, end, lambda index: body(index, types.INT))
+        elif iterable[0] == 'array_comprehension':
+            element, param, source, *condition = iterable[1:]
+            param_type, param_name = param
+            param_ptr = self._alloca(self._get_ir_type(param_type), param_name)
+
+            def each(value, value_type):
+                self.builder.store(self._convert(value, value_type, param_type), param_ptr)
+                self.scope.enter()
+                self.scope.define(param_name, param_ptr)
+                if condition and condition[0] is not None:
+                    cond = self.visit(condition[0])
+                    keep_block = self.builder.append_basic_block(name="keep")
+                    self.builder.cbranch(self._truth(cond, self._type_of(condition[0])),
+                                         keep_block, self.loops[-1][0])
+                    self.builder.position_at_end(keep_block)
+                value = self.visit(element)
+                body(value, self._type_of(element))
+                self.scope.leave()
+
+            self._iterate(source, each)
+        else:
+            container = self.visit(iterable)
+            if runtime.is_array(container.type):
+                element_type = self._type_name(runtime.element_type(container.type))
+                length = self.builder.trunc(self.runtime.length(self.builder, container), ir.IntType(32))
+                data = self.runtime.data(self.builder, container)
+
+                def each(index):
+                    element_ptr = self.builder.gep(data, [index])
+                    body(self.builder.load(element_ptr, "element"), element_type)
+
+                self._counted_loop(ir.Constant(ir.IntType(32), 0), length, each)
+            elif runtime.is_map(container.type):
+                # Iterating a map visits its keys, in table order.
+                key_type = self._type_name(runtime.key_type(container.type))
+                capacity = self.builder.trunc(self.runtime.field(self.builder, container, 1, "cap"),
+                                              ir.IntType(32))
+                states = self.runtime.field(self.builder, container, 2, "states")
+                keys = self.runtime.field(self.builder, container, 3, "keys")
+
+                def each(index):
+                    state = self.builder.load(self.builder.gep(states, [index]))
+                    used_block = self.builder.append_basic_block(name="used")
+                    self.builder.cbranch(self.builder.icmp_unsigned("!=", state, ir.Constant(state.type, 0)),
+                                         used_block, self.loops[-1][0])
+                    self.builder.position_at_end(used_block)
+                    body(self.builder.load(self.builder.gep(keys, [index]), "key"), key_type)
+
+                self._counted_loop(ir.Constant(ir.IntType(32), 0), capacity, each)
+            else:
+                raise Exception(f"Cannot iterate over {container.type}")
+
+    def _put(self, map_node, key_node, value_node):
+        container = self.visit(map_node)
+        if not runtime.is_map(container.type):
+            raise Exception(f"Cannot put into {container.type}")
+        key = self.visit(key_node)
+        value = self.visit(value_node)
+        value_type = self._type_name(runtime.value_type(container.type))
+        slot = self.runtime.map_slot(self.builder, container, key)
+        self.builder.store(self._convert(value, self._type_of(value_node), value_type), slot)
+
+    def _infer_map_type(self, entries):
+        # Literals that were not analyzed have int keys when every key
+        # reads as an integer.
+        for key, _, entry_type in entries:
+            if key is None:
+                return entry_type
+        keys = [key for key, _, _ in entries]
+        key_type = types.INT if all(key.lstrip('-').isdigit() for key in keys) else types.STR
+        value_type = entries[0][2] if entries else types.INT
+        if any(entry_type == types.DOUBLE for _, _, entry_type in entries):
+            value_type = types.DOUBLE
+        return types.map_of(key_type, value_type)
+
+    def _map_key(self, key, key_type):
+        if key_type == types.INT:
+            return ir.Constant(ir.IntType(32), int(key))
+        return self._string(unescape(key))
+
+    def _string(self, text):
+        # Identical strings share one private global.
+        pointer = self.strings.get(text)
+        if pointer is None:
+            pointer = self.runtime.constant_string(text, f".str.{len(self.strings)}")
+            self.strings[text] = pointer
+        return pointer
+
+    def visit_log(self, node):
+        # Arguments are separated by spaces and every call ends a line.
+        pieces = []
+        for arg in node[1]:
+            value = self.visit(arg)
+            if pieces:
+                pieces.append((self._string(" "), types.STR))
+            pieces.append((value, self._type_of(arg)))
+        pieces.append((self._string("\n"), types.STR))
+        self.runtime.log(self.builder, self._pieces(pieces))
+
+    def _at_exit(self):
+        # Before main returns, it runs the tasks it started and writes out
+        # the log output that is still buffered.
+        calls = []
+        if 'o_task_schedule' in self.module.globals:
+            calls.append(self.runtime.function('o_loop_run'))
+        if 'o_log_reserve' in self.module.globals:
+            calls.append(self.runtime.function('o_log_flush'))
+        main = self.module.globals.get('main')
+        if not calls or not isinstance(main, ir.Function) or main.is_declaration or 'main' in self.coroutines:
+            return
+        builder = ir.IRBuilder()
+        for block in main.blocks:
+            if isinstance(block.terminator, ir.Ret):
+                builder.position_before(block.terminator)
+                for function in calls:
+                    builder.call(function, [])
+
+    def _format(self, pieces):
+        return self.runtime.format(self.builder, self._pieces(pieces))
+
+    def _pieces(self, pieces):
+        values = []
+        for value, value_type in pieces:
+            if value_type == types.BOOL:
+                value, value_type = self.builder.select(value, self._string("True"), self._string("False")), types.STR
+            if value_type not in (types.STR, types.INT, types.DOUBLE):
+                raise Exception(f"Cannot format {value_type}")
+            values.append((value, value_type))
+        return values
+
+    def _operands(self, node):
+        if is_node(node) and node[0] == 'binop' and node[1] == '+' and getattr(node, "type", None) == types.STR:
+            return self._operands(node[2]) + self._operands(node[3])
+        return [node]
+
+    def _push(self, array_node, value_node):
+        array = self.visit(array_node)
+        if not runtime.is_array(array.type):
+            raise Exception(f"Cannot push onto {array.type}")
+        value = self.visit(value_node)
+        element_type = self._type_name(runtime.element_type(array.type))
+        value = self._convert(value, self._type_of(value_node), element_type)
+        self.runtime.push(self.builder, array, value)
+
+    def _counted_loop(self, start, end, body):
+        index_ptr = self._alloca(ir.IntType(32), "index")
+        self.builder.store(start, index_ptr)
+        loop_block = self.builder.append_basic_block(name="loop")
+        next_block = self.builder.append_basic_block(name="loop_next")
+        after_loop_block = self.builder.append_basic_block(name="after_loop")
+        # The loop is entered through a guard and tests its condition at
+        # the bottom, the shape LLVM's loop passes expect.
+        if isinstance(start, ir.Constant) and isinstance(end, ir.Constant):
+            self.builder.branch(loop_block if start.constant < end.constant else after_loop_block)
+        else:
+            self.builder.cbranch(self.builder.icmp_signed("<", start, end), loop_block, after_loop_block)
+        self.builder.position_at_end(loop_block)
+        index = self.builder.load(index_ptr, "index")
+        self.loops.append((next_block, after_loop_block))
+        body(index)
+        self.loops.pop()
+        if not self.builder.block.is_terminated:
+            self.builder.branch(next_block)
+        self.builder.position_at_end(next_block)
+        next_index = self.builder.add(index, ir.Constant(ir.IntType(32), 1), name="next_index")
+        self.builder.store(next_index, index_ptr)
+        end_cond = self.builder.icmp_signed("<", next_index, end)
+        self.builder.cbranch(end_cond, loop_block, after_loop_block)
+        self.builder.position_at_end(after_loop_block)
+
+    def _release(self, function):
+        # The arrays a function owns are freed wherever it returns, after
+        # its result has been computed.
+        owned = self.owned.pop(function, ())
+        for block in function.blocks if owned else ():
+            if block.is_terminated and isinstance(block.instructions[-1], ir.Ret):
+                self.builder.position_before(block.instructions[-1])
+                self._free_owned(owned)
+
+    def _free_owned(self, owned):
+        for ptr in owned:
+            self.runtime.free_array(self.builder, self.builder.load(ptr))
+
+    def _alloca(self, ir_type, name=""):
+        # Allocas go to the entry block, so they are made once
+        # per call and promoted to registers instead of growing the stack
+        # on every iteration of a loop.
+        with self.builder.goto_entry_block():
+            return self.builder.alloca(ir_type, name=name)
+
     def _get_field_index(self, class_name, field_name):
         class_info = self.classes.get(class_name)
         if not class_info or field_name not in class_info["fields"]:
@@ -326,20 +1027,73 @@ class IRGenerator:
                 return ir.IntType(1)
             case 'str':
                 return ir.IntType(8).as_pointer()
+            case str() if type_name.endswith('[]'):
+                return runtime.array_type(self._get_ir_type(type_name[:-2])).as_pointer()
+            case str() if types.is_map(type_name):
+                return runtime.map_type(self._get_ir_type(types.key_of(type_name)),
+                                        self._get_ir_type(types.value_of(type_name))).as_pointer()
             case _:  # Handle user-defined types (e.g., classes)
                 if type_name in self.classes:
                     return self.classes[type_name]["type"].as_pointer()
                 raise Exception(f"Unsupported type: {type_name}")
 
-    def _get_op_method(self, op):
-        return {
-            '+': 'add',
-            '-': 'sub',
-            '*': 'mul',
-            '/': 'div',
-            '%': 'urem',
-            '**': 'fmul',
-        }.get(op, None)
+    def _type_of(self, node):
+        # Types come from the semantic analyzer's annotations, so only
+        # analyzed trees can be lowered.
+        node_type = getattr(node, "type", None)
+        if node_type is None:
+            raise Exception(f"Expression was not analyzed: {node!r}")
+        return node_type
+
+    def _type_name(self, ir_type):
+        if isinstance(ir_type, ir.DoubleType):
+            return types.DOUBLE
+        if isinstance(ir_type, ir.IntType):
+            return types.BOOL if ir_type.width == 1 else types.INT
+        if ir_type == ir.IntType(8).as_pointer():
+            return types.STR
+        if runtime.is_array(ir_type):
+            return types.array_of(self._type_name(runtime.element_type(ir_type)))
+        if runtime.is_map(ir_type):
+            return types.map_of(self._type_name(runtime.key_type(ir_type)),
+                                self._type_name(runtime.value_type(ir_type)))
+        return None
+
+    def _convert(self, value, from_type, to_type):
+        if from_type == types.INT and to_type == types.DOUBLE:
+            return self.builder.sitofp(value, ir.DoubleType())
+        if from_type != to_type and to_type is not None \
+                and (runtime.is_array(value.type) or runtime.is_map(value.type)):
+            # Only empty literals have no element types of their own.
+            return self.builder.bitcast(value, self._get_ir_type(to_type))
+        return value
+
+    def _truth(self, value, value_type):
+        if value_type == types.INT:
+            return self.builder.icmp_signed('!=', value, ir.Constant(value.type, 0))
+        if value_type == types.DOUBLE:
+            return self.builder.fcmp_unordered('!=', value, ir.Constant(value.type, 0.0))
+        return value
+
+    def _arithmetic(self, op, lhs, lhs_type, rhs, rhs_type, result_type, name=None):
+        if result_type == types.STR and op == '+':
+            return self._format([(lhs, types.STR), (rhs, types.STR)])
+        if result_type == types.DOUBLE:
+            lhs = self._convert(lhs, lhs_type, types.DOUBLE)
+            rhs = self._convert(rhs, rhs_type, types.DOUBLE)
+            if op == '**':
+                pow = self.module.declare_intrinsic('llvm.pow', [ir.DoubleType()])
+                return self.builder.call(pow, [lhs, rhs])
+            method = FLOAT_OPS.get(op)
+        elif op == '**':
+            return self.builder.call(self.runtime.function("o_int_pow"), [lhs, rhs])
+        else:
+            method = INT_OPS.get(op)
+        if method is None:
+            raise Exception(f"Unknown binary operator {op}")
+        if name is not None:
+            return getattr(self.builder, method)(lhs, rhs, f"{name}_{method}")
+        return getattr(self.builder, method)(lhs, rhs)
 
     def _get_default_value(self, ir_type):
         if isinstance(ir_type, ir.IntType):
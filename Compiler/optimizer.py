@@ -0,0 +1,152 @@
+import time
+from collections import namedtuple
+
+import llvmlite.binding as llvm
+
+from .target import target_machine
+
+# Pass names follow opt's spelling. There is no standalone mem2reg in the
+# new pass manager; SROA performs the same promotion of allocas to SSA
+# registers and is what the standard pipelines use instead.
+PASSES = {
+    "mem2reg": "add_sroa_pass",
+    "sroa": "add_sroa_pass",
+    "instcombine": "add_instruction_combine_pass",
+    "aggressive-instcombine": "add_aggressive_instcombine_pass",
+    "reassociate": "add_reassociate_pass",
+    "gvn": "add_new_gvn_pass",
+    "sccp": "add_sccp_pass",
+    "ipsccp": "add_ipsccp_pass",
+    "dce": "add_dead_code_elimination_pass",
+    "adce": "add_aggressive_dce_pass",
+    "dse": "add_dead_store_elimination_pass",
+    "memcpyopt": "add_mem_copy_opt_pass",
+    "simplifycfg": "add_simplify_cfg_pass",
+    "jump-threading": "add_jump_threading_pass",
+    "tailcallelim": "add_tail_call_elimination_pass",
+    "loop-simplify": "add_loop_simplify_pass",
+    "lcssa": "add_lcssa_pass",
+    "loop-rotate": "add_loop_rotate_pass",
+    "loop-deletion": "add_loop_deletion_pass",
+    "loop-unroll": "add_loop_unroll_pass",
+    "loop-reduce": "add_loop_strength_reduce_pass",
+    "always-inline": "add_always_inliner_pass",
+    "partial-inliner": "add_partial_inliner_pass",
+    "globalopt": "add_global_opt_pass",
+    "globaldce": "add_global_dead_code_eliminate_pass",
+    "constmerge": "add_constant_merge_pass",
+    "deadargelim": "add_dead_arg_elimination_pass",
+    "function-attrs": "add_post_order_function_attributes_pass",
+}
+
+LOOP_PASSES = ["loop-simplify", "lcssa", "loop-rotate", "loop-deletion"]
+
+# "default" is LLVM's own pipeline for the optimizer's level. It brings the
+# passes llvmlite cannot schedule one by one: the call graph inliner, LICM,
+# induction variable simplification and the vectorizers.
+PIPELINES = {
+    0: ["always-inline"],
+    1: ["always-inline", "mem2reg", "instcombine", "simplifycfg", "dce"],
+    2: ["always-inline", "mem2reg", "instcombine", "simplifycfg", "reassociate", "gvn",
+        "sccp", *LOOP_PASSES, "instcombine", "dse", "adce", "simplifycfg", "default"],
+    3: ["always-inline", "ipsccp", "globalopt", "mem2reg", "instcombine", "simplifycfg",
+        "function-attrs", "reassociate", "gvn", "sccp", "jump-threading", *LOOP_PASSES,
+        "loop-unroll", "loop-reduce", "instcombine", "memcpyopt", "dse", "adce",
+        "tailcallelim", "simplifycfg", "default", "globaldce", "constmerge"],
+}
+
+PassReport = namedtuple("PassReport", "name seconds before after")
+
+
+def optimization_level(level):
+    if isinstance(level, str):
+        level = level.upper().removeprefix("-").removeprefix("O")
+        level = int(level) if level.isdigit() else level
+    if level not in PIPELINES:
+        raise ValueError(f"Unknown optimization level: {level}")
+    return level
+
+
+def lower_coroutines(module, target_machine):
+    # Coroutines must be split into their ramp, resume and destroy parts
+    # before code generation, so modules with any are lowered even when
+    # LLVM's pipelines did not run. Its O0 pipeline does that and nothing
+    # more.
+    if any(function.name == "llvm.coro.begin" for function in module.functions):
+        tuning = llvm.create_pipeline_tuning_options(speed_level=0)
+        pass_builder = llvm.create_pass_builder(target_machine, tuning)
+        pass_builder.getModulePassManager().run(module, pass_builder)
+    return module
+
+
+def instruction_count(module):
+    return sum(len(list(block.instructions))
+               for function in module.functions for block in function.blocks)
+
+
+class Optimizer:
+    def __init__(self, level=2, passes=None, stats=False):
+        self.level = optimization_level(level)
+        self.passes = list(PIPELINES[self.level] if passes is None else passes)
+        for name in self.passes:
+            if name != "default" and name not in PASSES:
+                raise ValueError(f"Unknown pass: {name}")
+        self.stats = stats
+        self.report = []
+        self.tuning = llvm.create_pipeline_tuning_options(speed_level=self.level)
+        self.target_machine = target_machine(self.level)
+        self.pass_builder = llvm.create_pass_builder(self.target_machine, self.tuning)
+
+    def optimize(self, ir_text):
+        module = llvm.parse_assembly(ir_text)
+        module.verify()
+        module.data_layout = str(self.target_machine.target_data)
+        self.run(module)
+        return str(module)
+
+    def run(self, module):
+        self.report = []
+        if not self.stats:
+            manager = llvm.create_new_module_pass_manager()
+            for name in self.passes:
+                if name == "default":
+                    self._run_default(manager, module)
+                    manager = llvm.create_new_module_pass_manager()
+                else:
+                    getattr(manager, PASSES[name])()
+            manager.run(module, self.pass_builder)
+            return lower_coroutines(module, self.target_machine)
+        # Every pass gets its own manager so it can be timed and its effect
+        # on the instruction count measured in isolation.
+        count = instruction_count(module)
+        for name in self.passes:
+            manager = llvm.create_new_module_pass_manager()
+            start = time.perf_counter()
+            if name == "default":
+                self._run_default(manager, module)
+                name = f"default<O{self.level}>"
+            else:
+                getattr(manager, PASSES[name])()
+                manager.run(module, self.pass_builder)
+            seconds = time.perf_counter() - start
+            after = instruction_count(module)
+            self.report.append(PassReport(name, seconds, count, after))
+            count = after
+        return lower_coroutines(module, self.target_machine)
+
+    def _run_default(self, manager, module):
+        manager.run(module, self.pass_builder)
+        if self.level:
+            self.pass_builder.getModulePassManager().run(module, self.pass_builder)
+
+    def summary(self):
+        lines = [f"{'pass':<24}{'ms':>10}{'before':>10}{'after':>10}{'delta':>10}"]
+        for report in self.report:
+            lines.append(f"{report.name:<24}{report.seconds * 1e3:>10.3f}{report.before:>10}"
+                         f"{report.after:>10}{report.after - report.before:>+10}")
+        if self.report:
+            total = sum(report.seconds for report in self.report)
+            delta = self.report[-1].after - self.report[0].before
+            lines.append(f"{'total':<24}{total * 1e3:>10.3f}{self.report[0].before:>10}"
+                         f"{self.report[-1].after:>10}{delta:>+10}")
+        return "\n".join(lines)
@@ -0,0 +1,46 @@
+import pickle
+from collections import namedtuple
+
+from Parser.parser import parser
+from Semantic.analyzer import SemanticAnalyzer
+from Semantic.folder import ConstantFolder
+
+from .assembler import Assembler
+from .ir_generator import IRGenerator
+from .optimizer import Optimizer
+
+Build = namedtuple("Build", "ast ir object")
+
+
+def compile_source(source, level=2, emit_object=False, cache=None):
+    if isinstance(source, bytes):
+        source = source.decode()
+    key = cache.key(source, level=level) if cache is not None else None
+    ast = ir_text = code = None
+    if key is not None:
+        ir_text = cache.get(key, "ll")
+        if ir_text is not None:
+            ir_text = ir_text.decode()
+            ast = cache.get(key, "ast")
+            ast = pickle.loads(ast) if ast is not None else None
+    if ir_text is None or ast is None:
+        ast = parser.parse(source)
+        SemanticAnalyzer().analyze(ast)
+        ir_text = IRGenerator().generate(ConstantFolder().fold(ast) if level else ast)
+        if level:
+            ir_text = Optimizer(level).optimize(ir_text)
+        if key is not None:
+            cache.put(key, "ast", pickle.dumps(ast, pickle.HIGHEST_PROTOCOL))
+            cache.put(key, "ll", ir_text.encode())
+    if emit_object:
+        assembler = Assembler(level=level)
+        if key is not None:
+            # Objects depend on the machine they were generated for.
+            object_key = cache.key(ir_text, level=level, target=assembler.triple,
+                                   cpu=assembler.cpu, features=assembler.features)
+            code = cache.get(object_key, "o")
+        if code is None:
+            code = assembler.emit_object(ir_text)
+            if key is not None:
+                cache.put(object_key, "o", code)
+    return Build(ast, ir_text, code)
@@ -0,0 +1,1128 @@
+from collections import namedtuple
+
+import llvmlite.ir as ir
+from llvmlite.ir.values import FunctionAttributes
+
+SIZE = ir.IntType(64)
+BYTE_PTR = ir.IntType(8).as_pointer()
+INDEX = ir.IntType(32)
+
+
+def array_type(element_type):
+    # Arrays are {len, cap, ptr} headers on the heap, with the elements in a
+    # separate buffer that grows geometrically.
+    return ir.LiteralStructType([SIZE, SIZE, element_type.as_pointer()])
+
+
+def is_array(ir_type):
+    return isinstance(ir_type, ir.PointerType) and isinstance(ir_type.pointee, ir.LiteralStructType) \
+        and len(ir_type.pointee.elements) == 3 and ir_type.pointee.elements[0] == SIZE \
+        and isinstance(ir_type.pointee.elements[2], ir.PointerType)
+
+
+def element_type(ir_type):
+    return ir_type.pointee.elements[2].pointee
+
+
+def sizeof(ir_type):
+    null = ir.Constant(ir_type.as_pointer(), None)
+    return null.gep([ir.Constant(INDEX, 1)]).ptrtoint(SIZE)
+
+
+def map_type(key_type, value_type):
+    # Maps are open-addressing tables with linear probing: a byte per slot
+    # marks it as used, and keys and values sit in parallel buffers.
+    return ir.LiteralStructType([SIZE, SIZE, BYTE_PTR, key_type.as_pointer(), value_type.as_pointer()])
+
+
+def is_map(ir_type):
+    return isinstance(ir_type, ir.PointerType) and isinstance(ir_type.pointee, ir.LiteralStructType) \
+        and len(ir_type.pointee.elements) == 5 and ir_type.pointee.elements[0] == SIZE
+
+
+def key_type(ir_type):
+    return ir_type.pointee.elements[3].pointee
+
+
+def value_type(ir_type):
+    return ir_type.pointee.elements[4].pointee
+
+
+class TokenType(ir.Type):
+    # llvmlite has no token type, which the coroutine intrinsics take.
+    def _to_string(self):
+        return "token"
+
+    def __eq__(self, other):
+        return isinstance(other, TokenType)
+
+    def __hash__(self):
+        return hash(TokenType)
+
+
+class CoroutineAttributes(FunctionAttributes):
+    # Nor does it know the attribute marking a coroutine to be split.
+    _known = FunctionAttributes._known | {"presplitcoroutine"}
+
+
+TOKEN = TokenType()
+NO_TOKEN = ir.FormattedConstant(TOKEN, "none")
+# Async functions are LLVM coroutines with switched-resume lowering, run by
+# a single-threaded loop that waits on timers and file descriptors with
+# epoll. Their promise holds the coroutine awaiting them and their result.
+Coroutine = namedtuple("Coroutine", "handle promise final suspended cleanup")
+PROMISE_ALIGN = 8
+TIMER = ir.LiteralStructType([SIZE, BYTE_PTR])
+TIMESPEC = ir.LiteralStructType([SIZE, SIZE])
+CLOCK_MONOTONIC = 1
+# What tasks can wait for on a file descriptor.
+EVENTS = {"readable": 0x1, "writable": 0x4}
+EPOLLONESHOT = 1 << 30
+EPOLL_CTL_ADD = 1
+EPOLL_CTL_MOD = 3
+EPOLL_CLOEXEC = 0o2000000
+# struct epoll_event is packed on x86-64.
+EPOLL_EVENT = ir.LiteralStructType([INDEX, SIZE], packed=True)
+# Events taken from epoll per wait.
+EPOLL_BATCH = 64
+
+
+def promise_type(result_type):
+    return ir.LiteralStructType([BYTE_PTR] if result_type is None else [BYTE_PTR, result_type])
+
+
+def uses_exceptions(module):
+    # Takes a parsed module, as the JIT and the linker get it.
+    return any(function.name in (PERSONALITY, "__cxa_throw") for function in module.functions)
+
+
+def string_type(length):
+    # Strings point at NUL-terminated bytes that follow their length, so
+    # they pass as C strings and their length is known without a scan.
+    return ir.LiteralStructType([SIZE, ir.ArrayType(ir.IntType(8), length + 1)])
+
+
+GENERIC_ARRAY = array_type(ir.IntType(8))
+# Map functions are specialized by key type only; values are copied as
+# bytes of a size passed in by the caller.
+KEY_TYPES = {"int": ir.IntType(32), "str": BYTE_PTR}
+GENERIC_MAPS = {kind: map_type(key, ir.IntType(8)) for kind, key in KEY_TYPES.items()}
+# Tables are at most three quarters full.
+MIN_CAPACITY = 8
+# How doubles are written into strings: with the fewest of these digits
+# that read back as the same double.
+DOUBLE_FORMATS = ("%.15g", "%.16g", "%.17g")
+# Bytes of log output buffered per thread before they are written out.
+LOG_CAPACITY = 1 << 16
+# Exceptions are thrown and caught with the C++ runtime's unwinder, so
+# code that raises nothing pays for unwind tables only.
+PERSONALITY = "__gxx_personality_v0"
+EXCEPTION_LIBRARY = "stdc++"
+# What a landing pad receives: the exception and the selector of the
+# clause that caught it.
+LANDING_PAD = ir.LiteralStructType([BYTE_PTR, INDEX])
+# The type_info of a class without bases is its vtable and its name.
+TYPE_INFO = ir.LiteralStructType([BYTE_PTR, BYTE_PTR])
+CLASS_TYPE_INFO = "_ZTVN10__cxxabiv117__class_type_infoE"
+
+
+class Runtime:
+    # Runtime functions are defined in IR inside every module that uses
+    # them. They have linkonce_odr linkage, so linking modules keeps a
+    # single copy and the JIT needs nothing but libc, plus the C++
+    # runtime once a module raises or catches exceptions.
+    def __init__(self, module):
+        self.module = module
+
+    def function(self, name):
+        function = self.module.globals.get(name)
+        if function is None:
+            function = getattr(self, "_define_" + name)()
+        return function
+
+    def _declare(self, name, rtype, *param_types, var_arg=False):
+        function = self.module.globals.get(name)
+        if function is None:
+            function = ir.Function(self.module, ir.FunctionType(rtype, param_types, var_arg=var_arg),
+                                   name=name)
+        return function
+
+    def _define(self, name, rtype, *param_types):
+        function = ir.Function(self.module, ir.FunctionType(rtype, param_types), name=name)
+        function.linkage = "linkonce_odr"
+        return function, ir.IRBuilder(function.append_basic_block(name="entry"))
+
+    def check(self, builder, pointer):
+        # Running out of memory aborts rather than writing through null.
+        failed = builder.icmp_unsigned("==", pointer, ir.Constant(pointer.type, None))
+        with builder.if_then(failed, likely=False):
+            self.abort(builder)
+        return pointer
+
+    def field(self, builder, header, index, name=""):
+        zero = ir.Constant(INDEX, 0)
+        return builder.load(builder.gep(header, [zero, ir.Constant(INDEX, index)]), name)
+
+    def set_field(self, builder, header, index, value):
+        zero = ir.Constant(INDEX, 0)
+        builder.store(value, builder.gep(header, [zero, ir.Constant(INDEX, index)]))
+
+    def _loop(self, builder, count, body):
+        # Emits body(index) for every index in [0, count).
+        with builder.goto_entry_block():
+            index_ptr = builder.alloca(SIZE)
+        builder.store(ir.Constant(SIZE, 0), index_ptr)
+        check_block = builder.append_basic_block("check")
+        body_block = builder.append_basic_block("body")
+        end_block = builder.append_basic_block("end")
+        builder.branch(check_block)
+        builder.position_at_end(check_block)
+        index = builder.load(index_ptr)
+        builder.cbranch(builder.icmp_unsigned("<", index, count), body_block, end_block)
+        builder.position_at_end(body_block)
+        body(index)
+        builder.store(builder.add(index, ir.Constant(SIZE, 1)), index_ptr)
+        builder.branch(check_block)
+        builder.position_at_end(end_block)
+
+    def _define_o_int_pow(self):
+        # Squares and multiplies, wrapping around like the other int
+        # operators. A negative exponent truncates 1 / base ** -exponent,
+        # which is 0 unless the base is 1 or -1.
+        function, builder = self._define("o_int_pow", INDEX, INDEX, INDEX)
+        base, exponent = function.args
+        one = ir.Constant(INDEX, 1)
+        odd = builder.trunc(exponent, ir.IntType(1))
+        with builder.if_then(builder.icmp_signed("<", exponent, ir.Constant(INDEX, 0)), likely=False):
+            sign = builder.select(odd, ir.Constant(INDEX, -1), one)
+            builder.ret(builder.select(builder.icmp_signed("==", base, one), one,
+                                       builder.select(builder.icmp_signed("==", base, ir.Constant(INDEX, -1)),
+                                                      sign, ir.Constant(INDEX, 0))))
+        entry_block = builder.block
+        loop_block = builder.append_basic_block("square")
+        end_block = builder.append_basic_block("done")
+        builder.branch(loop_block)
+        builder.position_at_end(loop_block)
+        result = builder.phi(INDEX)
+        factor = builder.phi(INDEX)
+        rest = builder.phi(INDEX)
+        result.add_incoming(one, entry_block)
+        factor.add_incoming(base, entry_block)
+        rest.add_incoming(exponent, entry_block)
+        done = builder.icmp_signed("==", rest, ir.Constant(INDEX, 0))
+        product = builder.select(builder.trunc(rest, ir.IntType(1)), builder.mul(result, factor), result)
+        result.add_incoming(product, loop_block)
+        factor.add_incoming(builder.mul(factor, factor), loop_block)
+        rest.add_incoming(builder.lshr(rest, one), loop_block)
+        builder.cbranch(done, end_block, loop_block)
+        builder.position_at_end(end_block)
+        builder.ret(result)
+        return function
+
+    def _define_o_array_new(self):
+        function, builder = self._define("o_array_new", GENERIC_ARRAY.as_pointer(), SIZE, SIZE)
+        size, capacity = function.args
+        malloc = self._declare("malloc", BYTE_PTR, SIZE)
+        header = self.check(builder, builder.call(malloc, [sizeof(GENERIC_ARRAY)]))
+        header = builder.bitcast(header, GENERIC_ARRAY.as_pointer())
+        # malloc(0) may return null, which would read as a failure.
+        nbytes = builder.mul(size, capacity)
+        empty = builder.icmp_unsigned("==", nbytes, ir.Constant(SIZE, 0))
+        data = self.check(builder, builder.call(malloc, [builder.select(empty, ir.Constant(SIZE, 1), nbytes)]))
+        self.set_field(builder, header, 0, ir.Constant(SIZE, 0))
+        self.set_field(builder, header, 1, capacity)
+        self.set_field(builder, header, 2, data)
+        builder.ret(header)
+        return function
+
+    def _define_o_array_push(self):
+        # Returns the address of a new slot at the end of the array; the
+        # caller stores the element there. Capacity doubles when the array
+        # is full, so appending is amortized O(1).
+        function, builder = self._define("o_array_push", BYTE_PTR, GENERIC_ARRAY.as_pointer(), SIZE)
+        header, size = function.args
+        zero = ir.Constant(INDEX, 0)
+        length_ptr = builder.gep(header, [zero, ir.Constant(INDEX, 0)])
+        capacity_ptr = builder.gep(header, [zero, ir.Constant(INDEX, 1)])
+        data_ptr = builder.gep(header, [zero, ir.Constant(INDEX, 2)])
+        length = builder.load(length_ptr, "len")
+        capacity = builder.load(capacity_ptr, "cap")
+        with builder.if_then(builder.icmp_unsigned("==", length, capacity), likely=False):
+            doubled = builder.shl(capacity, ir.Constant(SIZE, 1))
+            grown = builder.select(builder.icmp_unsigned("<", doubled, ir.Constant(SIZE, 4)),
+                                   ir.Constant(SIZE, 4), doubled)
+            realloc = self._declare("realloc", BYTE_PTR, BYTE_PTR, SIZE)
+            data = builder.call(realloc, [builder.load(data_ptr), builder.mul(grown, size)])
+            builder.store(self.check(builder, data), data_ptr)
+            builder.store(grown, capacity_ptr)
+        builder.store(builder.add(length, ir.Constant(SIZE, 1)), length_ptr)
+        slot = builder.gep(builder.load(data_ptr, "data"), [builder.mul(length, size)])
+        builder.ret(slot)
+        return function
+
+    def _define_o_array_free(self):
+        function, builder = self._define("o_array_free", ir.VoidType(), GENERIC_ARRAY.as_pointer())
+        header = function.args[0]
+        free = self._declare("free", ir.VoidType(), BYTE_PTR)
+        with builder.if_then(builder.icmp_unsigned("!=", header, ir.Constant(header.type, None))):
+            builder.call(free, [self.data(builder, header)])
+            builder.call(free, [builder.bitcast(header, BYTE_PTR)])
+        builder.ret_void()
+        return function
+
+    def free_array(self, builder, array):
+        builder.call(self.function("o_array_free"), [builder.bitcast(array, GENERIC_ARRAY.as_pointer())])
+
+    def new_array(self, builder, element, capacity):
+        header = builder.call(self.function("o_array_new"), [sizeof(element), capacity])
+        return builder.bitcast(header, array_type(element).as_pointer())
+
+    def push(self, builder, array, value):
+        generic = builder.bitcast(array, GENERIC_ARRAY.as_pointer())
+        slot = builder.call(self.function("o_array_push"), [generic, sizeof(value.type)])
+        builder.store(value, builder.bitcast(slot, value.type.as_pointer()))
+
+    def abort(self, builder):
+        builder.call(self._declare("abort", ir.VoidType()), [])
+        builder.unreachable()
+
+    def _define_o_alloc(self):
+        # Storage of the objects that outlive the frame creating them.
+        # Coroutines free their frames when they finish; instances of
+        # classes that escape are never freed.
+        function, builder = self._define("o_alloc", BYTE_PTR, SIZE)
+        malloc = self._declare("malloc", BYTE_PTR, SIZE)
+        builder.ret(self.check(builder, builder.call(malloc, [function.args[0]])))
+        return function
+
+    def alloc(self, builder, ir_type):
+        pointer = builder.call(self.function("o_alloc"), [sizeof(ir_type)])
+        return builder.bitcast(pointer, ir_type.as_pointer())
+
+    def element(self, builder, array, index):
+        # Indexing out of bounds aborts; a negative index is out of bounds
+        # as an unsigned number.
+        outside = builder.icmp_unsigned(">=", builder.sext(index, SIZE), self.length(builder, array))
+        with builder.if_then(outside, likely=False):
+            self.abort(builder)
+        return builder.gep(self.data(builder, array), [index])
+
+    def length(self, builder, array):
+        return self.field(builder, array, 0, "len")
+
+    def set_length(self, builder, array, length):
+        self.set_field(builder, array, 0, length)
+
+    def data(self, builder, array):
+        return self.field(builder, array, 2, "data")
+
+    def _define_map(self, name, kind, rtype, *param_types):
+        return self._define(f"o_map_{kind}_{name}", rtype, GENERIC_MAPS[kind].as_pointer(), *param_types)
+
+    def _map_function(self, name, kind):
+        function = self.module.globals.get(f"o_map_{kind}_{name}")
+        if function is None:
+            function = getattr(self, "_define_o_map_" + name)(kind)
+        return function
+
+    def _hash(self, builder, kind, key):
+        if kind == "int":
+            # Fibonacci hashing spreads runs of consecutive keys apart.
+            value = builder.mul(builder.sext(key, SIZE), ir.Constant(SIZE, 0x9E3779B97F4A7C15))
+            return builder.xor(value, builder.lshr(value, ir.Constant(SIZE, 29)))
+        # FNV-1a over the bytes of the string.
+        with builder.goto_entry_block():
+            hash_ptr = builder.alloca(SIZE)
+            cursor_ptr = builder.alloca(BYTE_PTR)
+        builder.store(ir.Constant(SIZE, 0xCBF29CE484222325), hash_ptr)
+        builder.store(key, cursor_ptr)
+        check_block = builder.append_basic_block("hash")
+        body_block = builder.append_basic_block("hash_byte")
+        end_block = builder.append_basic_block("hashed")
+        builder.branch(check_block)
+        builder.position_at_end(check_block)
+        cursor = builder.load(cursor_ptr)
+        byte = builder.load(cursor)
+        builder.cbranch(builder.icmp_unsigned("!=", byte, ir.Constant(byte.type, 0)), body_block, end_block)
+        builder.position_at_end(body_block)
+        value = builder.xor(builder.load(hash_ptr), builder.zext(byte, SIZE))
+        builder.store(builder.mul(value, ir.Constant(SIZE, 0x100000001B3)), hash_ptr)
+        builder.store(builder.gep(cursor, [ir.Constant(INDEX, 1)]), cursor_ptr)
+        builder.branch(check_block)
+        builder.position_at_end(end_block)
+        return builder.load(hash_ptr)
+
+    def _equal(self, builder, kind, left, right):
+        if kind == "int":
+            return builder.icmp_signed("==", left, right)
+        # Equal pointers are equal strings without looking at the bytes.
+        same = builder.icmp_unsigned("==", left, right)
+        same_block = builder.block
+        compare_block = builder.append_basic_block("compare")
+        join_block = builder.append_basic_block("compared")
+        builder.cbranch(same, join_block, compare_block)
+        builder.position_at_end(compare_block)
+        strcmp = self._declare("strcmp", ir.IntType(32), BYTE_PTR, BYTE_PTR)
+        equal = builder.icmp_signed("==", builder.call(strcmp, [left, right]), ir.Constant(ir.IntType(32), 0))
+        builder.branch(join_block)
+        builder.position_at_end(join_block)
+        result = builder.phi(ir.IntType(1))
+        result.add_incoming(same, same_block)
+        result.add_incoming(equal, compare_block)
+        return result
+
+    def _capacity(self, builder, capacity, count):
+        # The smallest power of two at least as large as capacity that
+        # holds count entries without going over the load factor.
+        with builder.goto_entry_block():
+            capacity_ptr = builder.alloca(SIZE)
+        minimum = ir.Constant(SIZE, MIN_CAPACITY)
+        builder.store(builder.select(builder.icmp_unsigned("<", capacity, minimum), minimum, capacity),
+                      capacity_ptr)
+        check_block = builder.append_basic_block("size")
+        grow_block = builder.append_basic_block("double")
+        end_block = builder.append_basic_block("sized")
+        builder.branch(check_block)
+        builder.position_at_end(check_block)
+        capacity = builder.load(capacity_ptr)
+        full = builder.icmp_unsigned("<", builder.mul(capacity, ir.Constant(SIZE, 3)),
+                                     builder.mul(count, ir.Constant(SIZE, 4)))
+        builder.cbranch(full, grow_block, end_block)
+        builder.position_at_end(grow_block)
+        builder.store(builder.shl(capacity, ir.Constant(SIZE, 1)), capacity_ptr)
+        builder.branch(check_block)
+        builder.position_at_end(end_block)
+        return builder.load(capacity_ptr)
+
+    def _define_o_map_probe(self, kind):
+        # Returns the slot holding key, or the empty slot where it belongs.
+        key_type = KEY_TYPES[kind]
+        function, builder = self._define_map("probe", kind, SIZE, key_type)
+        header, key = function.args
+        mask = builder.sub(self.field(builder, header, 1, "cap"), ir.Constant(SIZE, 1))
+        states = self.field(builder, header, 2, "states")
+        keys = self.field(builder, header, 3, "keys")
+        index_ptr = builder.alloca(SIZE)
+        builder.store(builder.and_(self._hash(builder, kind, key), mask), index_ptr)
+        loop_block = builder.append_basic_block("probe")
+        compare_block = builder.append_basic_block("candidate")
+        next_block = builder.append_basic_block("next")
+        done_block = builder.append_basic_block("found")
+        builder.branch(loop_block)
+        builder.position_at_end(loop_block)
+        index = builder.load(index_ptr, "index")
+        state = builder.load(builder.gep(states, [index]))
+        builder.cbranch(builder.icmp_unsigned("==", state, ir.Constant(state.type, 0)), done_block, compare_block)
+        builder.position_at_end(compare_block)
+        equal = self._equal(builder, kind, builder.load(builder.gep(keys, [index])), key)
+        builder.cbranch(equal, done_block, next_block)
+        builder.position_at_end(next_block)
+        builder.store(builder.and_(builder.add(index, ir.Constant(SIZE, 1)), mask), index_ptr)
+        builder.branch(loop_block)
+        builder.position_at_end(done_block)
+        builder.ret(index)
+        return function
+
+    def _define_o_map_grow(self, kind):
+        key_type = KEY_TYPES[kind]
+        function, builder = self._define_map("grow", kind, ir.VoidType(), SIZE, SIZE)
+        header, size, capacity = function.args
+        old_capacity = self.field(builder, header, 1, "old_cap")
+        old_states = self.field(builder, header, 2, "old_states")
+        old_keys = self.field(builder, header, 3, "old_keys")
+        old_values = self.field(builder, header, 4, "old_values")
+        calloc = self._declare("calloc", BYTE_PTR, SIZE, SIZE)
+        malloc = self._declare("malloc", BYTE_PTR, SIZE)
+        states = self.check(builder, builder.call(calloc, [capacity, ir.Constant(SIZE, 1)]))
+        keys = self.check(builder, builder.call(malloc, [builder.mul(capacity, sizeof(key_type))]))
+        values = self.check(builder, builder.call(malloc, [builder.mul(capacity, size)]))
+        keys = builder.bitcast(keys, key_type.as_pointer())
+        self.set_field(builder, header, 1, capacity)
+        self.set_field(builder, header, 2, states)
+        self.set_field(builder, header, 3, keys)
+        self.set_field(builder, header, 4, values)
+        probe = self._map_function("probe", kind)
+        memcpy = self.module.declare_intrinsic("llvm.memcpy", [BYTE_PTR, BYTE_PTR, SIZE])
+
+        def move(index):
+            state = builder.load(builder.gep(old_states, [index]))
+            with builder.if_then(builder.icmp_unsigned("!=", state, ir.Constant(state.type, 0))):
+                key = builder.load(builder.gep(old_keys, [index]))
+                slot = builder.call(probe, [header, key])
+                builder.store(ir.Constant(ir.IntType(8), 1), builder.gep(states, [slot]))
+                builder.store(key, builder.gep(keys, [slot]))
+                builder.call(memcpy, [builder.gep(values, [builder.mul(slot, size)]),
+                                      builder.gep(old_values, [builder.mul(index, size)]),
+                                      size, ir.Constant(ir.IntType(1), 0)])
+
+        self._loop(builder, old_capacity, move)
+        free = self._declare("free", ir.VoidType(), BYTE_PTR)
+        builder.call(free, [old_states])
+        builder.call(free, [builder.bitcast(old_keys, BYTE_PTR)])
+        builder.call(free, [old_values])
+        builder.ret_void()
+        return function
+
+    def _define_o_map_new(self, kind):
+        generic = GENERIC_MAPS[kind]
+        function, builder = self._define(f"o_map_{kind}_new", generic.as_pointer(), SIZE, SIZE)
+        size, count = function.args
+        malloc = self._declare("malloc", BYTE_PTR, SIZE)
+        header = self.check(builder, builder.call(malloc, [sizeof(generic)]))
+        header = builder.bitcast(header, generic.as_pointer())
+        builder.store(ir.Constant(generic, None), header)
+        # Growing an empty table allocates it at the capacity asked for.
+        capacity = self._capacity(builder, ir.Constant(SIZE, MIN_CAPACITY), count)
+        builder.call(self._map_function("grow", kind), [header, size, capacity])
+        builder.ret(header)
+        return function
+
+    def _define_o_map_slot(self, kind):
+        # Returns the value slot for key, inserting the key if it is new.
+        function, builder = self._define_map("slot", kind, BYTE_PTR, KEY_TYPES[kind], SIZE)
+        header, key, size = function.args
+        length = self.field(builder, header, 0, "len")
+        capacity = self.field(builder, header, 1, "cap")
+        full = builder.icmp_unsigned("<", builder.mul(capacity, ir.Constant(SIZE, 3)),
+                                     builder.mul(builder.add(length, ir.Constant(SIZE, 1)), ir.Constant(SIZE, 4)))
+        with builder.if_then(full, likely=False):
+            builder.call(self._map_function("grow", kind),
+                         [header, size, builder.shl(capacity, ir.Constant(SIZE, 1))])
+        index = builder.call(self._map_function("probe", kind), [header, key])
+        state_ptr = builder.gep(self.field(builder, header, 2, "states"), [index])
+        state = builder.load(state_ptr)
+        with builder.if_then(builder.icmp_unsigned("==", state, ir.Constant(state.type, 0))):
+            builder.store(ir.Constant(state.type, 1), state_ptr)
+            builder.store(key, builder.gep(self.field(builder, header, 3, "keys"), [index]))
+            self.set_field(builder, header, 0, builder.add(length, ir.Constant(SIZE, 1)))
+        builder.ret(builder.gep(self.field(builder, header, 4, "values"), [builder.mul(index, size)]))
+        return function
+
+    def _define_o_map_find(self, kind):
+        # Returns the value slot for key, or null when it is missing.
+        function, builder = self._define_map("find", kind, BYTE_PTR, KEY_TYPES[kind], SIZE)
+        header, key, size = function.args
+        index = builder.call(self._map_function("probe", kind), [header, key])
+        state = builder.load(builder.gep(self.field(builder, header, 2, "states"), [index]))
+        with builder.if_then(builder.icmp_unsigned("==", state, ir.Constant(state.type, 0))):
+            builder.ret(ir.Constant(BYTE_PTR, None))
+        builder.ret(builder.gep(self.field(builder, header, 4, "values"), [builder.mul(index, size)]))
+        return function
+
+    def _define_o_map_merge(self, kind):
+        # Copies every entry of the second map into the first, growing the
+        # first once up front instead of on the way.
+        generic = GENERIC_MAPS[kind]
+        function, builder = self._define_map("merge", kind, ir.VoidType(), generic.as_pointer(), SIZE)
+        target, source, size = function.args
+        capacity = self.field(builder, target, 1, "cap")
+        count = builder.add(self.field(builder, target, 0, "len"), self.field(builder, source, 0, "len"))
+        grown = self._capacity(builder, capacity, count)
+        with builder.if_then(builder.icmp_unsigned(">", grown, capacity)):
+            builder.call(self._map_function("grow", kind), [target, size, grown])
+        states = self.field(builder, source, 2, "states")
+        keys = self.field(builder, source, 3, "keys")
+        values = self.field(builder, source, 4, "values")
+        slot_function = self._map_function("slot", kind)
+        memcpy = self.module.declare_intrinsic("llvm.memcpy", [BYTE_PTR, BYTE_PTR, SIZE])
+
+        def copy(index):
+            state = builder.load(builder.gep(states, [index]))
+            with builder.if_then(builder.icmp_unsigned("!=", state, ir.Constant(state.type, 0))):
+                slot = builder.call(slot_function, [target, builder.load(builder.gep(keys, [index])), size])
+                builder.call(memcpy, [slot, builder.gep(values, [builder.mul(index, size)]),
+                                      size, ir.Constant(ir.IntType(1), 0)])
+
+        self._loop(builder, self.field(builder, source, 1, "cap"), copy)
+        builder.ret_void()
+        return function
+
+    def _generic_map(self, builder, map):
+        kind = "int" if key_type(map.type) == KEY_TYPES["int"] else "str"
+        return kind, builder.bitcast(map, GENERIC_MAPS[kind].as_pointer())
+
+    def new_map(self, builder, key, value, count):
+        kind = "int" if key == KEY_TYPES["int"] else "str"
+        header = builder.call(self._map_function("new", kind), [sizeof(value), count])
+        return builder.bitcast(header, map_type(key, value).as_pointer())
+
+    def map_slot(self, builder, map, key):
+        kind, generic = self._generic_map(builder, map)
+        slot = builder.call(self._map_function("slot", kind), [generic, key, sizeof(value_type(map.type))])
+        return builder.bitcast(slot, value_type(map.type).as_pointer())
+
+    def map_find(self, builder, map, key):
+        kind, generic = self._generic_map(builder, map)
+        slot = builder.call(self._map_function("find", kind), [generic, key, sizeof(value_type(map.type))])
+        return builder.bitcast(slot, value_type(map.type).as_pointer())
+
+    def map_merge(self, builder, target, source):
+        size = sizeof(value_type(target.type))
+        kind, target = self._generic_map(builder, target)
+        _, source = self._generic_map(builder, source)
+        builder.call(self._map_function("merge", kind), [target, source, size])
+
+    def constant_string(self, text, name):
+        data = bytearray(text.encode()) + b"\0"
+        initializer = ir.Constant(string_type(len(data) - 1), [
+            ir.Constant(SIZE, len(data) - 1),
+            ir.Constant(ir.ArrayType(ir.IntType(8), len(data)), data),
+        ])
+        variable = ir.GlobalVariable(self.module, initializer.type, name=name)
+        variable.linkage = "private"
+        variable.global_constant = True
+        variable.unnamed_addr = True
+        variable.initializer = initializer
+        return variable.gep([ir.Constant(INDEX, 0), ir.Constant(INDEX, 1), ir.Constant(INDEX, 0)])
+
+    def _define_o_str_new(self):
+        # Returns a string of the given length for the caller to fill in.
+        function, builder = self._define("o_str_new", BYTE_PTR, SIZE)
+        length = function.args[0]
+        malloc = self._declare("malloc", BYTE_PTR, SIZE)
+        size = builder.add(builder.add(length, sizeof(SIZE)), ir.Constant(SIZE, 1))
+        header = self.check(builder, builder.call(malloc, [size]))
+        builder.store(length, builder.bitcast(header, SIZE.as_pointer()))
+        data = builder.gep(header, [sizeof(SIZE)])
+        builder.store(ir.Constant(ir.IntType(8), 0), builder.gep(data, [length]))
+        builder.ret(data)
+        return function
+
+    def _magnitude(self, builder, value):
+        # Widened first, so the magnitude of the smallest int fits.
+        value = builder.sext(value, SIZE)
+        negative = builder.icmp_signed("<", value, ir.Constant(SIZE, 0))
+        return negative, builder.select(negative, builder.neg(value), value)
+
+    def _define_o_str_int_length(self):
+        function, builder = self._define("o_str_int_length", SIZE, INDEX)
+        negative, magnitude = self._magnitude(builder, function.args[0])
+        first = builder.add(builder.zext(negative, SIZE), ir.Constant(SIZE, 1))
+        entry_block = builder.block
+        loop_block = builder.append_basic_block("digits")
+        end_block = builder.append_basic_block("counted")
+        builder.branch(loop_block)
+        builder.position_at_end(loop_block)
+        rest = builder.phi(SIZE)
+        count = builder.phi(SIZE)
+        rest.add_incoming(magnitude, entry_block)
+        count.add_incoming(first, entry_block)
+        ten = ir.Constant(SIZE, 10)
+        rest.add_incoming(builder.udiv(rest, ten), loop_block)
+        count.add_incoming(builder.add(count, ir.Constant(SIZE, 1)), loop_block)
+        builder.cbranch(builder.icmp_unsigned(">=", rest, ten), loop_block, end_block)
+        builder.position_at_end(end_block)
+        builder.ret(count)
+        return function
+
+    def _define_o_str_write_int(self):
+        # Writes the digits backwards from the end of the space measured
+        # for them by o_str_int_length.
+        function, builder = self._define("o_str_write_int", ir.VoidType(), BYTE_PTR, INDEX, SIZE)
+        target, value, length = function.args
+        negative, magnitude = self._magnitude(builder, value)
+        with builder.if_then(negative):
+            builder.store(ir.Constant(ir.IntType(8), ord("-")), target)
+        start_block = builder.block
+        loop_block = builder.append_basic_block("digit")
+        end_block = builder.append_basic_block("written")
+        builder.branch(loop_block)
+        builder.position_at_end(loop_block)
+        rest = builder.phi(SIZE)
+        position = builder.phi(SIZE)
+        rest.add_incoming(magnitude, start_block)
+        position.add_incoming(length, start_block)
+        ten = ir.Constant(SIZE, 10)
+        previous = builder.sub(position, ir.Constant(SIZE, 1))
+        digit = builder.trunc(builder.urem(rest, ten), ir.IntType(8))
+        builder.store(builder.add(digit, ir.Constant(ir.IntType(8), ord("0"))), builder.gep(target, [previous]))
+        quotient = builder.udiv(rest, ten)
+        rest.add_incoming(quotient, loop_block)
+        position.add_incoming(previous, loop_block)
+        builder.cbranch(builder.icmp_unsigned("!=", quotient, ir.Constant(SIZE, 0)), loop_block, end_block)
+        builder.position_at_end(end_block)
+        builder.ret_void()
+        return function
+
+    def _double_format(self, text):
+        name = ".double_format." + text[2:-1]
+        variable = self.module.globals.get(name)
+        if variable is None:
+            data = bytearray(text.encode()) + b"\0"
+            initializer = ir.Constant(ir.ArrayType(ir.IntType(8), len(data)), data)
+            variable = ir.GlobalVariable(self.module, initializer.type, name=name)
+            variable.linkage = "private"
+            variable.global_constant = True
+            variable.unnamed_addr = True
+            variable.initializer = initializer
+        return variable.gep([ir.Constant(INDEX, 0), ir.Constant(INDEX, 0)])
+
+    def _define_o_double_format(self):
+        function, builder = self._define("o_double_format", BYTE_PTR, ir.DoubleType())
+        value = function.args[0]
+        snprintf = self._declare("snprintf", ir.IntType(32), BYTE_PTR, SIZE, BYTE_PTR, var_arg=True)
+        strtod = self._declare("strtod", ir.DoubleType(), BYTE_PTR, BYTE_PTR.as_pointer())
+        buffer = builder.alloca(ir.ArrayType(ir.IntType(8), 32))
+        text = builder.gep(buffer, [ir.Constant(INDEX, 0), ir.Constant(INDEX, 0)])
+        for format in DOUBLE_FORMATS[:-1]:
+            builder.call(snprintf, [text, ir.Constant(SIZE, 32), self._double_format(format), value])
+            parsed = builder.call(strtod, [text, ir.Constant(BYTE_PTR.as_pointer(), None)])
+            with builder.if_then(builder.fcmp_ordered("==", parsed, value)):
+                builder.ret(self._double_format(format))
+        builder.ret(self._double_format(DOUBLE_FORMATS[-1]))
+        return function
+
+    def _snprintf(self, builder, target, size, value):
+        snprintf = self._declare("snprintf", ir.IntType(32), BYTE_PTR, SIZE, BYTE_PTR, var_arg=True)
+        format = builder.call(self.function("o_double_format"), [value])
+        return builder.call(snprintf, [target, size, format, value])
+
+    def string_length(self, builder, string):
+        header = builder.bitcast(string, SIZE.as_pointer())
+        return builder.load(builder.gep(header, [ir.Constant(INDEX, -1)]), "len")
+
+    def _measure(self, builder, pieces):
+        # Pieces are (value, kind) pairs, kind being "str", "int" or "double".
+        lengths = []
+        for value, kind in pieces:
+            if kind == "str":
+                lengths.append(self.string_length(builder, value))
+            elif kind == "int":
+                lengths.append(builder.call(self.function("o_str_int_length"), [value]))
+            else:
+                null = ir.Constant(BYTE_PTR, None)
+                lengths.append(builder.sext(self._snprintf(builder, null, ir.Constant(SIZE, 0), value), SIZE))
+        total = lengths[0] if lengths else ir.Constant(SIZE, 0)
+        for length in lengths[1:]:
+            total = builder.add(total, length)
+        return lengths, total
+
+    def _write(self, builder, cursor, pieces, lengths):
+        memcpy = self.module.declare_intrinsic("llvm.memcpy", [BYTE_PTR, BYTE_PTR, SIZE])
+        for (value, kind), length in zip(pieces, lengths):
+            if kind == "str":
+                builder.call(memcpy, [cursor, value, length, ir.Constant(ir.IntType(1), 0)])
+            elif kind == "int":
+                builder.call(self.function("o_str_write_int"), [cursor, value, length])
+            else:
+                # The terminator lands where the next piece starts.
+                self._snprintf(builder, cursor, builder.add(length, ir.Constant(SIZE, 1)), value)
+            cursor = builder.gep(cursor, [length])
+
+    def format(self, builder, pieces):
+        # Every piece is measured first, so the result is allocated once at
+        # its exact length and each piece is written straight into place.
+        lengths, total = self._measure(builder, pieces)
+        result = builder.call(self.function("o_str_new"), [total])
+        self._write(builder, result, pieces, lengths)
+        return result
+
+    def _global(self, name, ir_type, value=None):
+        variable = self.module.globals.get(name)
+        if variable is None:
+            variable = ir.GlobalVariable(self.module, ir_type, name=name)
+            variable.linkage = "linkonce_odr"
+            variable.initializer = ir.Constant(ir_type, value)
+        return variable
+
+    def _define_o_log_init(self):
+        function, builder = self._define("o_log_init", ir.VoidType())
+        release_type = ir.FunctionType(ir.VoidType(), [BYTE_PTR]).as_pointer()
+        create = self._declare("pthread_key_create", ir.IntType(32), INDEX.as_pointer(), release_type)
+        builder.call(create, [self._global("o_log_key", INDEX, 0), self.function("o_log_release")])
+        builder.ret_void()
+        return function
+
+    def _define_o_log_buffer(self):
+        # Every thread logs into a buffer of its own, kept under a pthread
+        # key; the key flushes and frees the buffer when its thread exits.
+        function, builder = self._define("o_log_buffer", GENERIC_ARRAY.as_pointer())
+        once = self._declare("pthread_once", ir.IntType(32), INDEX.as_pointer(),
+                             ir.FunctionType(ir.VoidType(), []).as_pointer())
+        builder.call(once, [self._global("o_log_once", INDEX, 0), self.function("o_log_init")])
+        key = builder.load(self._global("o_log_key", INDEX, 0))
+        get = self._declare("pthread_getspecific", BYTE_PTR, INDEX)
+        buffer = builder.call(get, [key])
+        with builder.if_then(builder.icmp_unsigned("==", buffer, ir.Constant(BYTE_PTR, None)), likely=False):
+            new = builder.call(self.function("o_array_new"), [ir.Constant(SIZE, 1), ir.Constant(SIZE, LOG_CAPACITY)])
+            store = self._declare("pthread_setspecific", ir.IntType(32), INDEX, BYTE_PTR)
+            builder.call(store, [key, builder.bitcast(new, BYTE_PTR)])
+            builder.ret(new)
+        builder.ret(builder.bitcast(buffer, GENERIC_ARRAY.as_pointer()))
+        return function
+
+    def _define_o_log_drain(self):
+        # Hands the whole buffer to write(2), a call per buffer rather than
+        # per message; short writes are retried and errors drop the rest.
+        function, builder = self._define("o_log_drain", ir.VoidType(), GENERIC_ARRAY.as_pointer())
+        buffer = function.args[0]
+        write = self._declare("write", SIZE, ir.IntType(32), BYTE_PTR, SIZE)
+        length = self.length(builder, buffer)
+        data = self.data(builder, buffer)
+        with builder.goto_entry_block():
+            written_ptr = builder.alloca(SIZE)
+        builder.store(ir.Constant(SIZE, 0), written_ptr)
+        check_block = builder.append_basic_block("check")
+        body_block = builder.append_basic_block("write")
+        end_block = builder.append_basic_block("drained")
+        builder.branch(check_block)
+        builder.position_at_end(check_block)
+        written = builder.load(written_ptr)
+        builder.cbranch(builder.icmp_unsigned("<", written, length), body_block, end_block)
+        builder.position_at_end(body_block)
+        result = builder.call(write, [ir.Constant(ir.IntType(32), 1), builder.gep(data, [written]),
+                                      builder.sub(length, written)])
+        builder.store(builder.add(written, result), written_ptr)
+        builder.cbranch(builder.icmp_signed(">", result, ir.Constant(SIZE, 0)), check_block, end_block)
+        builder.position_at_end(end_block)
+        self.set_length(builder, buffer, ir.Constant(SIZE, 0))
+        builder.ret_void()
+        return function
+
+    def _define_o_log_release(self):
+        function, builder = self._define("o_log_release", ir.VoidType(), BYTE_PTR)
+        buffer = builder.bitcast(function.args[0], GENERIC_ARRAY.as_pointer())
+        builder.call(self.function("o_log_drain"), [buffer])
+        free = self._declare("free", ir.VoidType(), BYTE_PTR)
+        builder.call(free, [self.data(builder, buffer)])
+        builder.call(free, [function.args[0]])
+        builder.ret_void()
+        return function
+
+    def _define_o_log_flush(self):
+        # Kept even when nothing in the module calls it, so code that is
+        # not entered through main can flush its output too.
+        function, builder = self._define("o_log_flush", ir.VoidType())
+        function.linkage = "weak_odr"
+        builder.call(self.function("o_log_drain"), [builder.call(self.function("o_log_buffer"), [])])
+        builder.ret_void()
+        return function
+
+    def _define_o_log_reserve(self):
+        # Returns room for a message of the given length in the buffer,
+        # flushing it first when the message does not fit. A byte to spare
+        # is always left for the terminator snprintf writes.
+        function, builder = self._define("o_log_reserve", BYTE_PTR, SIZE)
+        size = function.args[0]
+        buffer = builder.call(self.function("o_log_buffer"), [])
+        length = self.length(builder, buffer)
+        capacity = self.field(builder, buffer, 1, "cap")
+        with builder.if_then(builder.icmp_unsigned(">=", builder.add(length, size), capacity)):
+            builder.call(self.function("o_log_drain"), [buffer])
+            with builder.if_then(builder.icmp_unsigned(">=", size, capacity), likely=False):
+                grown = builder.add(size, ir.Constant(SIZE, 1))
+                realloc = self._declare("realloc", BYTE_PTR, BYTE_PTR, SIZE)
+                data = self.check(builder, builder.call(realloc, [self.data(builder, buffer), grown]))
+                self.set_field(builder, buffer, 1, grown)
+                self.set_field(builder, buffer, 2, data)
+        length = self.length(builder, buffer)
+        self.set_length(builder, buffer, builder.add(length, size))
+        builder.ret(builder.gep(self.data(builder, buffer), [length]))
+        return function
+
+    def log(self, builder, pieces):
+        # Messages are formatted straight into the log buffer.
+        lengths, total = self._measure(builder, pieces)
+        cursor = builder.call(self.function("o_log_reserve"), [total])
+        self._write(builder, cursor, pieces, lengths)
+
+    def exception_type(self, name):
+        # Exceptions are identified by their name alone. The C++ runtime
+        # compares type_info names, so modules raising and catching the
+        # same name agree even when they are not linked together.
+        type_info = self.module.globals.get(f"o.exception.{name}")
+        if type_info is None:
+            data = bytearray(f"O.{name}".encode()) + b"\0"
+            text = self._global(f"o.exception.{name}.name", ir.ArrayType(ir.IntType(8), len(data)), data)
+            text.global_constant = True
+            vtable = self.module.globals.get(CLASS_TYPE_INFO)
+            if vtable is None:
+                vtable = ir.GlobalVariable(self.module, BYTE_PTR, name=CLASS_TYPE_INFO)
+            type_info = self._global(f"o.exception.{name}", TYPE_INFO, [
+                vtable.gep([ir.Constant(INDEX, 2)]).bitcast(BYTE_PTR), text.bitcast(BYTE_PTR)])
+            type_info.global_constant = True
+        return type_info.bitcast(BYTE_PTR)
+
+    def _define_o_raise(self):
+        # Exceptions carry nothing but their type.
+        function, builder = self._define("o_raise", ir.VoidType(), BYTE_PTR)
+        function.attributes.add("noreturn")
+        allocate = self._declare("__cxa_allocate_exception", BYTE_PTR, SIZE)
+        throw = self._declare("__cxa_throw", ir.VoidType(), BYTE_PTR, BYTE_PTR, BYTE_PTR)
+        exception = builder.call(allocate, [ir.Constant(SIZE, 1)])
+        builder.call(throw, [exception, function.args[0], ir.Constant(BYTE_PTR, None)])
+        builder.unreachable()
+        return function
+
+    def personality(self, function):
+        function.attributes.personality = self._declare(PERSONALITY, INDEX, var_arg=True)
+        function.attributes.add("uwtable")
+
+    def selects(self, builder, pad, type_info):
+        typeid = self._declare("llvm.eh.typeid.for", INDEX, BYTE_PTR)
+        return builder.icmp_signed("==", builder.extract_value(pad, 1), builder.call(typeid, [type_info]))
+
+    def catch(self, builder, pad):
+        # Handlers do not look at the exception, so it is freed before
+        # they run and they may raise again.
+        builder.call(self._declare("__cxa_begin_catch", BYTE_PTR, BYTE_PTR), [builder.extract_value(pad, 0)])
+        builder.call(self._declare("__cxa_end_catch", ir.VoidType()), [])
+
+    def coroutine(self, builder, promise):
+        # Begins the coroutine of the function being built. Its frame is
+        # on the heap unless LLVM elides it.
+        function = builder.function
+        function.attributes = CoroutineAttributes(["presplitcoroutine"])
+        null = ir.Constant(BYTE_PTR, None)
+        coro_id = builder.call(self._declare("llvm.coro.id", TOKEN, INDEX, BYTE_PTR, BYTE_PTR, BYTE_PTR),
+                               [ir.Constant(INDEX, 0), builder.bitcast(promise, BYTE_PTR), null, null])
+        entry_block = builder.block
+        with builder.if_then(builder.call(self._declare("llvm.coro.alloc", ir.IntType(1), TOKEN), [coro_id])):
+            size = builder.call(self._declare("llvm.coro.size.i64", SIZE), [])
+            memory = builder.call(self.function("o_alloc"), [size])
+            alloc_block = builder.block
+        frame = builder.phi(BYTE_PTR)
+        frame.add_incoming(null, entry_block)
+        frame.add_incoming(memory, alloc_block)
+        handle = builder.call(self._declare("llvm.coro.begin", BYTE_PTR, TOKEN, BYTE_PTR), [coro_id, frame])
+        self.set_field(builder, promise, 0, null)
+        coroutine = Coroutine(handle, promise, builder.append_basic_block("final"),
+                              builder.append_basic_block("suspended"), builder.append_basic_block("cleanup"))
+        with builder.goto_block(coroutine.suspended):
+            builder.call(self._declare("llvm.coro.end", ir.VoidType(), BYTE_PTR, ir.IntType(1), TOKEN),
+                         [handle, ir.Constant(ir.IntType(1), False), NO_TOKEN])
+            builder.ret(handle)
+        with builder.goto_block(coroutine.cleanup):
+            memory = builder.call(self._declare("llvm.coro.free", BYTE_PTR, TOKEN, BYTE_PTR), [coro_id, handle])
+            builder.call(self._declare("free", ir.VoidType(), BYTE_PTR), [memory])
+            builder.branch(coroutine.suspended)
+        return coroutine
+
+    def suspend(self, builder, coroutine, final=False):
+        state = builder.call(self._declare("llvm.coro.suspend", ir.IntType(8), TOKEN, ir.IntType(1)),
+                             [NO_TOKEN, ir.Constant(ir.IntType(1), final)])
+        resume_block = builder.append_basic_block("resume")
+        switch = builder.switch(state, coroutine.suspended)
+        switch.add_case(ir.Constant(ir.IntType(8), 0), resume_block)
+        switch.add_case(ir.Constant(ir.IntType(8), 1), coroutine.cleanup)
+        builder.position_at_end(resume_block)
+        if final:
+            # Nothing resumes a coroutine that has finished.
+            builder.unreachable()
+
+    def finish(self, builder, coroutine):
+        # The coroutine awaiting this one runs next. When nothing awaits it,
+        # the loop frees it instead.
+        builder.position_at_end(coroutine.final)
+        waiter = self.field(builder, coroutine.promise, 0, "waiter")
+        with builder.if_then(builder.icmp_unsigned("!=", waiter, ir.Constant(BYTE_PTR, None))):
+            builder.call(self.function("o_task_schedule"), [waiter])
+        self.suspend(builder, coroutine, final=True)
+
+    def promise(self, builder, handle, promise_type):
+        promise = self._declare("llvm.coro.promise", BYTE_PTR, BYTE_PTR, INDEX, ir.IntType(1))
+        pointer = builder.call(promise, [handle, ir.Constant(INDEX, PROMISE_ALIGN), ir.Constant(ir.IntType(1), False)])
+        return builder.bitcast(pointer, promise_type.as_pointer())
+
+    def spawn(self, builder, task):
+        builder.call(self.function("o_task_schedule"), [task])
+
+    def await_task(self, builder, coroutine, task, promise_type):
+        # The task wakes its awaiter when it finishes, which then takes its
+        # result and frees it.
+        promise = self.promise(builder, task, promise_type)
+        self.set_field(builder, promise, 0, coroutine.handle)
+        self.spawn(builder, task)
+        self.suspend(builder, coroutine)
+        result = self.field(builder, promise, 1, "result") if len(promise_type.elements) > 1 else None
+        builder.call(self._declare("llvm.coro.destroy", ir.VoidType(), BYTE_PTR), [task])
+        return result
+
+    def sleep(self, builder, coroutine, milliseconds):
+        builder.call(self.function("o_loop_sleep"), [coroutine.handle, milliseconds])
+        self.suspend(builder, coroutine)
+
+    def wait(self, builder, coroutine, fd, event):
+        builder.call(self.function("o_loop_wait"), [coroutine.handle, fd, ir.Constant(INDEX, EVENTS[event])])
+        self.suspend(builder, coroutine)
+
+    def _queue(self, builder, name, element):
+        # The loop's queues are made on first use.
+        variable = self._global(name, GENERIC_ARRAY.as_pointer())
+        with builder.if_then(builder.icmp_unsigned("==", builder.load(variable), ir.Constant(variable.value_type, None)),
+                             likely=False):
+            builder.store(builder.call(self.function("o_array_new"), [sizeof(element), ir.Constant(SIZE, 64)]),
+                          variable)
+        return builder.load(variable)
+
+    def _define_o_task_schedule(self):
+        function, builder = self._define("o_task_schedule", ir.VoidType(), BYTE_PTR)
+        queue = self._queue(builder, "o_loop_ready", BYTE_PTR)
+        slot = builder.call(self.function("o_array_push"), [queue, sizeof(BYTE_PTR)])
+        builder.store(function.args[0], builder.bitcast(slot, BYTE_PTR.as_pointer()))
+        builder.ret_void()
+        return function
+
+    def _define_o_loop_now(self):
+        # Milliseconds on the monotonic clock.
+        function, builder = self._define("o_loop_now", SIZE)
+        with builder.goto_entry_block():
+            time = builder.alloca(TIMESPEC)
+        clock = self._declare("clock_gettime", INDEX, INDEX, TIMESPEC.as_pointer())
+        builder.call(clock, [ir.Constant(INDEX, CLOCK_MONOTONIC), time])
+        seconds = builder.mul(self.field(builder, time, 0), ir.Constant(SIZE, 1000))
+        builder.ret(builder.add(seconds, builder.sdiv(self.field(builder, time, 1), ir.Constant(SIZE, 1000000))))
+        return function
+
+    def _define_o_loop_sleep(self):
+        function, builder = self._define("o_loop_sleep", ir.VoidType(), BYTE_PTR, INDEX)
+        handle, milliseconds = function.args
+        timers = self._queue(builder, "o_loop_timers", TIMER)
+        deadline = builder.add(builder.call(self.function("o_loop_now"), []), builder.sext(milliseconds, SIZE))
+        slot = builder.call(self.function("o_array_push"), [timers, sizeof(TIMER)])
+        timer = builder.bitcast(slot, TIMER.as_pointer())
+        self.set_field(builder, timer, 0, deadline)
+        self.set_field(builder, timer, 1, handle)
+        builder.ret_void()
+        return function
+
+    def _define_o_loop_poller(self):
+        function, builder = self._define("o_loop_poller", INDEX)
+        variable = self._global("o_loop_poller_fd", INDEX, -1)
+        fd = builder.load(variable)
+        with builder.if_then(builder.icmp_signed("<", fd, ir.Constant(INDEX, 0)), likely=False):
+            create = self._declare("epoll_create1", INDEX, INDEX)
+            created = builder.call(create, [ir.Constant(INDEX, EPOLL_CLOEXEC)])
+            with builder.if_then(builder.icmp_signed("<", created, ir.Constant(INDEX, 0)), likely=False):
+                self.abort(builder)
+            builder.store(created, variable)
+            builder.ret(created)
+        builder.ret(fd)
+        return function
+
+    def _define_o_loop_wait(self):
+        # Descriptors are registered for one event at a time and stay
+        # registered once it has fired, so waiting again modifies them.
+        # Descriptors epoll cannot wait on abort.
+        function, builder = self._define("o_loop_wait", ir.VoidType(), BYTE_PTR, INDEX, INDEX)
+        handle, fd, events = function.args
+        with builder.goto_entry_block():
+            event = builder.alloca(EPOLL_EVENT)
+        self.set_field(builder, event, 0, builder.or_(events, ir.Constant(INDEX, EPOLLONESHOT)))
+        self.set_field(builder, event, 1, builder.ptrtoint(handle, SIZE))
+        control = self._declare("epoll_ctl", INDEX, INDEX, INDEX, INDEX, EPOLL_EVENT.as_pointer())
+        poller = builder.call(self.function("o_loop_poller"), [])
+        added = builder.call(control, [poller, ir.Constant(INDEX, EPOLL_CTL_ADD), fd, event])
+        with builder.if_then(builder.icmp_signed("!=", added, ir.Constant(INDEX, 0))):
+            modified = builder.call(control, [poller, ir.Constant(INDEX, EPOLL_CTL_MOD), fd, event])
+            with builder.if_then(builder.icmp_signed("!=", modified, ir.Constant(INDEX, 0)), likely=False):
+                self.abort(builder)
+        waiting = self._global("o_loop_waiting", SIZE, 0)
+        builder.store(builder.add(builder.load(waiting), ir.Constant(SIZE, 1)), waiting)
+        builder.ret_void()
+        return function
+
+    def _define_o_loop_run(self):
+        # Runs tasks until none is ready, then sleeps in epoll until a
+        # descriptor is ready or the earliest timer is due, and returns once
+        # nothing is left to wait for. Kept like o_log_flush for code not
+        # entered through main.
+        function, builder = self._define("o_loop_run", ir.VoidType())
+        function.linkage = "weak_odr"
+        head = self._global("o_loop_head", SIZE, 0)
+        waiting = self._global("o_loop_waiting", SIZE, 0)
+        with builder.goto_entry_block():
+            events = builder.alloca(ir.ArrayType(EPOLL_EVENT, EPOLL_BATCH))
+            earliest = builder.alloca(SIZE)
+            index_ptr = builder.alloca(SIZE)
+        zero = ir.Constant(SIZE, 0)
+        run_block = builder.append_basic_block("run")
+        builder.branch(run_block)
+        builder.position_at_end(run_block)
+
+        # Tasks queued while the queue drains run in the same pass.
+        ready = self._queue(builder, "o_loop_ready", BYTE_PTR)
+        check_block = builder.append_basic_block("check")
+        resume_block = builder.append_basic_block("resume")
+        drained_block = builder.append_basic_block("drained")
+        builder.branch(check_block)
+        builder.position_at_end(check_block)
+        index = builder.load(head)
+        builder.cbranch(builder.icmp_unsigned("<", index, self.length(builder, ready)), resume_block, drained_block)
+        builder.position_at_end(resume_block)
+        handles = builder.bitcast(self.data(builder, ready), BYTE_PTR.as_pointer())
+        handle = builder.load(builder.gep(handles, [index]))
+        builder.store(builder.add(index, ir.Constant(SIZE, 1)), head)
+        builder.call(self._declare("llvm.coro.resume", ir.VoidType(), BYTE_PTR), [handle])
+        done = builder.call(self._declare("llvm.coro.done", ir.IntType(1), BYTE_PTR), [handle])
+        with builder.if_then(done):
+            promise = self.promise(builder, handle, promise_type(None))
+            detached = builder.icmp_unsigned("==", self.field(builder, promise, 0), ir.Constant(BYTE_PTR, None))
+            with builder.if_then(detached):
+                builder.call(self._declare("llvm.coro.destroy", ir.VoidType(), BYTE_PTR), [handle])
+        builder.branch(check_block)
+        builder.position_at_end(drained_block)
+        self.set_length(builder, ready, zero)
+        builder.store(zero, head)
+
+        timers = self._queue(builder, "o_loop_timers", TIMER)
+        count = self.length(builder, timers)
+        pending = builder.load(waiting)
+        idle = builder.and_(builder.icmp_unsigned("==", count, zero), builder.icmp_unsigned("==", pending, zero))
+        with builder.if_then(idle):
+            builder.ret_void()
+        entries = builder.bitcast(self.data(builder, timers), TIMER.as_pointer())
+        builder.store(ir.Constant(SIZE, (1 << 63) - 1), earliest)
+
+        def soonest(index):
+            deadline = self.field(builder, builder.gep(entries, [index]), 0)
+            builder.store(builder.select(builder.icmp_signed("<", deadline, builder.load(earliest)),
+                                         deadline, builder.load(earliest)), earliest)
+
+        self._loop(builder, count, soonest)
+        remaining = builder.sub(builder.load(earliest), builder.call(self.function("o_loop_now"), []))
+        remaining = builder.select(builder.icmp_signed("<", remaining, zero), zero, remaining)
+        limit = ir.Constant(SIZE, (1 << 31) - 1)
+        remaining = builder.trunc(builder.select(builder.icmp_signed(">", remaining, limit), limit, remaining), INDEX)
+        timeout = builder.select(builder.icmp_unsigned("==", count, zero), ir.Constant(INDEX, -1), remaining)
+        wait = self._declare("epoll_wait", INDEX, INDEX, EPOLL_EVENT.as_pointer(), INDEX, INDEX)
+        first = builder.gep(events, [ir.Constant(INDEX, 0), ir.Constant(INDEX, 0)])
+        ready_count = builder.call(wait, [builder.call(self.function("o_loop_poller"), []), first,
+                                          ir.Constant(INDEX, EPOLL_BATCH), timeout])
+        # An interrupted wait is one that found nothing.
+        ready_count = builder.sext(builder.select(builder.icmp_signed("<", ready_count, ir.Constant(INDEX, 0)),
+                                                  ir.Constant(INDEX, 0), ready_count), SIZE)
+        builder.store(builder.sub(pending, ready_count), waiting)
+
+        def wake(index):
+            event = builder.gep(events, [ir.Constant(INDEX, 0), index])
+            builder.call(self.function("o_task_schedule"), [builder.inttoptr(self.field(builder, event, 1), BYTE_PTR)])
+
+        self._loop(builder, ready_count, wake)
+
+        # Timers that are due are woken and replaced by the last one.
+        now = builder.call(self.function("o_loop_now"), [])
+        builder.store(zero, index_ptr)
+        timer_block = builder.append_basic_block("timer")
+        due_block = builder.append_basic_block("due")
+        next_block = builder.append_basic_block("next")
+        builder.branch(timer_block)
+        builder.position_at_end(timer_block)
+        index = builder.load(index_ptr)
+        length = self.length(builder, timers)
+        test_block = builder.append_basic_block("test")
+        builder.cbranch(builder.icmp_unsigned("<", index, length), test_block, run_block)
+        builder.position_at_end(test_block)
+        entries = builder.bitcast(self.data(builder, timers), TIMER.as_pointer())
+        timer = builder.gep(entries, [index])
+        builder.cbranch(builder.icmp_signed("<=", self.field(builder, timer, 0), now), due_block, next_block)
+        builder.position_at_end(due_block)
+        builder.call(self.function("o_task_schedule"), [self.field(builder, timer, 1)])
+        last = builder.sub(length, ir.Constant(SIZE, 1))
+        builder.store(builder.load(builder.gep(entries, [last])), timer)
+        self.set_length(builder, timers, last)
+        builder.branch(timer_block)
+        builder.position_at_end(next_block)
+        builder.store(builder.add(index, ir.Constant(SIZE, 1)), index_ptr)
+        builder.branch(timer_block)
+        return function
@@ -1,21 +1,24 @@
+from Semantic.symtable import SymbolTable
+
+
 class ScopeStack:
     def __init__(self):
-        self.scope_stack = [{}]
+        self.table = SymbolTable()
 
     def define(self, name, value):
-        self.scope_stack[-1][name] = value
+        self.table.define(name, None, value)
 
     def enter(self):
-        self.scope_stack.append({})
+        self.table.enter()
 
     def leave(self):
-        self.scope_stack.pop()
+        self.table.leave()
 
     def current(self):
-        return self.scope_stack[-1]
+        return {name: symbol.value for name, symbol in self.table.current_scope.symbols.items()}
 
     def resolve(self, name):
-        for scope in reversed(self.scope_stack):
-            if name in scope:
-                return scope[name]
-        raise NameError(f"Name {name} is not defined")
+        symbol = self.table.resolve(name)
+        if symbol is None:
+            raise NameError(f"Name {name} is not defined")
+        return symbol.value
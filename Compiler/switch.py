@@ -0,0 +1,48 @@
+from collections import namedtuple
+
+# A run of cases becomes a table when it fills this share of the values
+# between its first and last case and has at least this many cases.
+MIN_DENSITY = 0.4
+MIN_TABLE = 4
+# Leaves of the search tree compare up to this many cases in a row.
+MAX_LEAF = 3
+
+# Cases are (value, target) pairs. Tables are dispatched on in one step,
+# leaves compare their cases one by one and branches send values below
+# their pivot left and the others right.
+Table = namedtuple("Table", "low high cases")
+Leaf = namedtuple("Leaf", "cases")
+Branch = namedtuple("Branch", "pivot left right")
+
+
+def clusters(cases):
+    # Splits cases, sorted by value, into the longest dense runs from each
+    # case on, and the single cases that start none.
+    found = []
+    start = 0
+    while start < len(cases):
+        end = start
+        for last in range(start + MIN_TABLE - 1, len(cases)):
+            if (last - start + 1) / (cases[last][0] - cases[start][0] + 1) >= MIN_DENSITY:
+                end = last
+        if end > start:
+            found.append(Table(cases[start][0], cases[end][0], cases[start:end + 1]))
+        else:
+            found.append(Leaf(cases[start:start + 1]))
+        start = end + 1
+    return found
+
+
+def plan(cases):
+    # A binary search tree over the clusters of the cases, so any value
+    # reaches its case in a logarithmic number of comparisons.
+    return _tree(clusters(sorted(cases)))
+
+
+def _tree(items):
+    if len(items) == 1 and isinstance(items[0], Table):
+        return items[0]
+    if len(items) <= MAX_LEAF and all(isinstance(item, Leaf) for item in items):
+        return Leaf([case for item in items for case in item.cases])
+    middle = len(items) // 2
+    return Branch(items[middle].cases[0][0], _tree(items[:middle]), _tree(items[middle:]))
@@ -0,0 +1,44 @@
+from functools import lru_cache
+
+import llvmlite.binding as llvm
+
+
+@lru_cache(maxsize=None)
+def initialize():
+    llvm.initialize_native_target()
+    llvm.initialize_native_asmprinter()
+
+
+@lru_cache(maxsize=None)
+def initialize_all():
+    llvm.initialize_all_targets()
+    llvm.initialize_all_asmprinters()
+
+
+@lru_cache(maxsize=None)
+def host_cpu():
+    initialize()
+    return llvm.get_host_cpu_name(), llvm.get_host_cpu_features().flatten()
+
+
+def create_target_machine(opt=2, triple=None, cpu=None, features=None, reloc="default",
+                          codemodel="jitdefault", jit=False):
+    # With no triple the machine targets the host, including its exact CPU
+    # and feature set, which is what generated code should be tuned for.
+    initialize()
+    if triple is None:
+        target = llvm.Target.from_default_triple()
+        host, host_features = host_cpu()
+        cpu = host if cpu is None else cpu
+        features = host_features if features is None else features
+    else:
+        initialize_all()
+        target = llvm.Target.from_triple(triple)
+    return target.create_target_machine(cpu=cpu or "", features=features or "", opt=opt,
+                                        reloc=reloc, codemodel=codemodel, jit=jit)
+
+
+# Shared machines for emitting code and querying the data layout. An
+# execution engine takes ownership of its machine, so each one needs a
+# fresh machine from create_target_machine instead.
+target_machine = lru_cache(maxsize=None)(create_target_machine)
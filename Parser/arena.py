@@ -0,0 +1,178 @@
+import sys
+from array import array
+
+from Parser.nodes import NODE_TYPES, VIEW_TYPES, NodeView
+
+# Every field is stored as one signed 64-bit operand whose low two bits
+# say how to read the rest: a node index, an interned string, an offset
+# into the operand column where a list starts (its length first, then its
+# items) or an index into the constant table.
+NODE, STRING, LIST, CONSTANT = range(4)
+# None is always the first constant.
+NONE = 0 << 2 | CONSTANT
+
+
+class Arena:
+    def __init__(self):
+        self.kinds = array("B")
+        self.linenos = array("L")
+        self.offsets = array("Q")
+        self.operands = array("q")
+        # The resolved type of each node, encoded like an operand.
+        self.types = array("q")
+        self.strings = []
+        self.string_ids = {}
+        self.constants = [None]
+        self.constant_ids = {(type(None), None): 0}
+        self.root = None
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def nbytes(self):
+        columns = (self.kinds, self.linenos, self.offsets, self.operands, self.types)
+        return sum(column.itemsize * len(column) for column in columns)
+
+    def add(self, node):
+        if isinstance(node, Cursor) and node.arena is self:
+            return node
+        operands = [self.encode(getattr(node, field)) for field in node.fields]
+        index = len(self.kinds)
+        self.kinds.append(node.kind)
+        self.linenos.append(node.lineno)
+        self.offsets.append(len(self.operands))
+        self.operands.extend(operands)
+        self.types.append(self.encode(node.type))
+        return CURSOR_TYPES[node.kind](self, index)
+
+    def encode(self, value):
+        if isinstance(value, NodeView):
+            return self.add(value).index << 2 | NODE
+        if isinstance(value, str):
+            string_id = self.string_ids.get(value)
+            if string_id is None:
+                string_id = self.string_ids[value] = len(self.strings)
+                self.strings.append(sys.intern(value))
+            return string_id << 2 | STRING
+        if isinstance(value, list):
+            items = [self.encode(item) for item in value]
+            offset = len(self.operands)
+            self.operands.append(len(items))
+            self.operands.extend(items)
+            return offset << 2 | LIST
+        key = (value.__class__, value)
+        try:
+            constant_id = self.constant_ids.get(key)
+        except TypeError:
+            key = constant_id = None
+        if constant_id is None:
+            constant_id = len(self.constants)
+            self.constants.append(value)
+            if key is not None:
+                self.constant_ids[key] = constant_id
+        return constant_id << 2 | CONSTANT
+
+    def decode(self, operand):
+        kind = operand & 3
+        value = operand >> 2
+        if kind == NODE:
+            return CURSOR_TYPES[self.kinds[value]](self, value)
+        if kind == STRING:
+            return self.strings[value]
+        if kind == LIST:
+            operands = self.operands
+            return [self.decode(operands[i])
+                    for i in range(value + 1, value + 1 + operands[value])]
+        return self.constants[value]
+
+    def field(self, index, position):
+        return self.decode(self.operands[self.offsets[index] + position])
+
+    def cursor(self, index):
+        return CURSOR_TYPES[self.kinds[index]](self, index)
+
+
+class Cursor(NodeView):
+    __slots__ = ("arena", "index")
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+    @property
+    def lineno(self):
+        return self.arena.linenos[self.index]
+
+    def identity(self):
+        return self.arena, self.index
+
+    @property
+    def type(self):
+        return self.arena.decode(self.arena.types[self.index])
+
+    @type.setter
+    def type(self, value):
+        self.arena.types[self.index] = self.arena.encode(value)
+
+    def __len__(self):
+        if self.variadic:
+            arena = self.arena
+            start = arena.operands[arena.offsets[self.index] + len(self.fields) - 1] >> 2
+            return len(self.fields) + arena.operands[start]
+        if self.optional and self._last() == NONE:
+            return len(self.fields)
+        return len(self.fields) + 1
+
+    def __getitem__(self, index):
+        # Decodes only the requested field; slices go through the view.
+        if index.__class__ is not int:
+            return self.view()[index]
+        if index < 0:
+            index += len(self)
+        if index == 0:
+            return self.tag
+        fixed = len(self.fields) - (self.variadic or self.optional)
+        if 0 < index <= fixed:
+            return self.arena.field(self.index, index - 1)
+        if self.variadic and index > fixed:
+            operands = self.arena.operands
+            start = self._last() >> 2
+            if index - fixed <= operands[start]:
+                return self.arena.decode(operands[start + index - fixed])
+        elif self.optional and index == fixed + 1 and self._last() != NONE:
+            return self.arena.field(self.index, fixed)
+        raise IndexError("node index out of range")
+
+    def _last(self):
+        arena = self.arena
+        return arena.operands[arena.offsets[self.index] + len(self.fields) - 1]
+
+    def view(self):
+        arena = self.arena
+        offset = arena.offsets[self.index]
+        values = [arena.decode(operand)
+                  for operand in arena.operands[offset:offset + len(self.fields)]]
+        if self.variadic:
+            values.extend(values.pop())
+        elif self.optional and values[-1] is None:
+            values.pop()
+        return (self.tag, *values)
+
+
+def _field(position):
+    return property(lambda self: self.arena.field(self.index, position))
+
+
+CURSOR_TYPES = tuple(
+    type(f"{cls.__name__}Cursor", (Cursor,), {
+        "__slots__": (),
+        "kind": cls.kind,
+        "tag": cls.tag,
+        "fields": cls.fields,
+        "variadic": cls.variadic,
+        "optional": cls.optional,
+        **{field: _field(position) for position, field in enumerate(cls.fields)},
+    })
+    for cls in NODE_TYPES
+)
+VIEW_TYPES.extend(CURSOR_TYPES)
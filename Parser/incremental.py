@@ -0,0 +1,150 @@
+import bisect
+import re
+
+from Parser import nodes
+from Parser.lexer import Lexer
+from Parser.parser import ensure_newline_at_end, parser_function
+
+# Lines at column zero that never start a statement of their own: they
+# extend the compound statement above them.
+CONTINUATIONS = {"otherwise", "except"}
+
+_first_word = re.compile(r"[A-Za-z_]\w*|\S")
+_strings_and_comments = re.compile(r't?"([^"\\\n]|\\.)*"|#.*')
+
+
+class Chunk:
+    # A run of lines holding one top-level statement, together with the
+    # blank lines and comments that follow it. Top-level statements start
+    # at column zero and the grammar has no state that crosses them, so a
+    # chunk parses the same on its own as it does inside the whole file.
+    __slots__ = ("start", "end", "lineno", "statements")
+
+    def __init__(self, start, end, lineno, statements):
+        self.start = start
+        self.end = end
+        self.lineno = lineno
+        self.statements = statements
+
+    def __repr__(self):
+        return f"Chunk(start={self.start}, end={self.end}, lineno={self.lineno})"
+
+
+def segment(text, position=0, lineno=1):
+    start = position
+    start_line = lineno
+    kind = None
+    decorated = False
+    depth = 0
+    while position < len(text):
+        newline = text.find("\n", position)
+        line_end = len(text) if newline < 0 else newline + 1
+        line = text[position:line_end]
+        stripped = line.strip()
+        if stripped and not stripped.startswith("#"):
+            word = _first_word.match(stripped).group()
+            if depth == 0 and not line[0].isspace():
+                if kind is None:
+                    kind = word
+                elif not decorated and word not in CONTINUATIONS \
+                        and not (word == "when" and kind == "when"):
+                    yield start, position, start_line
+                    start = position
+                    start_line = lineno
+                    kind = word
+            decorated = word == "@" and depth == 0
+            code = _strings_and_comments.sub("", line)
+            depth = max(depth + sum(map(code.count, "([{")) - sum(map(code.count, ")]}")), 0)
+        position = line_end
+        lineno += 1
+    if start < len(text):
+        yield start, len(text), start_line
+
+
+def shift_lines(value, delta):
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, nodes.Node):
+            value.lineno += delta
+            stack.extend(getattr(value, field) for field in value.fields)
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+
+
+class Document:
+    def __init__(self, text=""):
+        self.text = text
+        self.chunks = [self.parse_chunk(*bounds) for bounds in segment(text)]
+        self.reparsed = len(self.chunks)
+
+    def parse_chunk(self, start, end, lineno):
+        lexer = Lexer()
+        tree = parser_function(ensure_newline_at_end(self.text[start:end]), lexer=lexer)
+        statements = None
+        # Recovering from a syntax error can still produce a tree; a chunk
+        # with errors is left out until an edit fixes it.
+        if tree is not None and not lexer.errors:
+            statements = tree.body
+            if lineno != 1:
+                shift_lines(statements, lineno - 1)
+        return Chunk(start, end, lineno, statements)
+
+    @property
+    def tree(self):
+        body = []
+        for chunk in self.chunks:
+            if chunk.statements is not None:
+                body.extend(chunk.statements)
+        return nodes.Program(body)
+
+    @property
+    def errors(self):
+        return [chunk.lineno for chunk in self.chunks if chunk.statements is None]
+
+    def offset(self, line, column):
+        position = 0
+        for _ in range(line - 1):
+            position = self.text.index("\n", position) + 1
+        return position + column
+
+    def edit(self, start, end, replacement):
+        old = self.chunks
+        delta = len(replacement) - (end - start)
+        line_delta = replacement.count("\n") - self.text.count("\n", start, end)
+        self.text = self.text[:start] + replacement + self.text[end:]
+        # Resegmenting starts one chunk before the edit, since the edit may
+        # turn its first line into a continuation of that chunk, and stops
+        # at the first boundary that lines up with an old chunk past the
+        # edit; everything from there on is the old text, only moved.
+        first = max(bisect.bisect_right(old, start, key=lambda chunk: chunk.end) - 1, 0)
+        tail = bisect.bisect_left(old, end, key=lambda chunk: chunk.start)
+        chunks = old[:first]
+        self.reparsed = 0
+        position, lineno = (old[first].start, old[first].lineno) if old else (0, 1)
+        for bounds in segment(self.text, position, lineno):
+            chunk_start, chunk_end, chunk_line = bounds
+            index = bisect.bisect_left(old, chunk_start - delta, lo=tail,
+                                       key=lambda chunk: chunk.start)
+            if chunk_start - delta >= end and index < len(old) \
+                    and old[index].start == chunk_start - delta:
+                for chunk in old[index:]:
+                    chunk.start += delta
+                    chunk.end += delta
+                    if line_delta:
+                        chunk.lineno += line_delta
+                        if chunk.statements is not None:
+                            shift_lines(chunk.statements, line_delta)
+                    chunks.append(chunk)
+                break
+            if len(chunks) == first and old and chunk_end <= start \
+                    and (chunk_start, chunk_end) == (old[first].start, old[first].end):
+                chunks.append(old[first])
+                continue
+            chunks.append(self.parse_chunk(chunk_start, chunk_end, chunk_line))
+            self.reparsed += 1
+        self.chunks = chunks
+        return self.tree
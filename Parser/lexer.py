@@ -1,5 +1,8 @@
 import re
-import ply.lex as lex
+import sys
+from functools import partial
+
+from Parser.tables import build_lexer
 
 # Keywords
 keywords = {
@@ -22,12 +25,14 @@ keywords = {
     "case": "CASE",
     "try": "TRY",
     "except": "EXCEPT",
+    "raise": "RAISE",
     # Functions and methods
     "log": "LOG",
     "include": "INCLUDE",
     "extends": "EXTENDS",
     "self": "SELF",
     "async": "ASYNC",
+    "await": "AWAIT",
     "escape": "ESCAPE",
     "return": "RETURN",
     "pass": "PASS",
@@ -126,9 +131,6 @@ t_EXCLAMATION = r"!"
 t_QUESTION = r"\?"
 t_ELLIPSIS = r"\.\.\."
 
-indentation_stack = [0]
-
-
 def t_COMMENT(t):
     r"\#.*"
     pass
@@ -144,16 +146,19 @@ def t_NEWLINE(t):
 def t_whitespaces(t):
     r"(?<=\n)[ \t]+"
     t.value = len(t.value) - 1
+    indentation_stack = t.lexer.indentation_stack
     if t.value > indentation_stack[-1]:
         indentation_stack.append(t.value)
         t.type = "INDENT"
         return t
     elif t.value < indentation_stack[-1]:
-        while indentation_stack[-1] > t.value and len(indentation_stack) > 1:
-            t.lexer.lexpos -= 1
-            t.value = indentation_stack[-1]
-            indentation_stack.pop()
-            t.type = "DEDENT"
+        indent = t.value
+        t.value = indentation_stack.pop()
+        t.type = "DEDENT"
+        if indent < indentation_stack[-1]:
+            # One DEDENT per closed block: the indentation is lexed again
+            # until the stack is back at its level.
+            t.lexer.lexpos = t.lexpos
         return t
     return None
 
@@ -205,10 +210,92 @@ def t_error(t):
 
 def sanitize(data):
     multiple_newlines_regex = r"\n+"
-    sanitized_newline = "\n "
+    sanitized_newline = r"\g<0> "
     return re.sub(multiple_newlines_regex, sanitized_newline, data.lstrip())
 
 
-lexer = lex.lex()
-input_function = lexer.input
-lexer.input = lambda data: input_function(sanitize(data))
+def leading_lines(data):
+    return data[:len(data) - len(data.lstrip())].count("\n")
+
+
+def read_lines(source):
+    line = source.readline()
+    if isinstance(line, bytes):
+        while line:
+            yield line.decode("utf-8")
+            line = source.readline()
+    else:
+        while line:
+            yield line
+            line = source.readline()
+
+
+class Lexer:
+    def __init__(self):
+        self.lexer = ply_lexer.clone()
+        self.lexer.indentation_stack = [0]
+        self.token = self.lexer.token
+
+    def reset(self):
+        self.lexer.indentation_stack = [0]
+        self.errors = self.lexer.errors = []
+        self.lexer.lineno = 1
+        self.lexer.linestart = 0
+
+    def input(self, data):
+        self.reset()
+        self.lexer.lineno += leading_lines(data)
+        self.lexer.input(sanitize(data))
+        self.token = self.lexer.token
+
+    def input_stream(self, source, final_newline=False):
+        self.token = partial(next, self.stream(source, final_newline), None)
+
+    def stream(self, source, final_newline=False):
+        # Feeds the PLY lexer the same text sanitize() would produce, one
+        # source line at a time: leading blank lines are skipped, the first
+        # line is left-stripped and every later line is prefixed with its
+        # run of newlines plus the separator space.
+        self.reset()
+        lexer = self.lexer
+        offset = 0
+        newlines = 0
+        started = False
+        for line in read_lines(source):
+            content = line.rstrip("\n")
+            if not started:
+                content = content.lstrip()
+                if not content:
+                    lexer.lineno += line.count("\n")
+                    continue
+                started = True
+                chunk = content
+            elif content:
+                chunk = "\n" * newlines + " " + content
+            else:
+                newlines += 1
+                continue
+            newlines = len(line) - len(line.rstrip("\n"))
+            lexer.input(chunk)
+            for t in iter(lexer.token, None):
+                t.lexpos += offset
+                yield t
+            offset += len(chunk)
+        if started and (newlines or final_newline):
+            lexer.input("\n" * max(newlines, 1) + " ")
+            for t in iter(lexer.token, None):
+                t.lexpos += offset
+                yield t
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t = self.token()
+        if t is None:
+            raise StopIteration
+        return t
+
+
+ply_lexer = build_lexer(sys.modules[__name__])
+lexer = Lexer()
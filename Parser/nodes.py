@@ -0,0 +1,253 @@
+from functools import lru_cache
+
+# Field layout of every AST node, in the order the parser has always
+# emitted them as tuples. A field prefixed with "*" collects the remaining
+# values and a field suffixed with "?" is optional and left out of the
+# tuple view when it is None.
+SPEC = (
+    ("program", "body"),
+    ("fun_def", "decorators", "rtype", "name", "params", "body"),
+    ("class_def", "decorators", "name", "base", "body"),
+    ("class_ctor_def", "name", "params", "body"),
+    ("async", "function"),
+    ("await", "call"),
+    ("decorator", "name"),
+    ("when_stmts", "*cases"),
+    ("when", "condition", "body"),
+    ("otherwise", "body"),
+    ("for_stmt", "param", "iterable", "body"),
+    ("switch_stmt", "expression", "cases"),
+    ("case", "value", "body"),
+    ("var_def", "type_name", "name", "value?"),
+    ("assignment", "op", "name", "value"),
+    ("star", "name"),
+    ("enum_def", "name", "values"),
+    ("lambda", "params", "body"),
+    ("fun_call", "name", "args"),
+    ("include", "modules"),
+    ("return", "value"),
+    ("log", "args"),
+    ("pass",),
+    ("skip",),
+    ("escape",),
+    ("integer", "value"),
+    ("double", "value"),
+    ("boolean", "value"),
+    ("string", "value"),
+    ("template_string", "value"),
+    ("identifier", "name"),
+    ("binop", "op", "left", "right"),
+    ("comparison", "op", "left", "right"),
+    ("inline_condition", "condition", "true_value", "false_value"),
+    ("logical_or", "left", "right"),
+    ("logical_and", "left", "right"),
+    ("array_literal", "elements"),
+    ("array_range", "start", "end"),
+    ("array_comprehension", "element", "param", "iterable", "condition?"),
+    ("object_literal", "entries"),
+    ("unpack", "name"),
+    ("keypair", "key", "value"),
+    ("try", "body", "handlers"),
+    ("except", "name", "body"),
+    ("raise", "name"),
+    ("index", "target", "key"),
+)
+# The nodes that have a value, and so a type for the semantic analyzer to
+# annotate them with; other nodes leave the slot out.
+EXPRESSIONS = {
+    "integer", "double", "boolean", "string", "template_string", "identifier", "binop", "comparison",
+    "inline_condition", "logical_or", "logical_and", "array_literal", "array_range",
+    "array_comprehension", "object_literal", "index", "lambda", "fun_call", "await",
+}
+
+
+class NodeView:
+    __slots__ = ()
+    kind = -1
+    tag = None
+    fields = ()
+    variadic = False
+    optional = False
+    type = None
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __len__(self):
+        return len(self.view())
+
+    def __getitem__(self, index):
+        return self.view()[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (tuple, NodeView)):
+            return self.view() == tuple(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        values = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.fields)
+        return f"{type(self).__name__}({values})"
+
+    def astuple(self):
+        return tuple(astuple(value) for value in self.view())
+
+    def identity(self):
+        return id(self)
+
+
+class Node(NodeView):
+    # Expressions add a type slot, filled in by the semantic analyzer.
+    __slots__ = ("lineno",)
+
+    def __reduce__(self):
+        args = tuple(getattr(self, field) for field in self.fields) + (self.lineno,)
+        return type(self), args, self._state()
+
+    def _state(self):
+        return None if self.type is None else (None, {"type": self.type})
+
+
+def astuple(value):
+    if isinstance(value, NodeView):
+        return value.astuple()
+    if isinstance(value, list):
+        return [astuple(item) for item in value]
+    return value
+
+
+def object_entries(entries):
+    # An object literal holds a list of keypair and unpack nodes, or a dict
+    # from keys to values when it has no unpacking.
+    if isinstance(entries, dict):
+        return [("keypair", key, value) for key, value in entries.items()]
+    return entries
+
+
+def is_node(value):
+    return isinstance(value, (tuple, NodeView))
+
+
+def identity(node):
+    # A key for a node that holds as long as its tree does. Nodes that are
+    # built on every access, like arena cursors, name their slot instead
+    # of their address, which a later view may reuse.
+    return node.identity() if isinstance(node, NodeView) else id(node)
+
+
+@lru_cache(maxsize=None)
+def _handlers(visitor_type, prefix):
+    return {name[len(prefix):]: getattr(visitor_type, name)
+            for name in dir(visitor_type) if name.startswith(prefix)}
+
+
+def dispatch_table(visitor, prefix, default):
+    # Maps both view classes and tags to bound methods. Every registered
+    # view class gets an entry, so looking one up never misses; plain
+    # tuples fall back to a lookup by their tag.
+    table = {tag: handler.__get__(visitor)
+             for tag, handler in _handlers(type(visitor), prefix).items()}
+    for cls in VIEW_TYPES:
+        table[cls] = table.get(cls.tag, default)
+    return table
+
+
+def _class_name(tag):
+    return "".join(part.title() for part in tag.split("_"))
+
+
+def _generate(kind, tag, *spec):
+    fields = tuple(field.strip("*?") for field in spec)
+    params = []
+    view = [repr(tag)]
+    optional = None
+    for field, name in zip(spec, fields):
+        if field.startswith("*"):
+            params.append(f"*{name}")
+            view.append(f"*self.{name}")
+        elif field.endswith("?"):
+            params.append(f"{name}=None")
+            optional = name
+        else:
+            params.append(name)
+            view.append(f"self.{name}")
+    body = [f"    self.{name} = {'list(%s)' % name if f.startswith('*') else name}"
+            for f, name in zip(spec, fields)]
+    source = [
+        f"def __init__(self, {', '.join(params + ['lineno=0'])}):",
+        *body,
+        "    self.lineno = lineno",
+        *(["    self.type = None"] if tag in EXPRESSIONS else []),
+        "def view(self):",
+        f"    view = ({', '.join(view)},)",
+    ]
+    if optional:
+        source.append(f"    if self.{optional} is not None:")
+        source.append(f"        view += (self.{optional},)")
+    source.append("    return view")
+    source += _indexing(tag, spec, fields)
+    namespace = {}
+    exec("\n".join(source), namespace)
+    if any(field.startswith("*") for field in spec):
+        # Variadic fields are stored as one list; unpickling passes it back
+        # positionally, so __reduce__ has to splat it again.
+        def __reduce__(self):
+            values = [getattr(self, field) for field in self.fields]
+            return _rebuild, (type(self), values, self.lineno), self._state()
+        namespace["__reduce__"] = __reduce__
+    namespace.pop("__builtins__", None)
+    namespace.update(__slots__=fields + ("type",) * (tag in EXPRESSIONS), kind=kind, tag=tag, fields=fields,
+                     variadic=spec[-1].startswith("*") if spec else False,
+                     optional=spec[-1].endswith("?") if spec else False,
+                     __module__=__name__, __qualname__=_class_name(tag))
+    return type(_class_name(tag), (Node,), namespace)
+
+
+def _indexing(tag, spec, fields):
+    # __getitem__ and __len__ read the slots directly instead of building
+    # the tuple view; slices still go through the view.
+    last = spec[-1] if spec else ""
+    fixed = fields[:-1] if last.startswith("*") or last.endswith("?") else fields
+    if last.startswith("*"):
+        length = f"{len(fixed) + 1} + len(self.{fields[-1]})"
+    elif last.endswith("?"):
+        length = f"{len(fields) + 1} if self.{fields[-1]} is not None else {len(fields)}"
+    else:
+        length = str(len(fields) + 1)
+    source = [
+        "def __len__(self):",
+        f"    return {length}",
+        "def __getitem__(self, index):",
+        "    if index.__class__ is not int:",
+        "        return self.view()[index]",
+        "    if index < 0:",
+        f"        index += {length}",
+        "    if index == 0:",
+        f"        return {tag!r}",
+    ]
+    for position, name in enumerate(fixed, 1):
+        source.append(f"    if index == {position}:")
+        source.append(f"        return self.{name}")
+    if last.startswith("*"):
+        source.append(f"    if index > {len(fixed)}:")
+        source.append(f"        return self.{fields[-1]}[index - {len(fixed) + 1}]")
+    elif last.endswith("?"):
+        source.append(f"    if index == {len(fields)} and self.{fields[-1]} is not None:")
+        source.append(f"        return self.{fields[-1]}")
+    source.append("    raise IndexError('node index out of range')")
+    return source
+
+
+def _rebuild(cls, values, lineno):
+    *head, rest = values
+    return cls(*head, *rest, lineno=lineno)
+
+
+NODE_TYPES = tuple(_generate(kind, *spec) for kind, spec in enumerate(SPEC))
+KINDS = {cls.tag: cls.kind for cls in NODE_TYPES}
+NODES = {cls.tag: cls for cls in NODE_TYPES}
+globals().update((cls.__name__, cls) for cls in NODE_TYPES)
+# Every class that presents a node through the tuple view; other node
+# representations register their classes here for visitor dispatch.
+VIEW_TYPES = list(NODE_TYPES)
@@ -1,5 +1,10 @@
-import ply.yacc as yacc
-from Parser.lexer import tokens
+import copy
+import sys
+
+from Parser import nodes
+from Parser.arena import Arena
+from Parser.lexer import Lexer, tokens
+from Parser.tables import build_parser
 
 precedence = (
     ("left", "EQEQUAL", "NOT_EQEQUAL", "LESS",
@@ -9,14 +14,27 @@ precedence = (
     ("left", "PERCENT"),
     ("right", "DOUBLESTAR"),
     ("left", "DOUBLE_VBAR"),
+    ("left", "LSQB"),
 )
 
 
+def lineno(p):
+    for i in range(1, len(p)):
+        if isinstance(p[i], nodes.Node):
+            return p[i].lineno
+        if p.lineno(i):
+            return p.lineno(i)
+    return 0
+
+
 def p_program(p):
     """
     program : statements
     """
-    p[0] = ('program', p[1])
+    p[0] = nodes.Program(p[1], lineno=lineno(p))
+    arena = getattr(p.parser, "arena", None)
+    if arena is not None:
+        p[0] = arena.root = arena.add(p[0])
 
 
 def p_statements(p):
@@ -27,7 +45,14 @@ def p_statements(p):
     if len(p) == 2:
         p[0] = [p[1]]
     else:
-        p[0] = p[1] + [p[2]]
+        p[1].append(p[2])
+        p[0] = p[1]
+    # With only the end marker below it on the stack this is a top-level
+    # statement; when building an arena it is flattened right away, so only
+    # one top-level statement exists as node objects at a time.
+    arena = getattr(p.parser, "arena", None)
+    if arena is not None and len(p.stack) == 1:
+        p[0][-1] = arena.add(p[0][-1])
 
 
 def p_statement(p):
@@ -45,8 +70,9 @@ def p_simple_stmt(p):
                 | assignment
                 | array_unpack
                 | enum_def
-                | fun_call_stmt
                 | return_stmt
+                | log_stmt
+                | raise_stmt
                 | keyword_stmt
                 | include_stmt
                 | expression
@@ -62,7 +88,8 @@ def p_compound_stmts(p):
     if len(p) == 2:
         p[0] = [p[1]]
     else:
-        p[0] = p[1] + [p[2]]
+        p[1].append(p[2])
+        p[0] = p[1]
 
 
 def p_compound_stmt(p):
@@ -102,7 +129,7 @@ def p_decorator(p):
               | AT IDENTIFIER LPAR RPAR
               | AT IDENTIFIER LPAR args RPAR
     """
-    p[0] = ("decorator", p[2])
+    p[0] = nodes.Decorator(p[2], lineno=lineno(p))
 
 
 def p_class_def(p):
@@ -111,11 +138,8 @@ def p_class_def(p):
               | class_def_raw
     """
     if len(p) == 3:
-        fun = list(p[2])
-        fun[1] = p[1]
-        p[0] = tuple(fun)
-    else:
-        p[0] = p[1]
+        p[2].decorators = p[1]
+    p[0] = p[len(p) - 1]
 
 
 def p_class_def_raw(p):
@@ -124,9 +148,9 @@ def p_class_def_raw(p):
                   | CLASS IDENTIFIER EXTENDS IDENTIFIER COLON block
     """
     if len(p) <= 6:
-        p[0] = ("class_def", [], p[2], None, p[4])
+        p[0] = nodes.ClassDef([], p[2], None, p[4], lineno=lineno(p))
     else:
-        p[0] = ("class_def", [], p[2], p[4], p[6])
+        p[0] = nodes.ClassDef([], p[2], p[4], p[6], lineno=lineno(p))
 
 
 def p_class_ctor_def(p):
@@ -135,9 +159,9 @@ def p_class_ctor_def(p):
                    | IDENTIFIER LPAR params RPAR COLON block
     """
     if len(p) == 6:
-        p[0] = ("class_ctor_def", p[1], [], p[5])
+        p[0] = nodes.ClassCtorDef(p[1], [], p[5], lineno=lineno(p))
     else:
-        p[0] = ("class_ctor_def", p[1], p[3], p[6])
+        p[0] = nodes.ClassCtorDef(p[1], p[3], p[6], lineno=lineno(p))
 
 
 def p_fun_def(p):
@@ -146,11 +170,9 @@ def p_fun_def(p):
             | fun_def_raw
     """
     if len(p) == 3:
-        fun = list(p[2])
-        fun[1] = p[1]
-        p[0] = tuple(fun)
-    else:
-        p[0] = p[1]
+        fun = p[2].function if isinstance(p[2], nodes.Async) else p[2]
+        fun.decorators = p[1]
+    p[0] = p[len(p) - 1]
 
 
 def p_fun_def_raw(p):
@@ -160,11 +182,11 @@ def p_fun_def_raw(p):
                 | ASYNC fun_def_raw
     """
     if len(p) == 3:
-        p[0] = ("async", p[2])
-    if len(p) == 7:
-        p[0] = ("fun_def", [], p[1], p[2], [], p[6])
+        p[0] = nodes.Async(p[2], lineno=lineno(p))
+    elif len(p) == 7:
+        p[0] = nodes.FunDef([], p[1], p[2], [], p[6], lineno=lineno(p))
     else:
-        p[0] = ("fun_def", [], p[1], p[2], p[4], p[7])
+        p[0] = nodes.FunDef([], p[1], p[2], p[4], p[7], lineno=lineno(p))
 
 
 def p_params(p):
@@ -175,7 +197,8 @@ def p_params(p):
     if len(p) == 2:
         p[0] = [p[1]]
     else:
-        p[0] = p[1] + [p[3]]
+        p[1].append(p[3])
+        p[0] = p[1]
 
 
 def p_param(p):
@@ -192,36 +215,32 @@ def p_when_stmts(p):
                | when_stmts when_stmt
                | when_stmts when_stmt otherwise_block
     """
-    if len(p) == 2:
-        p[0] = ("when_stmts", p[1])
-    elif len(p) == 3:
-        if p[2][0] == "otherwise":
-            p[0] = ("when_stmts", p[1]) + (p[2],)
-        else:
-            p[0] = ("when_stmts", p[1][1]) + (p[2],)
+    if isinstance(p[1], nodes.WhenStmts):
+        p[0] = p[1]
+        p[0].cases.extend(p[2:])
     else:
-        p[0] = ("when_stmts", p[1][1]) + (p[2], p[3])
+        p[0] = nodes.WhenStmts(*p[1:], lineno=lineno(p))
 
 
 def p_when_stmt(p):
     """
     when_stmt : WHEN expression COLON block
     """
-    p[0] = ("when", p[2], p[4])
+    p[0] = nodes.When(p[2], p[4], lineno=lineno(p))
 
 
 def p_otherwise_block(p):
     """
     otherwise_block : OTHERWISE COLON block
     """
-    p[0] = ("otherwise", p[3])
+    p[0] = nodes.Otherwise(p[3], lineno=lineno(p))
 
 
 def p_for_stmt(p):
     """
     for_stmt : FOR param IN expression COLON block
     """
-    p[0] = ("for_stmt", p[2], p[4], p[6])
+    p[0] = nodes.ForStmt(p[2], p[4], p[6], lineno=lineno(p))
 
 
 def p_switch_stmt(p):
@@ -229,7 +248,7 @@ def p_switch_stmt(p):
     switch_stmt : SWITCH expression COLON switch_cases DEDENT
                 | SWITCH expression COLON switch_cases
     """
-    p[0] = ("switch_stmt", p[2], p[4])
+    p[0] = nodes.SwitchStmt(p[2], p[4], lineno=lineno(p))
 
 
 def p_switch_cases(p):
@@ -240,14 +259,15 @@ def p_switch_cases(p):
     if len(p) == 4:
         p[0] = [p[3]]
     else:
-        p[0] = p[1] + [p[2]]
+        p[1].append(p[2])
+        p[0] = p[1]
 
 
 def p_switch_case(p):
     """
     switch_case : CASE expression COLON NEWLINE INDENT statements DEDENT
     """
-    p[0] = ("case", p[2], p[6])
+    p[0] = nodes.Case(p[2], p[6], lineno=lineno(p))
 
 
 def p_var_def(p):
@@ -256,16 +276,26 @@ def p_var_def(p):
             | type IDENTIFIER EQUAL expression
     """
     if len(p) == 3:
-        p[0] = ("var_def", p[1], p[2])
+        p[0] = nodes.VarDef(p[1], p[2], lineno=lineno(p))
     else:
-        p[0] = ("var_def", p[1], p[2], p[4])
+        p[0] = nodes.VarDef(p[1], p[2], p[4], lineno=lineno(p))
+
+
+def p_class_type(p):
+    """
+    type : IDENTIFIER
+    """
+    # Defined before expression : IDENTIFIER, so a name followed by
+    # another name declares an instance. Class types are not array
+    # elements, which keeps a name followed by [ an index.
+    p[0] = p[1]
 
 
 def p_assignment(p):
     """
     assignment : IDENTIFIER assignment_op_sign expression
     """
-    p[0] = ("assignment", p[2], p[1], p[3])
+    p[0] = nodes.Assignment(p[2], p[1], p[3], lineno=lineno(p))
 
 
 def p_assignment_op_sign(p):
@@ -299,10 +329,10 @@ def p_params_opt_star(p):
     """
     actions = {
         2: lambda p: p[1],
-        3: lambda p: ("star", p[2]),
-        4: lambda p: p[1] + [("star", p[3])],
-        5: lambda p: [("star", p[2])] + p[4],
-        6: lambda p: p[1] + [("star", p[3])] + p[5]
+        3: lambda p: nodes.Star(p[2], lineno=lineno(p)),
+        4: lambda p: p[1] + [nodes.Star(p[3], lineno=lineno(p))],
+        5: lambda p: [nodes.Star(p[2], lineno=lineno(p))] + p[4],
+        6: lambda p: p[1] + [nodes.Star(p[3], lineno=lineno(p))] + p[5]
     }
     p[0] = actions[len(p)](p)
 
@@ -311,7 +341,7 @@ def p_enum_def(p):
     """
     enum_def : ENUM IDENTIFIER LBRACE enum_params RBRACE
     """
-    p[0] = ("enum_def", p[2], p[4])
+    p[0] = nodes.EnumDef(p[2], p[4], lineno=lineno(p))
 
 
 def p_enum_params(p):
@@ -322,25 +352,26 @@ def p_enum_params(p):
     if len(p) == 2:
         p[0] = [p[1]]
     else:
-        p[0] = p[1] + [p[3]]
+        p[1].append(p[3])
+        p[0] = p[1]
 
 
 def p_lambdef(p):
     """
     lambdef : params EQUAL GREATER expression
     """
-    p[0] = ("lambda", p[1], p[4])
+    p[0] = nodes.Lambda(p[1], p[4], lineno=lineno(p))
 
 
-def p_fun_call_stmt(p):
+def p_fun_call(p):
     """
-    fun_call_stmt : IDENTIFIER LPAR RPAR
-                  | IDENTIFIER LPAR args RPAR
+    fun_call : IDENTIFIER LPAR RPAR
+             | IDENTIFIER LPAR args RPAR
     """
     if len(p) == 4:
-        p[0] = ("fun_call", p[1], [])
+        p[0] = nodes.FunCall(p[1], [], lineno=lineno(p))
     else:
-        p[0] = ("fun_call", p[1], p[3])
+        p[0] = nodes.FunCall(p[1], p[3], lineno=lineno(p))
 
 
 def p_args(p):
@@ -351,14 +382,15 @@ def p_args(p):
     if len(p) == 2:
         p[0] = [p[1]]
     else:
-        p[0] = p[1] + [p[3]]
+        p[1].append(p[3])
+        p[0] = p[1]
 
 
 def p_include_stmt(p):
     """
     include_stmt : INCLUDE module_name
     """
-    p[0] = (p[1], p[2])
+    p[0] = nodes.Include(p[2], lineno=lineno(p))
 
 
 def p_module_name(p):
@@ -369,7 +401,8 @@ def p_module_name(p):
     if len(p) == 2:
         p[0] = [p[1]]
     else:
-        p[0] = p[1] + [p[3]]
+        p[1].append(p[3])
+        p[0] = p[1]
 
 
 def p_return_stmt(p):
@@ -377,7 +410,15 @@ def p_return_stmt(p):
     return_stmt : RETURN
                 | RETURN expression
     """
-    p[0] = (p[1], p[2] if len(p) == 3 else None)
+    p[0] = nodes.Return(p[2] if len(p) == 3 else None, lineno=lineno(p))
+
+
+def p_log_stmt(p):
+    """
+    log_stmt : LOG LPAR RPAR
+             | LOG LPAR args RPAR
+    """
+    p[0] = nodes.Log(p[3] if len(p) == 5 else [], lineno=lineno(p))
 
 
 def p_keyword_stmt(p):
@@ -386,27 +427,27 @@ def p_keyword_stmt(p):
                  | SKIP
                  | ESCAPE
     """
-    p[0] = (p[1],)
+    p[0] = nodes.NODES[p[1]](lineno=lineno(p))
 
 
 def p_expression_integer_literal(p):
     """expression : INTEGERLIT"""
-    p[0] = ("integer", p[1])
+    p[0] = nodes.Integer(p[1], lineno=lineno(p))
 
 
 def p_expression_double_literal(p):
     """expression : DOUBLELIT"""
-    p[0] = ("double", p[1])
+    p[0] = nodes.Double(p[1], lineno=lineno(p))
 
 
 def p_expression_boolean_literal(p):
     """expression : BOOLEANLIT"""
-    p[0] = ("boolean", p[1])
+    p[0] = nodes.Boolean(p[1], lineno=lineno(p))
 
 
 def p_expression_string_literal(p):
     """expression : STRINGLIT"""
-    p[0] = ("string", p[1])
+    p[0] = nodes.String(p[1], lineno=lineno(p))
 
 
 def p_expression_binop(p):
@@ -418,7 +459,7 @@ def p_expression_binop(p):
                | expression PERCENT expression
                | expression DOUBLESTAR expression
     """
-    p[0] = ("binop", p[2], p[1], p[3])
+    p[0] = nodes.Binop(p[2], p[1], p[3], lineno=lineno(p))
 
 
 def p_expression_group(p):
@@ -437,7 +478,7 @@ def p_expression_comparision(p):
                | expression GREATER expression
                | expression GREATEREQUAL expression
     """
-    p[0] = ("comparison", p[2], p[1], p[3])
+    p[0] = nodes.Comparison(p[2], p[1], p[3], lineno=lineno(p))
 
 
 def p_expression_stmt(p):
@@ -447,39 +488,53 @@ def p_expression_stmt(p):
     p[0] = p[1]
 
 
+def p_expression_fun_call(p):
+    """
+    expression : fun_call
+    """
+    p[0] = p[1]
+
+
+def p_expression_await(p):
+    """
+    expression : AWAIT fun_call
+    """
+    p[0] = nodes.Await(p[2], lineno=lineno(p))
+
+
 def p_expression_identifier(p):
     """
     expression : IDENTIFIER
     """
-    p[0] = ("identifier", p[1])
+    p[0] = nodes.Identifier(p[1], lineno=lineno(p))
 
 
 def p_expression_string_template(p):
     """
     expression : TEMPLATE_STRING
     """
-    p[0] = ("template_string", p[1])
+    p[0] = nodes.TemplateString(p[1], lineno=lineno(p))
 
 
 def p_expression_inline_condition(p):
     """
     expression : expression QUESTION expression EXCLAMATION expression
     """
-    p[0] = ("inline_condition", p[1], p[3], p[5])
+    p[0] = nodes.InlineCondition(p[1], p[3], p[5], lineno=lineno(p))
 
 
 def p_expression_logical_or(p):
     """
     expression : expression DOUBLE_VBAR expression
     """
-    p[0] = ("logical_or", p[1], p[3])
+    p[0] = nodes.LogicalOr(p[1], p[3], lineno=lineno(p))
 
 
 def p_expression_logical_and(p):
     """
     expression : expression DOUBLE_AMP expression
     """
-    p[0] = ("logical_and", p[1], p[3])
+    p[0] = nodes.LogicalAnd(p[1], p[3], lineno=lineno(p))
 
 
 def p_type(p):
@@ -522,7 +577,8 @@ def p_composed_types(p):
 
 def p_array_type(p):
     """
-    array_type : type LSQB RSQB
+    array_type : primitive_types LSQB RSQB
+               | composed_types LSQB RSQB
     """
     p[0] = f"{p[1]}[]"
 
@@ -533,16 +589,23 @@ def p_array_literals(p):
                | LSQB args RSQB
     """
     if len(p) == 3:
-        p[0] = ("array_literal", [])
+        p[0] = nodes.ArrayLiteral([], lineno=lineno(p))
     else:
-        p[0] = ("array_literal", p[2])
+        p[0] = nodes.ArrayLiteral(p[2], lineno=lineno(p))
 
 
 def p_array_range(p):
     """
     expression : LSQB expression ELLIPSIS expression RSQB
     """
-    p[0] = ("array_range", p[2], p[4])
+    p[0] = nodes.ArrayRange(p[2], p[4], lineno=lineno(p))
+
+
+def p_expression_index(p):
+    """
+    expression : expression LSQB expression RSQB
+    """
+    p[0] = nodes.Index(p[1], p[3], lineno=lineno(p))
 
 
 def p_array_comprehension(p):
@@ -551,16 +614,16 @@ def p_array_comprehension(p):
                | LSQB expression FOR param IN expression WHEN expression RSQB
     """
     if len(p) == 8:
-        p[0] = ("array_comprehension", p[2], p[4], p[6])
+        p[0] = nodes.ArrayComprehension(p[2], p[4], p[6], lineno=lineno(p))
     else:
-        p[0] = ("array_comprehension", p[2], p[4], p[6], p[8])
+        p[0] = nodes.ArrayComprehension(p[2], p[4], p[6], p[8], lineno=lineno(p))
 
 
 def p_object_type(p):
     """
     object_type : ktype COLON type
     """
-    p[0] = "{%s: %s}" % (p[2], p[5])
+    p[0] = "{%s: %s}" % (p[1], p[3])
 
 
 def p_ktype(p):
@@ -578,9 +641,9 @@ def p_object_literals(p):
                | LBRACE unpacked_kvpairs RBRACE
     """
     if len(p) == 3:
-        p[0] = ("object_literal", {})
+        p[0] = nodes.ObjectLiteral({}, lineno=lineno(p))
     else:
-        p[0] = ("object_literal", p[2])
+        p[0] = nodes.ObjectLiteral(p[2], lineno=lineno(p))
 
 
 def p_unpacked_kvpairs(p):
@@ -591,7 +654,8 @@ def p_unpacked_kvpairs(p):
     if len(p) == 2:
         p[0] = [p[1]]
     else:
-        p[0] = p[1] + [p[3]]
+        p[1].append(p[3])
+        p[0] = p[1]
 
 
 def p_unpacked_kvpair(p):
@@ -600,7 +664,7 @@ def p_unpacked_kvpair(p):
                     | kvpair
     """
     if len(p) == 3:
-        p[0] = ("unpack", p[2])
+        p[0] = nodes.Unpack(p[2], lineno=lineno(p))
     else:
         p[0] = p[1]
 
@@ -613,14 +677,15 @@ def p_kvpairs(p):
     if len(p) == 2:
         p[0] = {p[1][0]: p[1][1]}
     else:
-        p[0] = {**p[1], p[3][0]: p[3][1]}
+        p[1][p[3][0]] = p[3][1]
+        p[0] = p[1]
 
 
 def p_kvpair(p):
     """
     kvpair : kv_key COLON expression
     """
-    p[0] = ("keypair", p[1], p[3])
+    p[0] = nodes.Keypair(p[1], p[3], lineno=lineno(p))
 
 
 def p_kv_key(p):
@@ -636,7 +701,7 @@ def p_try_stmt(p):
     """
     try_stmt : TRY COLON block except_blocks
     """
-    p[0] = ("try", p[3], p[4])
+    p[0] = nodes.Try(p[3], p[4], lineno=lineno(p))
 
 
 def p_except_blocks(p):
@@ -647,7 +712,8 @@ def p_except_blocks(p):
     if len(p) == 2:
         p[0] = [p[1]]
     else:
-        p[0] = p[1] + [p[2]]
+        p[1].append(p[2])
+        p[0] = p[1]
 
 
 def p_except_block(p):
@@ -656,16 +722,43 @@ def p_except_block(p):
                  | EXCEPT IDENTIFIER COLON block
     """
     if len(p) == 4:
-        p[0] = ("except", None, p[3])
+        p[0] = nodes.Except(None, p[3], lineno=lineno(p))
     else:
-        p[0] = ("except", p[2], p[4])
+        p[0] = nodes.Except(p[2], p[4], lineno=lineno(p))
+
+
+def p_raise_stmt(p):
+    """
+    raise_stmt : RAISE IDENTIFIER
+    """
+    p[0] = nodes.Raise(p[2], lineno=lineno(p))
 
 
 def p_error(p):
+    # Errors are collected for the caller to report; an error at the end of
+    # the input has no token and no lexer to record it on, see
+    # syntax_errors.
     if p:
-        print(f"Syntax error at '{p.value}'")
-    else:
-        print("Syntax error at EOF")
+        p.lexer.errors.append((p.lineno, p.value))
+
+
+def syntax_errors(tree, lexer):
+    # Recovering at the end of the input is impossible, so an error there
+    # is the one that leaves no tree.
+    if tree is None and not lexer.errors:
+        lexer.errors.append((lexer.lexer.lineno, None))
+    return lexer.errors
+
+
+def checked(tree, lexer):
+    errors = syntax_errors(tree, lexer)
+    if errors:
+        line, value = errors[0]
+        # The line is shown after the message.
+        error = SyntaxError("Syntax error at EOF" if value is None else f"Syntax error at {value!r}")
+        error.lineno = line
+        raise error
+    return tree
 
 
 def ensure_newline_at_end(data):
@@ -674,6 +767,31 @@ def ensure_newline_at_end(data):
     return data
 
 
-parser = yacc.yacc()
+parser = build_parser(sys.modules[__name__])
 parser_function = parser.parse
-parser.parse = lambda data: parser_function(ensure_newline_at_end(data))
+
+
+def parse(data):
+    lexer = Lexer()
+    return checked(parser_function(ensure_newline_at_end(data), lexer=lexer), lexer)
+
+
+parser.parse = parse
+
+
+def parse_stream(source):
+    lexer = Lexer()
+    lexer.input_stream(source, final_newline=True)
+    return checked(parser_function(lexer=lexer), lexer)
+
+
+def parse_arena(source):
+    lexer = Lexer()
+    if isinstance(source, str):
+        lexer.input(ensure_newline_at_end(source))
+    else:
+        lexer.input_stream(source, final_newline=True)
+    # A shallow copy shares the LR tables but carries its own arena.
+    arena_parser = copy.copy(parser)
+    arena_parser.arena = Arena()
+    return checked(parser_function.__func__(arena_parser, lexer=lexer), lexer)
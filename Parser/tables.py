@@ -0,0 +1,82 @@
+import hashlib
+import importlib.util
+import os
+import shutil
+import tempfile
+
+import ply
+import ply.lex as lex
+import ply.yacc as yacc
+
+
+def cache_dir():
+    directory = os.environ.get("O_CACHE_DIR")
+    if not directory:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache")
+        directory = os.path.join(base, "o")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def signature(module, prefix, *names):
+    digest = hashlib.sha256(ply.__version__.encode())
+    rules = [(name, getattr(module, name))
+             for name in dir(module) if name.startswith(prefix)]
+    # PLY orders function rules by definition line, so the order is part
+    # of the grammar even though the line numbers themselves are not.
+    rules.sort(key=lambda rule: (
+        not callable(rule[1]),
+        rule[1].__code__.co_firstlineno if callable(rule[1]) else 0,
+        rule[0],
+    ))
+    for name, rule in rules:
+        text = rule.__doc__ if callable(rule) else rule
+        digest.update(f"{name}={text!r};".encode())
+    for name in names:
+        digest.update(f"{name}={getattr(module, name, None)!r};".encode())
+    return digest.hexdigest()[:16]
+
+
+def load_table(directory, name):
+    path = os.path.join(directory, name + ".py")
+    if not os.path.exists(path):
+        return None
+    spec = importlib.util.spec_from_file_location(name, path)
+    table = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(table)
+    except Exception:
+        return None
+    return table
+
+
+def cached(name, build):
+    directory = cache_dir()
+    table = load_table(directory, name)
+    if table is not None:
+        return build(table, None)
+    # Tables are written to a private directory and then moved into place,
+    # so concurrent workers never import a half-written file.
+    outputdir = tempfile.mkdtemp(dir=directory)
+    try:
+        result = build(name, outputdir)
+        written = os.path.join(outputdir, name + ".py")
+        if os.path.exists(written):
+            os.replace(written, os.path.join(directory, name + ".py"))
+        return result
+    finally:
+        shutil.rmtree(outputdir, ignore_errors=True)
+
+
+def build_lexer(module):
+    name = "lextab_" + signature(module, "t_", "tokens", "literals", "states")
+    return cached(name, lambda table, outputdir: lex.lex(
+        module=module, optimize=1, lextab=table, outputdir=outputdir))
+
+
+def build_parser(module):
+    name = "parsetab_" + signature(module, "p_", "tokens", "precedence", "start")
+    return cached(name, lambda table, outputdir: yacc.yacc(
+        module=module, optimize=1, tabmodule=table, outputdir=outputdir,
+        debug=False))
@@ -1,89 +1,371 @@
-from .scope import Scope
+import re
+
+from Parser.nodes import NodeView, dispatch_table, is_node, object_entries
+
+from . import types
+from .symtable import SymbolTable
+
+# Keys of object literals keep only their text, so "1" and 1 look alike.
+_integer_key = re.compile(r"-?\d+")
+# What async functions can await besides each other. Each takes an int:
+# milliseconds to sleep or a file descriptor to wait on.
+AWAITABLES = {"sleep", "readable", "writable"}
 
 
 class SemanticAnalyzer:
-    def __init__(self):
-        self.global_scope = Scope()
-        self.current_scope = self.global_scope
+    def __init__(self, externs=()):
+        self.symbols = SymbolTable()
+        self.global_scope = self.symbols.global_scope
+        # Functions exported by the included modules, as (name, rtype,
+        # param_types) triples.
+        for name, rtype, param_types in externs:
+            self.symbols.define(name, ("function", rtype), list(param_types))
+        self.return_types = []
+        self.coroutine = None
+        self.dispatch = dispatch_table(self, "analyze_", self.generic_analyze)
 
     def analyze(self, node):
-        method_name = f"analyze_{node[0]}"
-        method = getattr(self, method_name, self.generic_analyze)
+        method = self.dispatch.get(node.__class__)
+        if method is None:
+            if isinstance(node, list):
+                method = self.generic_analyze
+            else:
+                method = self.dispatch.get(node[0], self.generic_analyze)
         return method(node)
 
+    @property
+    def current_scope(self):
+        return self.symbols.current_scope
+
     def generic_analyze(self, node):
-        for child in node[1:]:
-            if isinstance(child, tuple):
+        for child in node if isinstance(node, list) else node[1:]:
+            if is_node(child):
                 self.analyze(child)
+            elif isinstance(child, list):
+                for item in child:
+                    if is_node(item):
+                        self.analyze(item)
+
+    def typed(self, node, type):
+        # Expressions are annotated once here, so later passes read the type
+        # off the node instead of working it out again.
+        if isinstance(node, NodeView):
+            node.type = type
+        return type
+
+    def analyze_literal(self, node):
+        return self.typed(node, types.LITERALS[node[0]])
+
+    analyze_integer = analyze_double = analyze_boolean = analyze_literal
+    analyze_string = analyze_template_string = analyze_literal
 
     def analyze_identifier(self, node):
         _, name = node
-        symbol = self.global_scope.resolve(name)
+        symbol = self.symbols.resolve(name)
         if symbol is None:
             raise Exception(f"Undefined variable '{name}'")
+        return self.typed(node, symbol.type)
 
     def analyze_binop(self, node):
-        _, _, left, right = node
-        self.analyze(left)
-        self.analyze(right)
+        _, op, left, right = node
+        left = self.analyze(left)
+        right = self.analyze(right)
+        return self.typed(node, types.arithmetic(op, left, right))
 
     def analyze_comparison(self, node):
-        _, _, left, right = node
-        self.analyze(left)
-        self.analyze(right)
+        _, op, left, right = node
+        left = self.analyze(left)
+        right = self.analyze(right)
+        if left is not None and right is not None and types.unify(left, right) is None:
+            raise Exception(f"Type mismatch: cannot compare {left} and {right}")
+        return self.typed(node, types.BOOL)
+
+    def check_condition(self, node):
+        type = self.analyze(node)
+        if type is not None and type not in types.CONDITIONS:
+            raise Exception(f"Type mismatch: {type} is not a condition")
+        return type
+
+    def analyze_logical_or(self, node):
+        _, left, right = node
+        self.check_condition(left)
+        self.check_condition(right)
+        return self.typed(node, types.BOOL)
+
+    analyze_logical_and = analyze_logical_or
+
+    def analyze_inline_condition(self, node):
+        _, condition, true_value, false_value = node
+        self.check_condition(condition)
+        true_type = self.analyze(true_value)
+        false_type = self.analyze(false_value)
+        type = types.unify(true_type, false_type)
+        if type is None and true_type is not None and false_type is not None:
+            raise Exception(f"Type mismatch: branches are {true_type} and {false_type}")
+        return self.typed(node, type)
+
+    def analyze_array_literal(self, node):
+        _, elements = node
+        type = None
+        for element in elements:
+            element_type = self.analyze(element)
+            unified = types.unify(type, element_type)
+            if unified is None and type is not None and element_type is not None:
+                raise Exception(f"Type mismatch: array mixes {type} and {element_type}")
+            type = unified
+        return self.typed(node, types.array_of(type))
+
+    def analyze_array_range(self, node):
+        _, start, end = node
+        for bound in (start, end):
+            type = self.analyze(bound)
+            if type is not None and type != types.INT:
+                raise Exception(f"Type mismatch: range bound must be int, not {type}")
+        return self.typed(node, types.array_of(types.INT))
+
+    def analyze_array_comprehension(self, node):
+        _, element, param, iterable, *condition = node
+        self.check_iterable(param, self.analyze(iterable))
+        self.symbols.enter()
+        self.symbols.define(param[1], param[0])
+        for value in condition:
+            if value is not None:
+                self.check_condition(value)
+        type = self.analyze(element)
+        self.symbols.leave()
+        return self.typed(node, types.array_of(type))
+
+    def analyze_object_literal(self, node, expected=None):
+        _, entries = node
+        key_type, value_type = types.key_of(expected), types.value_of(expected)
+        keys = values = None
+        for entry in object_entries(entries):
+            if entry[0] == "unpack":
+                symbol = self.symbols.resolve(entry[1])
+                if symbol is None:
+                    raise Exception(f"Undefined variable '{entry[1]}'")
+                if symbol.type is not None and not types.is_map(symbol.type):
+                    raise Exception(f"Type mismatch: cannot unpack {symbol.type}")
+                if expected is not None and symbol.type not in (None, expected):
+                    raise Exception(f"Type mismatch: cannot unpack {symbol.type} into {expected}")
+                entry_key, entry_value = types.key_of(symbol.type), types.value_of(symbol.type)
+            else:
+                _, key, value = entry
+                if key_type == types.INT and not _integer_key.fullmatch(key):
+                    raise Exception(f"Type mismatch: key '{key}' is not int")
+                # Keys that read as integers fit either key type.
+                entry_key = None if _integer_key.fullmatch(key) else types.STR
+                entry_value = self.analyze_value(value, value_type)
+                if not types.assignable(value_type, entry_value):
+                    raise Exception(f"Type mismatch: cannot store {entry_value} in {expected}")
+            keys = self.unify_entries(keys, entry_key, "keys")
+            values = self.unify_entries(values, entry_value, "values")
+        if expected is not None:
+            return self.typed(node, expected)
+        return self.typed(node, types.map_of(keys, values))
+
+    def unify_entries(self, type, entry_type, what):
+        unified = types.unify(type, entry_type)
+        if unified is None and type is not None and entry_type is not None:
+            raise Exception(f"Type mismatch: map {what} mix {type} and {entry_type}")
+        return unified
+
+    def analyze_value(self, node, expected):
+        # Empty and object literals have no complete type of their own and
+        # take the type of whatever they are assigned to.
+        if is_node(node) and node[0] == "object_literal" and types.is_map(expected):
+            return self.analyze_object_literal(node, expected)
+        value = self.analyze(node)
+        if value is None and expected is not None and is_node(node) \
+                and node[0] in ("array_literal", "object_literal"):
+            return self.typed(node, expected)
+        return value
+
+    def analyze_index(self, node):
+        _, target, key = node
+        type = self.analyze(target)
+        key = self.analyze(key)
+        if type is None:
+            return self.typed(node, None)
+        if types.is_map(type):
+            if not types.assignable(types.key_of(type), key):
+                raise Exception(f"Type mismatch: cannot index {type} with {key}")
+            return self.typed(node, types.value_of(type))
+        if types.element_of(type) is None:
+            raise Exception(f"Type mismatch: cannot index {type}")
+        if key is not None and key != types.INT:
+            raise Exception(f"Type mismatch: array index must be int, not {key}")
+        return self.typed(node, types.element_of(type))
+
+    def check_iterable(self, param, type):
+        # Iterating a map visits its keys.
+        element = types.element_of(type) or types.key_of(type)
+        if type is not None and element is None:
+            raise Exception(f"Type mismatch: cannot iterate over {type}")
+        if not types.assignable(param[0], element):
+            raise Exception(f"Type mismatch: cannot assign {element} to {param[0]}")
 
     def analyze_var_def(self, node):
         _, type, name, *rest = node
-        self.current_scope.define(name, type)
+        if rest and rest[0] is not None:
+            value = self.analyze_value(rest[0], type)
+            if not types.assignable(type, value):
+                raise Exception(f"Type mismatch: cannot assign {value} to {type}")
+        self.symbols.define(name, type)
 
     def analyze_assignment(self, node):
-        _, name, value = node
-        symbol = self.current_scope.resolve(name)
+        _, op, name, value = node
+        symbol = self.symbols.resolve(name)
         if symbol is None:
             raise Exception(f"Undefined variable '{name}'")
-        self.analyze(value)
-        if symbol.type.startswith(value[0]):
-            raise Exception(
-                f"Type mismatch: cannot assign {value[0]} to {symbol[0]}"
-            )
+        value = self.analyze_value(value, symbol.type if op == "=" else None)
+        if op != "=":
+            value = types.arithmetic(op[:-1], symbol.type, value)
+        if not types.assignable(symbol.type, value):
+            raise Exception(f"Type mismatch: cannot assign {value} to {symbol.type}")
 
     def analyze_enum_def(self, node):
         _, name, values = node
-        self.current_scope.define(name, ("enum", values))
+        self.symbols.define(name, ("enum", values))
 
     def analyze_lambda(self, node):
         _, params, body = node
-        # Set parent to current scope
-        function_scope = Scope(parent=self.current_scope)
+        coroutine, self.coroutine = self.coroutine, None
+        self.symbols.enter()
         for param in params:
-            function_scope.define(param[1], param[0])
-        previous_scope = self.current_scope
-        self.current_scope = function_scope
-        self.analyze(body)
-        self.current_scope = previous_scope
+            self.symbols.define(param[1], param[0])
+        rtype = self.analyze(body)
+        self.symbols.leave()
+        self.coroutine = coroutine
+        return self.typed(node, ("function", rtype))
 
-    def analyze_fun_def(self, node):
+    def analyze_fun_def(self, node, kind="function"):
         _, _, rtype, name, params, body = node
-        self.current_scope.define(name, ("function", rtype))
-        # Set parent to current scope
-        function_scope = Scope(parent=self.current_scope)
+        self.symbols.define(name, (kind, rtype), [param[0] for param in params])
+        self.return_types.append(rtype)
+        self.symbols.enter()
         for param in params:
-            function_scope.define(param[1], param[0])
-        previous_scope = self.current_scope
-        self.current_scope = function_scope
+            self.symbols.define(param[1], param[0])
         for statement in body:
             self.analyze(statement)
-        self.current_scope = previous_scope
+        self.symbols.leave()
+        self.return_types.pop()
+
+    def analyze_async(self, node):
+        _, function = node
+        coroutine, self.coroutine = self.coroutine, function
+        self.analyze_fun_def(function, "async")
+        self.coroutine = coroutine
+
+    def analyze_await(self, node):
+        _, call = node
+        _, name, args = call
+        if self.coroutine is None:
+            raise Exception("'await' outside of an async function")
+        if name in AWAITABLES:
+            if len(args) != 1:
+                raise Exception(f"'{name}' takes 1 argument, {len(args)} given")
+            type = self.analyze(args[0])
+            if not types.assignable(types.INT, type):
+                raise Exception(f"Type mismatch: cannot pass {type} as {types.INT}")
+            self.typed(call, types.VOID)
+            return self.typed(node, types.VOID)
+        symbol = self.symbols.resolve(name)
+        if symbol is None or not isinstance(symbol.type, tuple) or symbol.type[0] != "async":
+            raise Exception(f"Cannot await '{name}', which is not an async function")
+        self.analyze(call)
+        return self.typed(node, symbol.type[1])
+
+    def analyze_class_ctor_def(self, node):
+        _, _, params, body = node
+        self.symbols.enter()
+        for param in params:
+            self.symbols.define(param[1], param[0])
+        for statement in body:
+            self.analyze(statement)
+        self.symbols.leave()
 
     def analyze_class_def(self, node):
-        _, name, *body = node
-        self.current_scope.define(name, ("class", body))
-        class_scope = Scope(parent=self.current_scope)
-        previous_scope = self.current_scope
-        self.current_scope = class_scope
+        _, _, name, _, body = node
+        self.symbols.define(name, ("class", body))
+        self.symbols.enter()
+        for statement in body:
+            self.analyze(statement)
+        self.symbols.leave()
+
+    def analyze_fun_call(self, node):
+        _, name, args = node
+        symbol = self.symbols.resolve(name)
+        arg_types = [self.analyze(arg) for arg in args]
+        if symbol is None:
+            if name == "push":
+                self.check_push(arg_types)
+            elif name == "put":
+                self.check_put(arg_types)
+            else:
+                raise Exception(f"Undefined function '{name}'")
+            return self.typed(node, None)
+        if isinstance(symbol.type, tuple) and symbol.type[0] == "class":
+            self.check_construction(name, symbol.type[1], arg_types)
+            return self.typed(node, name)
+        if isinstance(symbol.value, list):
+            if len(symbol.value) != len(arg_types):
+                raise Exception(f"'{name}' takes {len(symbol.value)} arguments, "
+                                f"{len(arg_types)} given")
+            for param_type, arg_type in zip(symbol.value, arg_types):
+                if not types.assignable(param_type, arg_type):
+                    raise Exception(f"Type mismatch: cannot pass {arg_type} as {param_type}")
+        if isinstance(symbol.type, tuple) and symbol.type[0] == "async":
+            # Calling an async function without awaiting it starts a task
+            # and gives nothing back.
+            return self.typed(node, types.VOID)
+        return self.typed(node, types.return_of(symbol.type))
+
+    def check_construction(self, name, body, arg_types):
+        ctors = [item for item in body if item[0] == "class_ctor_def"]
+        params = [param[0] for param in ctors[0][2]] if ctors else []
+        if len(params) != len(arg_types):
+            raise Exception(f"'{name}' takes {len(params)} arguments, {len(arg_types)} given")
+        for param_type, arg_type in zip(params, arg_types):
+            if not types.assignable(param_type, arg_type):
+                raise Exception(f"Type mismatch: cannot pass {arg_type} as {param_type}")
+
+    def check_push(self, arg_types):
+        if len(arg_types) != 2:
+            raise Exception(f"'push' takes 2 arguments, {len(arg_types)} given")
+        array, value = arg_types
+        element = types.element_of(array)
+        if array is not None and element is None:
+            raise Exception(f"Type mismatch: cannot push onto {array}")
+        if not types.assignable(element, value):
+            raise Exception(f"Type mismatch: cannot push {value} onto {array}")
+
+    def check_put(self, arg_types):
+        if len(arg_types) != 3:
+            raise Exception(f"'put' takes 3 arguments, {len(arg_types)} given")
+        map, key, value = arg_types
+        if map is not None and not types.is_map(map):
+            raise Exception(f"Type mismatch: cannot put into {map}")
+        if not types.assignable(types.key_of(map), key):
+            raise Exception(f"Type mismatch: cannot use {key} as a key of {map}")
+        if not types.assignable(types.value_of(map), value):
+            raise Exception(f"Type mismatch: cannot put {value} into {map}")
+
+    def analyze_log(self, node):
+        _, args = node
+        for arg in args:
+            type = self.analyze(arg)
+            if type is not None and type not in types.FORMATTABLE:
+                raise Exception(f"Type mismatch: cannot log {type}")
+
+    def analyze_for_stmt(self, node):
+        _, param, iterable, body = node
+        self.check_iterable(param, self.analyze(iterable))
+        self.symbols.enter()
+        self.symbols.define(param[1], param[0])
         for statement in body:
             self.analyze(statement)
-        self.current_scope = previous_scope
+        self.symbols.leave()
 
     def analyze_when_stmts(self, node):
         _, *cases = node
@@ -92,13 +374,18 @@ class SemanticAnalyzer:
 
     def analyze_when(self, node):
         _, condition, body = node
-        self.analyze(condition)
+        self.check_condition(condition)
         for statement in body:
             self.analyze(statement)
 
     def analyze_return(self, node):
         _, value = node
-        self.analyze(value)
+        if value is None:
+            return
+        type = self.analyze_value(value, self.return_types[-1] if self.return_types else None)
+        if self.return_types and not types.assignable(self.return_types[-1], type):
+            raise Exception(f"Type mismatch: cannot return {type} from a "
+                            f"{self.return_types[-1]} function")
 
     def analyze_pass(self, node):
         pass
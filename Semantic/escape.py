@@ -0,0 +1,186 @@
+from Parser.nodes import dispatch_table, identity, is_node
+
+# Expressions that build a new array no one else refers to yet.
+FRESH_ARRAYS = {"array_literal", "array_range", "array_comprehension"}
+# Builtins that change their first argument in place without keeping it.
+MUTATORS = {"push", "put"}
+
+
+class EscapeAnalyzer:
+    # Finds the class instances that never outlive the call creating them,
+    # so the generator can keep them on the stack. An instance escapes when
+    # it is returned, stored anywhere but a local variable, captured by a
+    # lambda or passed to a parameter that escapes. Whether a parameter
+    # escapes is summarized per function and iterated to a fixed point, as
+    # functions may call each other in any order.
+    #
+    # It also finds the local arrays a function owns: variables that only
+    # ever hold arrays built in that function and never escape. The
+    # generator frees such an array when its variable is given a new one
+    # and when the function returns. Every other array lives until the
+    # program exits.
+    def __init__(self):
+        self.classes = {}
+        self.functions = set()
+        self.summaries = {}
+        self.current_class = None
+        self.locals = None
+        self.escaped = set()
+        self.owners = {}
+        self.candidates = []
+        self.params = set()
+        self.fresh = {}
+        self.declared = {}
+        self.stack = set()
+        self.owned = set()
+        self.dispatch = dispatch_table(self, "use_", self.generic_use)
+
+    def analyze(self, tree):
+        if is_node(tree):
+            tree = tree[1] if tree[0] == "program" else [tree]
+        body = tree
+        for statement in body:
+            if statement[0] == "class_def":
+                self.classes[statement[2]] = {item[3] for item in statement[4] if item[0] == "fun_def"}
+            elif statement[0] == "fun_def":
+                self.functions.add(statement[3])
+        while True:
+            summaries = dict(self.summaries)
+            self.stack = set()
+            self.owned = set()
+            self.use(body, True)
+            if summaries == self.summaries:
+                return self.stack
+
+    def use(self, node, escapes):
+        if isinstance(node, list):
+            for item in node:
+                self.use(item, escapes)
+            return
+        if isinstance(node, dict):
+            for value in node.values():
+                self.use(value, escapes)
+            return
+        if not is_node(node) or not node:
+            return
+        method = self.dispatch.get(node.__class__)
+        if method is None:
+            method = self.dispatch.get(node[0], self.generic_use)
+        method(node, escapes)
+
+    def generic_use(self, node, escapes):
+        for value in node[1:]:
+            if is_node(value) or isinstance(value, (list, dict)):
+                self.use(value, escapes)
+
+    def resolve(self, name):
+        # Calls resolve as the generator resolves them: constructors first,
+        # then methods of the class being generated, then functions.
+        if name in self.classes:
+            return name
+        if self.current_class is not None and name in self.classes[self.current_class]:
+            return f"{self.current_class}_{name}"
+        if name in self.functions:
+            return name
+        return None
+
+    def function(self, key, params, body, stored=()):
+        saved = self.locals, self.escaped, self.owners, self.candidates, self.params, self.fresh, self.declared
+        self.locals = {param[1] for param in params}
+        self.escaped, self.owners, self.candidates = set(), {}, []
+        self.params, self.fresh, self.declared = set(self.locals), {}, {}
+        self.use(list(stored), True)
+        self.use(body, False)
+        for site in self.candidates:
+            if self.owners.get(identity(site)) not in self.escaped:
+                self.stack.add(identity(site))
+        for name, definitions in self.declared.items():
+            # Parameters hold their caller's arrays.
+            if self.fresh.get(name) and name not in self.escaped and name not in self.params:
+                self.owned.update(definitions)
+        summary = [param[1] in self.escaped for param in params]
+        self.summaries[key] = [old or new for old, new in zip(self.summaries.get(key, summary), summary)]
+        self.locals, self.escaped, self.owners, self.candidates, self.params, self.fresh, self.declared = saved
+
+    def bind(self, name, value):
+        if self.locals is not None and name in self.locals:
+            fresh = is_node(value) and value[0] in FRESH_ARRAYS
+            self.fresh[name] = self.fresh.get(name, True) and fresh
+        if self.locals is None or name not in self.locals:
+            # Globals live forever and fields as long as their instance.
+            self.use(value, True)
+        elif is_node(value) and value[0] == "fun_call" and value[1] in self.classes:
+            self.use(value, False)
+            self.owners[identity(value)] = name
+        else:
+            # Copies of an instance are not tracked apart from the original.
+            self.use(value, True)
+
+    def use_identifier(self, node, escapes):
+        if escapes:
+            self.escaped.add(node[1])
+
+    def use_var_def(self, node, escapes):
+        _, _, name, *rest = node
+        if self.locals is not None:
+            self.locals.add(name)
+            self.declared.setdefault(name, []).append(identity(node))
+        if rest and rest[0] is not None:
+            self.bind(name, rest[0])
+
+    def use_assignment(self, node, escapes):
+        _, op, name, value = node
+        if op == "=" and self.current_class is None:
+            self.bind(name, value)
+        else:
+            # Assignments in classes store to fields.
+            self.use(value, True)
+
+    def use_return(self, node, escapes):
+        if len(node) > 1:
+            self.use(node[1], True)
+
+    def use_comparison(self, node, escapes):
+        # Instances compare by address, which does not keep them alive.
+        self.use(node[2], False)
+        self.use(node[3], False)
+
+    def use_lambda(self, node, escapes):
+        self.use(node[2], True)
+
+    def use_index(self, node, escapes):
+        # Reading an element of a named array does not hand out the array.
+        _, target, key = node
+        self.use(target, escapes and (not is_node(target) or target[0] != "identifier"))
+        self.use(key, escapes)
+
+    def use_fun_call(self, node, escapes):
+        _, name, args = node
+        callee = self.resolve(name)
+        if callee is None and name in MUTATORS and args:
+            self.use(args[0], False)
+            self.use(args[1:], True)
+            return
+        summary = self.summaries.get(callee, []) if callee is not None else []
+        for index, arg in enumerate(args):
+            self.use(arg, callee is None or (index < len(summary) and summary[index]))
+        if name in self.classes and not escapes and self.locals is not None:
+            self.candidates.append(node)
+
+    def use_fun_def(self, node, escapes):
+        _, _, _, name, params, body = node
+        key = name if self.current_class is None else f"{self.current_class}_{name}"
+        self.function(key, params, body)
+
+    def use_class_def(self, node, escapes):
+        _, _, name, _, body = node
+        saved = self.current_class
+        self.current_class = name
+        defaults = [item[3] for item in body if item[0] == "var_def" and len(item) > 3]
+        ctors = [item for item in body if item[0] == "class_ctor_def"]
+        for _, _, params, ctor_body in ctors or [(None, None, [], [])]:
+            self.function(name, params, ctor_body, defaults)
+        for item in body:
+            if item[0] == "fun_def":
+                self.use(item, False)
+        self.current_class = saved
@@ -0,0 +1,386 @@
+import math
+import operator
+import re
+from collections import Counter
+
+from Parser.nodes import NODES, NodeView, dispatch_table, is_node
+
+from . import types
+
+INT_MIN = -2 ** 31
+# Placeholders of template strings: t"x is {x}".
+PLACEHOLDER = re.compile(r"\{([A-Za-z_]\w*)\}")
+# Statements after these in a block never run.
+TERMINATORS = {"return", "raise", "escape", "skip"}
+DECLARATIONS = {"var_def", "fun_def", "class_def", "enum_def"}
+
+
+def wrap(value):
+    # Integers are i32 and LLVM arithmetic wraps around on overflow.
+    return (value - INT_MIN) % 2 ** 32 + INT_MIN
+
+
+def truth(value):
+    return value != 0 if isinstance(value, float) else bool(value)
+
+
+def view(node):
+    return node.view() if isinstance(node, NodeView) else node
+
+
+def constant(node):
+    if not is_node(node):
+        return None
+    tag = node[0]
+    if tag == "integer":
+        return int(node[1])
+    if tag == "double":
+        return float(node[1])
+    if tag == "boolean":
+        return node[1] == "True"
+    if tag == "string":
+        return node[1]
+    return None
+
+
+def coerce(value, type):
+    if type == types.DOUBLE and not isinstance(value, (bool, str)):
+        return float(value)
+    return value
+
+
+def evaluate(op, left, right):
+    # Returns None whenever the result is not what the generated code would
+    # compute at run time, such as a division by zero.
+    if isinstance(left, str) or isinstance(right, str):
+        return left + right if op == "+" and isinstance(left, str) and isinstance(right, str) else None
+    if isinstance(left, bool) or isinstance(right, bool):
+        return None
+    if op == "**" and (isinstance(left, float) or isinstance(right, float)):
+        try:
+            return math.pow(left, right)
+        except (OverflowError, ValueError):
+            return None
+    if isinstance(left, float) or isinstance(right, float):
+        left, right = float(left), float(right)
+        if op in "/%" and right == 0:
+            return None
+        return {"+": left + right, "-": left - right, "*": left * right,
+                "/": left / right if op == "/" else None,
+                "%": math.fmod(left, right) if op == "%" else None}.get(op)
+    left, right = wrap(left), wrap(right)
+    if op in "/%" and (right == 0 or (left == INT_MIN and right == -1)):
+        return None
+    if op == "/":
+        # sdiv and srem round towards zero, unlike Python's // and %.
+        quotient = abs(left) // abs(right)
+        return quotient if (left < 0) == (right < 0) else -quotient
+    if op == "%":
+        remainder = abs(left) % abs(right)
+        return -remainder if left < 0 else remainder
+    if op == "**":
+        # As o_int_pow: a negative exponent truncates 1 / left ** -right.
+        if right < 0:
+            return 1 if left == 1 else (-1 if right % 2 else 1) if left == -1 else 0
+        return wrap(pow(left, right, 2 ** 32))
+    return wrap({"+": left + right, "-": left - right, "*": left * right}[op])
+
+
+def compare(op, left, right):
+    if isinstance(left, str) or isinstance(right, str):
+        # Strings compare by address, which is unknown until run time.
+        return None
+    if isinstance(left, bool) or isinstance(right, bool):
+        if not (isinstance(left, bool) and isinstance(right, bool)) or op not in ("==", "!="):
+            return None
+    if isinstance(left, float) or isinstance(right, float):
+        # Comparisons are ordered: anything involving NaN is false.
+        if math.isnan(left) or math.isnan(right):
+            return False
+    return {"==": left == right, "!=": left != right, "<": left < right,
+            "<=": left <= right, ">": left > right, ">=": left >= right}.get(op)
+
+
+def calls(node):
+    if isinstance(node, dict):
+        return any(map(calls, node.values()))
+    if isinstance(node, list):
+        return any(map(calls, node))
+    if not is_node(node) or not node:
+        return False
+    return node[0] == "fun_call" or any(calls(value) for value in node[1:])
+
+
+def assigned_names(tree):
+    definitions = Counter()
+    assignments = set()
+    stack = [tree]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, list):
+            stack.extend(value)
+        elif isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif is_node(value) and value:
+            if value[0] == "var_def":
+                definitions[value[2]] += 1
+            elif value[0] == "assignment":
+                assignments.add(value[2])
+            stack.extend(value[1:])
+    return definitions, assignments
+
+
+class ConstantFolder:
+    def __init__(self):
+        self.scopes = [{}]
+        self.definitions = Counter()
+        self.assignments = set()
+        self.dispatch = dispatch_table(self, "fold_", self.generic_fold)
+
+    def fold(self, tree):
+        # A variable is propagated only when it is defined once and never
+        # assigned to, so its value is the same wherever it is read.
+        self.definitions, self.assignments = assigned_names(tree)
+        return self.visit(tree)
+
+    def visit(self, node):
+        if isinstance(node, list):
+            return self.fold_statements(node)
+        if isinstance(node, dict):
+            return {self.visit(key): self.visit(value) for key, value in node.items()}
+        if not is_node(node) or not node:
+            return node
+        method = self.dispatch.get(node.__class__)
+        if method is None:
+            method = self.dispatch.get(node[0], self.generic_fold)
+        return method(node)
+
+    def fold_statements(self, statements):
+        folded = []
+        for statement in statements:
+            statement = self.visit(statement)
+            # Statements fold to a node, to the statements that take their
+            # place, or to None when they have no effect at all.
+            if isinstance(statement, Inline):
+                folded.extend(statement)
+            elif statement is not None:
+                folded.append(statement)
+            if folded and is_node(folded[-1]) and folded[-1][0] in TERMINATORS:
+                break
+        if len(folded) == len(statements) and all(map(operator.is_, folded, statements)):
+            return statements
+        return folded
+
+    def generic_fold(self, node):
+        values = view(node)
+        folded = [self.visit(value) for value in values[1:]]
+        if all(new is old for new, old in zip(folded, values[1:])):
+            return node
+        return self.rebuild(node, values[0], *folded)
+
+    def rebuild(self, node, tag, *values):
+        if isinstance(node, tuple):
+            return (tag, *values)
+        new = NODES[tag](*values, lineno=node.lineno)
+        if tag == node[0] and node.type is not None:
+            new.type = node.type
+        return new
+
+    def literal(self, node, value, type=None):
+        value = coerce(value, type)
+        if isinstance(value, bool):
+            tag, text = "boolean", str(value)
+        elif isinstance(value, int):
+            tag, text = "integer", str(value)
+        elif isinstance(value, float):
+            tag, text = "double", repr(value)
+        else:
+            tag, text = "string", value
+        literal = self.rebuild(node, tag, text)
+        if isinstance(literal, NodeView):
+            literal.type = types.LITERALS[tag]
+        return literal
+
+    def enter(self, params=()):
+        self.scopes.append({param[1]: None for param in params})
+
+    def leave(self):
+        self.scopes.pop()
+
+    def lookup(self, name):
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        return None
+
+    def fold_identifier(self, node):
+        value = self.lookup(node[1])
+        return node if value is None else self.literal(node, value)
+
+    def fold_var_def(self, node):
+        node = self.generic_fold(node)
+        _, type, name, *rest = view(node)
+        value = constant(rest[0]) if rest else None
+        if value is not None and (self.definitions[name] != 1 or name in self.assignments
+                                  or type not in (types.INT, types.DOUBLE, types.BOOL, types.STR)):
+            value = None
+        self.scopes[-1][name] = None if value is None else coerce(value, type)
+        return node
+
+    def fold_binop(self, node):
+        _, op, left, right = node = self.generic_fold(node)
+        left, right = constant(left), constant(right)
+        if left is None or right is None:
+            return node
+        value = evaluate(op, left, right)
+        return node if value is None else self.literal(node, value, getattr(node, "type", None))
+
+    def fold_comparison(self, node):
+        _, op, left, right = node = self.generic_fold(node)
+        left, right = constant(left), constant(right)
+        if left is None or right is None:
+            return node
+        value = compare(op, left, right)
+        return node if value is None else self.literal(node, value)
+
+    def fold_logical_or(self, node):
+        tag, left, right = node = self.generic_fold(node)
+        short = tag == "logical_or"
+        for first, second in ((left, right), (right, left)):
+            value = constant(first)
+            if value is None or isinstance(value, str):
+                continue
+            if truth(value) == short:
+                # A constant right side only decides the result when the
+                # left one has no calls, which must still be made.
+                if first is right and calls(left):
+                    continue
+                return self.literal(node, short)
+            if getattr(second, "type", None) == types.BOOL:
+                return second
+            value = constant(second)
+            if value is not None and not isinstance(value, str):
+                return self.literal(node, truth(value))
+        return node
+
+    fold_logical_and = fold_logical_or
+
+    def fold_inline_condition(self, node):
+        _, condition, true_value, false_value = node = self.generic_fold(node)
+        value = constant(condition)
+        if value is None or isinstance(value, str):
+            return node
+        chosen = true_value if truth(value) else false_value
+        type = getattr(node, "type", None)
+        if type is not None and getattr(chosen, "type", None) != type:
+            value = constant(chosen)
+            if value is None:
+                return node
+            return self.literal(node, value, type)
+        return chosen
+
+    def fold_template_string(self, node):
+        text = node[1]
+
+        def substitute(match):
+            value = self.lookup(match.group(1))
+            # Doubles are left to the runtime, which formats them.
+            if isinstance(value, bool):
+                return str(value)
+            if isinstance(value, (int, str)) and "{" not in str(value) and "}" not in str(value):
+                return str(value)
+            return match.group()
+
+        text = PLACEHOLDER.sub(substitute, text)
+        if not PLACEHOLDER.search(text):
+            return self.literal(node, text)
+        return node if text == node[1] else self.rebuild(node, "template_string", text)
+
+    def fold_when_stmts(self, node):
+        values = view(node)
+        cases = values[1] if len(values) == 2 and isinstance(values[1], list) else values[1:]
+        folded = []
+        for case in cases:
+            if case[0] == "otherwise":
+                folded.append(self.generic_fold(case))
+                break
+            condition = self.visit(case[1])
+            value = constant(condition)
+            if value is not None and not isinstance(value, str):
+                if not truth(value):
+                    continue
+                # The chain ends at a condition that always holds.
+                body = self.visit(case[2])
+                folded.append(self.rebuild(case, "otherwise", body))
+                break
+            body = self.visit(case[2])
+            if condition is not case[1] or body is not case[2]:
+                case = self.rebuild(case, "when", condition, body)
+            folded.append(case)
+        if not folded:
+            return None
+        if folded[0][0] == "otherwise" and not any(
+                is_node(statement) and statement[0] in DECLARATIONS for statement in folded[0][1]):
+            # A body that declares nothing runs in place of the chain; one
+            # that does stays a block of its own.
+            return Inline(folded[0][1])
+        if all(new is old for new, old in zip(folded, cases)) and len(folded) == len(cases):
+            return node
+        if len(values) == 2 and isinstance(values[1], list):
+            return self.rebuild(node, "when_stmts", folded)
+        return self.rebuild(node, "when_stmts", *folded)
+
+    def fold_fun_def(self, node):
+        _, decorators, rtype, name, params, body = view(node)
+        self.enter(params)
+        folded = self.visit(body)
+        self.leave()
+        if folded is body:
+            return node
+        return self.rebuild(node, "fun_def", decorators, rtype, name, params, folded)
+
+    def fold_class_ctor_def(self, node):
+        _, name, params, body = view(node)
+        self.enter(params)
+        folded = self.visit(body)
+        self.leave()
+        return self.rebuild(node, "class_ctor_def", name, params, folded)
+
+    def fold_class_def(self, node):
+        _, decorators, name, base, body = view(node)
+        # Fields are read through the instance and never propagated.
+        self.enter((None, statement[2]) for statement in body if statement[0] == "var_def")
+        folded = [self.visit(statement) if statement[0] != "var_def" else statement
+                  for statement in body]
+        self.leave()
+        return self.rebuild(node, "class_def", decorators, name, base, folded)
+
+    def fold_lambda(self, node):
+        _, params, body = view(node)
+        self.enter(params)
+        folded = self.visit(body)
+        self.leave()
+        return node if folded is body else self.rebuild(node, "lambda", params, folded)
+
+    def fold_for_stmt(self, node):
+        _, param, iterable, body = view(node)
+        iterable = self.visit(iterable)
+        self.enter([param])
+        folded = self.visit(body)
+        self.leave()
+        return self.rebuild(node, "for_stmt", param, iterable, folded)
+
+    def fold_array_comprehension(self, node):
+        _, element, param, iterable, *condition = view(node)
+        iterable = self.visit(iterable)
+        self.enter([param])
+        element = self.visit(element)
+        condition = [self.visit(value) for value in condition]
+        self.leave()
+        return self.rebuild(node, "array_comprehension", element, param, iterable, *condition)
+
+
+class Inline(list):
+    # Statements that take the place of the statement they were folded from.
+    pass
@@ -1,22 +1,25 @@
-from .symbol import Symbol
-
 class Scope:
-    def __init__(self, parent=None):
+    # The undo record of one level of a SymbolTable: the symbols bound at
+    # this depth, popped again when the scope is left.
+    __slots__ = ("table", "depth", "symbols")
+
+    def __init__(self, table, depth):
+        self.table = table
+        self.depth = depth
         self.symbols = {}
-        self.parent = parent
 
-    def define(self, name, type):
-        symbol = Symbol(name, type)
-        self.symbols[name] = symbol
-        return symbol
+    def define(self, name, type, value=None):
+        if self.table.scopes[-1] is not self:
+            raise Exception("Only the innermost scope can define names")
+        return self.table.define(name, type, value)
 
     def resolve(self, name):
-        symbol = self.symbols.get(name)
-        if symbol is not None:
-            return symbol
-        if self.parent is not None:
-            return self.parent.resolve(name)
+        # Bindings deeper than this scope belong to scopes nested inside it
+        # and are not visible from here.
+        for symbol in reversed(self.table.bindings.get(name, ())):
+            if symbol.depth <= self.depth:
+                return symbol
         return None
 
     def __repr__(self):
-        return f"<Scope(symbols={self.symbols}, parent={self.parent})>"
+        return f"<Scope(depth={self.depth}, symbols={self.symbols})>"
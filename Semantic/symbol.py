@@ -1,7 +1,11 @@
 class Symbol:
-    def __init__(self, name, type):
+    __slots__ = ("name", "type", "value", "depth")
+
+    def __init__(self, name, type, value=None, depth=0):
         self.name = name
         self.type = type
+        self.value = value
+        self.depth = depth
 
     def __repr__(self):
         return f"<Symbol(name={self.name}, type={self.type})>"
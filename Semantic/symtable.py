@@ -0,0 +1,69 @@
+from .scope import Scope
+from .symbol import Symbol
+
+
+class SymbolTable:
+    # Every name maps to a stack of its live bindings, innermost last, so
+    # resolving a name is one dict lookup whatever the nesting depth. Each
+    # scope logs the symbols it bound and leaving it pops exactly those.
+    def __init__(self):
+        self.bindings = {}
+        self.scopes = []
+        self.interned = {}
+        self.global_scope = self.enter()
+
+    @property
+    def current_scope(self):
+        return self.scopes[-1]
+
+    @property
+    def depth(self):
+        return len(self.scopes) - 1
+
+    def enter(self):
+        scope = Scope(self, len(self.scopes))
+        self.scopes.append(scope)
+        return scope
+
+    def leave(self):
+        scope = self.scopes.pop()
+        bindings = self.bindings
+        for name in scope.symbols:
+            stack = bindings[name]
+            stack.pop()
+            if not stack:
+                del bindings[name]
+        return scope
+
+    def define(self, name, type, value=None):
+        symbol = self.symbol(name, type, value, len(self.scopes) - 1)
+        stack = self.bindings.get(name)
+        if stack is None:
+            self.bindings[name] = [symbol]
+        elif stack[-1].depth == symbol.depth:
+            # Redefining a name in the same scope replaces its binding
+            # instead of shadowing it.
+            stack[-1] = symbol
+        else:
+            stack.append(symbol)
+        self.scopes[-1].symbols[name] = symbol
+        return symbol
+
+    def symbol(self, name, type, value, depth):
+        # Symbols are never changed once made, so those without a value are
+        # hash-consed: every binding of a name to a type at one depth, say
+        # the int parameter a of each function, shares one Symbol.
+        if value is not None:
+            return Symbol(name, type, value, depth)
+        key = (name, type, depth)
+        try:
+            symbol = self.interned.get(key)
+        except TypeError:
+            return Symbol(name, type, value, depth)
+        if symbol is None:
+            symbol = self.interned[key] = Symbol(name, type, value, depth)
+        return symbol
+
+    def resolve(self, name):
+        stack = self.bindings.get(name)
+        return stack[-1] if stack else None
@@ -0,0 +1,80 @@
+INT = "int"
+DOUBLE = "double"
+BOOL = "bool"
+STR = "str"
+VOID = "void"
+
+NUMERIC = {INT, DOUBLE}
+# Types a map can be keyed by.
+KEYS = {INT, STR}
+# Types that can be written into strings.
+FORMATTABLE = {INT, DOUBLE, BOOL, STR}
+# Types a condition may have; numbers are true when they are not zero.
+CONDITIONS = {BOOL, INT, DOUBLE}
+
+LITERALS = {
+    "integer": INT,
+    "double": DOUBLE,
+    "boolean": BOOL,
+    "string": STR,
+    "template_string": STR,
+}
+
+
+def array_of(element):
+    return None if element is None else f"{element}[]"
+
+
+def element_of(type):
+    if isinstance(type, str) and type.endswith("[]"):
+        return type[:-2]
+    return None
+
+
+def map_of(key, value):
+    return None if key is None or value is None else "{%s: %s}" % (key, value)
+
+
+def is_map(type):
+    return isinstance(type, str) and type.startswith("{")
+
+
+def key_of(type):
+    return type[1:-1].split(": ", 1)[0] if is_map(type) else None
+
+
+def value_of(type):
+    return type[1:-1].split(": ", 1)[1] if is_map(type) else None
+
+
+def return_of(type):
+    if isinstance(type, tuple) and type[0] == "function":
+        return type[1]
+    return None
+
+
+def assignable(target, value):
+    # Unknown types are not checked; ints widen to doubles implicitly.
+    if target is None or value is None or target == value:
+        return True
+    return target == DOUBLE and value == INT
+
+
+def unify(left, right):
+    if left is None or right is None:
+        return left or right
+    if left == right:
+        return left
+    if left in NUMERIC and right in NUMERIC:
+        return DOUBLE
+    return None
+
+
+def arithmetic(op, left, right):
+    if op == "+" and left == STR and right == STR:
+        return STR
+    if left is None or right is None:
+        return None
+    if left not in NUMERIC or right not in NUMERIC:
+        raise Exception(f"Type mismatch: cannot apply '{op}' to {left} and {right}")
+    return unify(left, right)
@@ -0,0 +1,91 @@
+import argparse
+import gc
+import sys
+import tracemalloc
+
+from Parser.nodes import Node
+from Parser.parser import parse_arena, parser
+
+
+def program(functions):
+    lines = []
+    for i in range(functions):
+        lines += [
+            f"int f{i}(int a, int b):",
+            f" int c = a * {i} + b",
+            " when c > 10:",
+            "  c -= 1",
+            " otherwise:",
+            "  c += 1",
+            " return c",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def deep_size(value):
+    # Strings are shared between both representations, so only the
+    # containers that make up the tree are counted.
+    size = 0
+    count = 0
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, Node):
+            size += sys.getsizeof(value)
+            count += 1
+            stack.extend(getattr(value, field) for field in value.fields)
+        elif isinstance(value, tuple):
+            size += sys.getsizeof(value)
+            count += isinstance(value[0], str) if value else 0
+            stack.extend(value)
+        elif isinstance(value, list):
+            size += sys.getsizeof(value)
+            stack.extend(value)
+    return size, count
+
+
+def traced(parse, data):
+    gc.collect()
+    tracemalloc.start()
+    tree = parse(data)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return tree, retained, peak
+
+
+def main():
+    # Slotted nodes carry line numbers and expression types that the raw
+    # tuples never had, at about the tuples' size; it is the arena that
+    # cuts the memory of a tree.
+    argparser = argparse.ArgumentParser(
+        description="Memory held by the AST of a large synthetic program")
+    argparser.add_argument("--functions", type=int, default=20000)
+    args = argparser.parse_args()
+
+    data = program(args.functions)
+    tree = parser.parse(data)
+    node_size, node_count = deep_size(tree)
+    tuple_size, _ = deep_size(tree.astuple())
+    del tree
+
+    print(f"nodes:         {node_count}")
+    print(f"slotted nodes: {node_size / 2**20:8.2f} MiB, "
+          f"{node_size / node_count:6.1f} bytes/node")
+    print(f"raw tuples:    {tuple_size / 2**20:8.2f} MiB, "
+          f"{tuple_size / node_count:6.1f} bytes/node")
+    print(f"ratio:         {node_size / tuple_size:.2f}")
+    arena = parse_arena(data).arena
+    print(f"arena columns: {arena.nbytes() / 2**20:8.2f} MiB, "
+          f"{arena.nbytes() / node_count:6.1f} bytes/node")
+    del arena
+
+    print("retained and peak memory of a parse, strings included:")
+    for name, parse in (("node tree", parser.parse), ("arena", parse_arena)):
+        tree, retained, peak = traced(parse, data)
+        del tree
+        print(f"{name:<14} retained {retained / 2**20:8.2f} MiB, "
+              f"peak {peak / 2**20:8.2f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import time
+
+from Compiler.ir_generator import IRGenerator
+from Parser.nodes import Node
+from Parser.parser import parser
+from Semantic.analyzer import SemanticAnalyzer
+
+
+class GetattrAnalyzer(SemanticAnalyzer):
+    def analyze(self, node):
+        method_name = f"analyze_{node[0]}"
+        method = getattr(self, method_name, self.generic_analyze)
+        return method(node)
+
+
+class GetattrIRGenerator(IRGenerator):
+    def visit(self, node):
+        method_name = f"visit_{node[0]}"
+        method = getattr(self, method_name, self.generic_visit)
+        return method(node)
+
+
+def analyzer_program(size):
+    lines = []
+    for i in range(size):
+        lines += [
+            f"int a{i} = {i}",
+            f"when a{i} > 3:",
+            f" a{i} += {i} * 2 - 1",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def generator_program(size):
+    lines = []
+    for i in range(size):
+        lines += [
+            f"int f{i}(int a):",
+            " int c = a * 2 + 1",
+            " c += a - 3",
+            " when c > 10:",
+            "  c = c * a",
+            " return c",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def count(tree):
+    nodes = 0
+    stack = [tree]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, Node):
+            nodes += 1
+            stack.extend(value[1:])
+        elif isinstance(value, list):
+            stack.extend(value)
+    return nodes
+
+
+def rate(factory, run, tree, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        visitor = factory()
+        start = time.perf_counter()
+        run(visitor, tree)
+        best = min(best, time.perf_counter() - start)
+    return count(tree) / best
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description="Nodes/second of the analyzer and IR generator visitors")
+    argparser.add_argument("--size", type=int, default=5000)
+    argparser.add_argument("--repeat", type=int, default=5)
+    args = argparser.parse_args()
+
+    analyzer_tree = parser.parse(analyzer_program(args.size))
+    generator_tree = parser.parse(generator_program(args.size))
+
+    def analyze(visitor, tree):
+        visitor.analyze(tree)
+
+    def generate(visitor, tree):
+        visitor.visit(tree[1])
+
+    rows = (
+        ("SemanticAnalyzer", GetattrAnalyzer, SemanticAnalyzer, analyze, analyzer_tree),
+        ("IRGenerator", GetattrIRGenerator, IRGenerator, generate, generator_tree),
+    )
+    for name, before, after, run, tree in rows:
+        old = rate(before, run, tree, args.repeat)
+        new = rate(after, run, tree, args.repeat)
+        print(f"{name:<17} getattr: {old:>10,.0f} nodes/s   "
+              f"table: {new:>10,.0f} nodes/s   ({new / old:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import sys
+import time
+
+from Parser.parser import parser
+
+
+def program(statements):
+    lines = ["int main():"]
+    for i in range(statements):
+        lines.append(f" int a{i} = {i} + b * 2")
+    return "\n".join(lines) + "\n"
+
+
+def parse_time(statements):
+    data = program(statements)
+    start = time.perf_counter()
+    result = parser.parse(data)
+    elapsed = time.perf_counter() - start
+    assert len(result[1][0][5]) == statements
+    return elapsed
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description="Parse time of a function body with N statements")
+    argparser.add_argument("--sizes", default="10000,100000,1000000")
+    argparser.add_argument("--tolerance", type=float, default=2.0,
+                           help="allowed growth of the per-statement time")
+    args = argparser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    per_statement = []
+    for size in sizes:
+        elapsed = parse_time(size)
+        per_statement.append(elapsed / size)
+        print(f"{size:>9} statements: {elapsed:8.3f} s, "
+              f"{elapsed / size * 1e6:6.2f} us/statement")
+
+    growth = per_statement[-1] / per_statement[0]
+    print(f"per-statement growth from {sizes[0]} to {sizes[-1]}: {growth:.2f}x")
+    if growth > args.tolerance:
+        print("parse time does not scale linearly")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
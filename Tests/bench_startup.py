@@ -0,0 +1,44 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(cache):
+    env = dict(os.environ, O_CACHE_DIR=cache)
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", "import Parser.parser"],
+        cwd=ROOT, env=env, check=True, stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description="Cold vs. warm import time of Parser.parser")
+    argparser.add_argument("--runs", type=int, default=10)
+    args = argparser.parse_args()
+
+    cold = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as cache:
+            cold.append(import_time(cache))
+
+    with tempfile.TemporaryDirectory() as cache:
+        import_time(cache)
+        warm = [import_time(cache) for _ in range(args.runs)]
+
+    for label, times in (("cold", cold), ("warm", warm)):
+        print(f"{label}: median {statistics.median(times) * 1000:.1f} ms, "
+              f"min {min(times) * 1000:.1f} ms over {len(times)} runs")
+    print(f"speedup: {statistics.median(cold) / statistics.median(warm):.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import pytest
+from Parser.parser import parser
 from Semantic.analyzer import SemanticAnalyzer
 
 
@@ -19,7 +20,7 @@ def test_var_def(analyzer):
 def test_assignment(analyzer):
     var_node = ("var_def", "int", "x")
     analyzer.analyze(var_node)
-    assign_node = ("assignment", "x", ("integer", "42"))
+    assign_node = ("assignment", "=", "x", ("integer", "42"))
     analyzer.analyze(assign_node)
     symbol = analyzer.global_scope.resolve("x")
     assert symbol is not None
@@ -59,7 +60,7 @@ def test_fun_def(analyzer):
 
 def test_undefined_variable(analyzer):
     with pytest.raises(Exception) as excinfo:
-        node = ("assignment", "y", ("integer", 42))
+        node = ("assignment", "=", "y", ("integer", 42))
         analyzer.analyze(node)
     assert "Undefined variable 'y'" in str(excinfo.value)
 
@@ -67,9 +68,13 @@ def test_undefined_variable(analyzer):
 def test_class_def(analyzer):
     node = (
         "class_def",
+        [],
         "MyClass",
-        ("var_def", "int", "x"),
-        ("fun_def", [], "void", "method", [], [("pass",)]),
+        None,
+        [
+            ("var_def", "int", "x"),
+            ("fun_def", [], "void", "method", [], [("pass",)]),
+        ],
     )
     analyzer.analyze(node)
     symbol = analyzer.global_scope.resolve("MyClass")
@@ -102,3 +107,91 @@ def test_when_stmts_with_undefined_variable(analyzer):
     with pytest.raises(Exception) as excinfo:
         analyzer.analyze(node)
     assert "Undefined variable 'a'" in str(excinfo.value)
+
+
+def test_program_statements_are_analyzed(analyzer):
+    tree = parser.parse("int a = 0\na = b")
+    with pytest.raises(Exception) as excinfo:
+        analyzer.analyze(tree)
+    assert "Undefined variable 'b'" in str(excinfo.value)
+
+
+def test_locals_and_params_resolve(analyzer):
+    analyzer.analyze(parser.parse("int add(int a, int b):\n int c = a + b\n return c\n"))
+    assert analyzer.global_scope.resolve("a") is None
+
+
+def test_expressions_are_typed(analyzer):
+    tree = parser.parse("double f(int a):\n double b = a * 2 + 0.5\n return b\n")
+    analyzer.analyze(tree)
+    value = tree.body[0].body[0].value
+    assert value.type == "double"
+    assert value.left.type == "int"
+
+
+def test_type_mismatch(analyzer):
+    with pytest.raises(Exception) as excinfo:
+        analyzer.analyze(parser.parse('int a = "text"\n'))
+    assert "cannot assign str to int" in str(excinfo.value)
+
+
+def test_int_widens_to_double(analyzer):
+    analyzer.analyze(parser.parse("double a = 1\na += 2\n"))
+    with pytest.raises(Exception) as excinfo:
+        analyzer.analyze(parser.parse("int b = 1\nb = 2.5\n"))
+    assert "cannot assign double to int" in str(excinfo.value)
+
+
+def test_integer_powers_are_ints(analyzer):
+    tree = parser.parse("int x = 2 ** 3\ndouble y = 2 ** 0.5\n")
+    analyzer.analyze(tree)
+    assert [statement.value.type for statement in tree.body] == ["int", "double"]
+
+
+def test_call_arguments_are_checked(analyzer):
+    with pytest.raises(Exception) as excinfo:
+        analyzer.analyze(parser.parse("int f(int a):\n return a\nf(1, 2)\n"))
+    assert "takes 1 arguments, 2 given" in str(excinfo.value)
+
+
+def test_constructions_are_typed(analyzer):
+    tree = parser.parse("class P:\n int x = 0\n P(int a):\n  x = a\nP p = P(1)\nint n = p\n")
+    with pytest.raises(Exception) as excinfo:
+        analyzer.analyze(tree)
+    assert "cannot assign P to int" in str(excinfo.value)
+    with pytest.raises(Exception) as excinfo:
+        SemanticAnalyzer().analyze(parser.parse("class P:\n int x = 0\nP p = P(1)\n"))
+    assert "'P' takes 0 arguments, 1 given" in str(excinfo.value)
+
+
+def test_log_arguments_are_checked(analyzer):
+    with pytest.raises(Exception) as excinfo:
+        analyzer.analyze(parser.parse('int[] a = [1]\nlog("a is", a)\n'))
+    assert "cannot log int[]" in str(excinfo.value)
+
+
+def test_awaits_are_checked(analyzer):
+    source = "async int f(int n):\n await sleep(n)\n return n\n"
+    tree = parser.parse(source + "async double g():\n int r = await f(1)\n f(2)\n return r\n")
+    analyzer.analyze(tree)
+    body = tree[1][1][1][5]
+    assert body[0][3].type == "int" and body[1].type == "void"
+    for source, message in [
+        (source + "int g():\n return await f(1)\n", "'await' outside of an async function"),
+        (source + "int h():\n return 1\nasync void g():\n await h()\n", "Cannot await 'h'"),
+        (source + "async void g():\n int r = f(1)\n", "cannot assign void to int"),
+        ('async void g():\n await sleep("1")\n', "cannot pass str as int"),
+    ]:
+        with pytest.raises(Exception) as excinfo:
+            SemanticAnalyzer().analyze(parser.parse(source))
+        assert message in str(excinfo.value)
+
+
+def test_calls_must_resolve(analyzer):
+    with pytest.raises(Exception) as excinfo:
+        analyzer.analyze(parser.parse("int f(int a):\n return a\nint g():\n return fo(1)\n"))
+    assert "Undefined function 'fo'" in str(excinfo.value)
+    tree = parser.parse("int g():\n return twice(2.5)\n")
+    with pytest.raises(Exception) as excinfo:
+        SemanticAnalyzer([("twice", "int", ("int",))]).analyze(tree)
+    assert "cannot pass double as int" in str(excinfo.value)
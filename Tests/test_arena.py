@@ -0,0 +1,107 @@
+import io
+
+import pytest
+from Compiler.ir_generator import IRGenerator
+from Parser.arena import Arena, Cursor
+from Parser.parser import parse_arena, parser
+from Semantic.analyzer import SemanticAnalyzer
+
+SOURCE = """int add(int a, int b):
+ return a + b
+int main():
+ int x = 2
+ x += 3
+ when x > 4:
+  x = 1
+ otherwise:
+  x = 2
+ return x
+enum E { A, B }
+"""
+
+
+def test_parse_arena_matches_node_tree():
+    root = parse_arena(SOURCE)
+    assert isinstance(root, Cursor)
+    assert root.arena.root is root
+    assert root == parser.parse(SOURCE)
+
+
+def test_parse_arena_from_stream():
+    assert parse_arena(io.StringIO(SOURCE)) == parser.parse(SOURCE)
+
+
+def test_cursor_fields():
+    root = parse_arena(SOURCE)
+    add, main, enum = root.body
+    assert add.tag == "fun_def"
+    assert (add.rtype, add.name, add.params) == ("int", "add", [("int", "a"), ("int", "b")])
+    assert add.body[0].value.op == "+"
+    assert main.body[2].cases[1].tag == "otherwise"
+    assert enum.values == ["A", "B"]
+    assert main.lineno == 3
+    assert main.body[3].lineno == 10
+
+
+def test_cursor_tuple_view():
+    var_def = parse_arena("int a\n").body[0]
+    assert var_def == ("var_def", "int", "a")
+    _, type_name, name = var_def
+    assert (type_name, name) == ("int", "a")
+    assert var_def.value is None
+
+
+def test_strings_are_interned():
+    root = parse_arena("int a = b\nint c = b\n")
+    arena = root.arena
+    assert arena.strings.count("b") == 1
+    assert arena.strings.count("int") == 1
+
+
+def test_add_node_tree():
+    arena = Arena()
+    tree = parser.parse(SOURCE)
+    root = arena.add(tree)
+    assert root == tree
+    assert len(arena) == len(parse_arena(SOURCE).arena)
+    assert arena.nbytes() > 0
+
+
+def test_analyzer_walks_cursors():
+    root = parse_arena("int a = 0\na = b")
+    with pytest.raises(Exception) as excinfo:
+        SemanticAnalyzer().analyze(root)
+    assert "Undefined variable 'b'" in str(excinfo.value)
+
+
+def test_ir_generator_walks_cursors():
+    root = parse_arena(SOURCE)
+    tree = parser.parse(SOURCE)
+    SemanticAnalyzer().analyze(root)
+    SemanticAnalyzer().analyze(tree)
+    assert IRGenerator().generate(root.body[:2]) == IRGenerator().generate(tree.body[:2])
+
+
+def test_cursor_indexing_decodes_one_field(monkeypatch):
+    root = parse_arena("int a\nint b = 1\nwhen a:\n pass\notherwise:\n pass\n")
+    samples = root.body
+    views = [node.view() for node in samples]
+    with monkeypatch.context() as patch:
+        patch.setattr(Cursor, "view", lambda self: pytest.fail("view built"))
+        lengths = [len(node) for node in samples]
+        items = [[node[index] for index in range(-len(view), len(view))]
+                 for node, view in zip(samples, views)]
+        for node, view in zip(samples, views):
+            with pytest.raises(IndexError):
+                node[len(view)]
+    assert lengths == [len(view) for view in views]
+    assert items == [[view[index] for index in range(-len(view), len(view))] for view in views]
+
+
+def test_types_are_a_column():
+    root = parse_arena("int a = 1 + 2\n")
+    SemanticAnalyzer().analyze(root)
+    arena = root.arena
+    assert len(arena.types) == len(arena)
+    assert root.body[0].value.type == "int"
+    assert root.body[0].type is None
@@ -0,0 +1,52 @@
+import ctypes
+import shutil
+
+import pytest
+from Compiler.assembler import Assembler
+from Compiler.ir_generator import IRGenerator
+from Compiler.optimizer import Optimizer
+from Parser.parser import parser
+from Semantic.analyzer import SemanticAnalyzer
+
+
+@pytest.fixture
+def assembler():
+    return Assembler()
+
+
+def optimized(data):
+    tree = parser.parse(data)
+    SemanticAnalyzer().analyze(tree)
+    return Optimizer(2).optimize(IRGenerator().generate(tree.body))
+
+
+def test_emit_object(assembler):
+    data = assembler.emit_object(optimized("int add(int a, int b):\n return a + b\n"))
+    assert data.startswith(b"\x7fELF")
+
+
+def test_emit_assembly(assembler):
+    text = assembler.emit_assembly(optimized("int add(int a, int b):\n return a + b\n"))
+    assert "add:" in text
+
+
+def test_target_triple():
+    assembler = Assembler(triple="aarch64-unknown-linux-gnu", cpu="generic")
+    assert assembler.triple == "aarch64-unknown-linux-gnu"
+
+
+@pytest.mark.skipif(shutil.which("cc") is None, reason="no system linker")
+def test_build_shared(assembler, tmp_path):
+    modules = [
+        optimized("int add(int a, int b):\n return a + b\n"),
+        optimized("int scale(int a):\n return a * 3\n"),
+    ]
+    library = assembler.build_shared(modules, str(tmp_path / "libo.so"))
+    loaded = ctypes.CDLL(library)
+    assert loaded.add(40, 2) == 42
+    assert loaded.scale(14) == 42
+
+
+def test_link_failure(assembler, tmp_path):
+    with pytest.raises(Exception):
+        assembler.link_shared([str(tmp_path / "missing.o")], str(tmp_path / "libo.so"))
@@ -0,0 +1,120 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from Compiler import pipeline
+from Compiler.cache import CompilationCache, compiler_version
+from Compiler.pipeline import compile_source
+
+SOURCE = "int add(int a, int b):\n return a + b\n"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return CompilationCache(str(tmp_path / "build"))
+
+
+def test_key_depends_on_source_and_options(cache):
+    key = cache.key(SOURCE, level=2)
+    assert key == cache.key(SOURCE.encode(), level=2)
+    assert key != cache.key(SOURCE + "\n", level=2)
+    assert key != cache.key(SOURCE, level=3)
+    assert len(compiler_version()) == 64
+
+
+def test_put_and_get(cache):
+    key = cache.key(SOURCE)
+    assert cache.get(key, "ll") is None
+    cache.put(key, "ll", b"ir")
+    assert cache.get(key, "ll") == b"ir"
+    assert cache.get(key, "o") is None
+
+
+def test_lru_eviction(tmp_path):
+    cache = CompilationCache(str(tmp_path / "build"), max_size=4000)
+    keys = [cache.key(str(i)) for i in range(3)]
+    for age, key in enumerate(keys):
+        path = cache.put(key, "ll", b"x" * 1000)
+        os.utime(path, (age, age))
+    cache.get(keys[0], "ll")
+    cache.put(cache.key("3"), "ll", b"x" * 1000)
+    cache.put(cache.key("4"), "ll", b"x" * 1000)
+    assert cache.get(keys[0], "ll") is not None
+    assert cache.get(keys[1], "ll") is None
+    assert cache.size() <= 4000
+
+
+def counter(cache):
+    with open(os.path.join(cache.directory, "size")) as file:
+        return int(file.read())
+
+
+def test_size_counter(tmp_path):
+    cache = CompilationCache(str(tmp_path / "build"), max_size=4000)
+    key = cache.key(SOURCE)
+    cache.put(key, "ll", b"x" * 1000)
+    cache.put(key, "ll", b"x" * 600)
+    assert counter(cache) == cache.size() == 600
+    os.utime(cache.path(key, "ll"), (0, 0))
+    for i in range(3):
+        cache.put(cache.key(str(i)), "ll", b"x" * 1000)
+    assert counter(cache) == cache.size() == 3600
+    assert cache.evict() == 1
+    assert counter(cache) == cache.size() == 3000
+    assert cache.get(key, "ll") is None
+    cache.clear()
+    assert counter(cache) == cache.size() == 0
+
+
+def test_directory_writable_by_others_is_refused(tmp_path):
+    directory = tmp_path / "build"
+    directory.mkdir(mode=0o777)
+    directory.chmod(0o777)
+    with pytest.raises(Exception) as excinfo:
+        CompilationCache(str(directory))
+    assert "writable by other users" in str(excinfo.value)
+
+
+def test_compile_source_hits_cache(cache, monkeypatch):
+    first = compile_source(SOURCE, cache=cache, emit_object=True)
+    assert "add i32" in first.ir
+    assert first.object.startswith(b"\x7fELF")
+
+    def fail(data):
+        raise AssertionError("source was parsed again")
+    monkeypatch.setattr(pipeline.parser, "parse", fail)
+    second = compile_source(SOURCE, cache=cache, emit_object=True)
+    assert second.ir == first.ir
+    assert second.object == first.object
+    assert second.ast == first.ast
+
+
+def test_compile_source_without_cache():
+    build = compile_source(SOURCE, level=0)
+    assert "alloca i32" in build.ir
+    assert build.object is None
+
+
+def write_entries(directory, worker):
+    cache = CompilationCache(directory, max_size=20000)
+    for i in range(50):
+        key = cache.key(f"{worker}:{i}")
+        cache.put(key, "ll", bytes([worker]) * 1000)
+        data = cache.get(key, "ll")
+        assert data is None or data == bytes([worker]) * 1000
+    return True
+
+
+def test_concurrent_writers(tmp_path):
+    directory = str(tmp_path / "build")
+    with ProcessPoolExecutor(4) as executor:
+        assert all(executor.map(write_entries, [directory] * 4, range(4)))
+    cache = CompilationCache(directory, max_size=20000)
+    assert cache.size() <= 20000 + 4 * 1000
+    assert not [name for _, _, names in os.walk(directory) for name in names if name.endswith(".tmp")]
+
+
+def test_syntax_errors_fail_the_build(cache):
+    with pytest.raises(SyntaxError) as excinfo:
+        compile_source("int main():\n int = 2\n return 1\n", cache=cache)
+    assert excinfo.value.lineno == 2
@@ -0,0 +1,147 @@
+import ctypes
+import gc
+
+import pytest
+from Compiler.codegen import JIT
+from Compiler.ir_generator import IRGenerator
+from Parser.parser import parser
+from Semantic import folder
+from Semantic.analyzer import SemanticAnalyzer
+
+
+@pytest.fixture
+def jit():
+    return JIT()
+
+
+def analyzed(data):
+    tree = parser.parse(data)
+    SemanticAnalyzer().analyze(tree)
+    return tree.body
+
+
+def module(data):
+    generator = IRGenerator()
+    generator.generate(analyzed(data))
+    return generator.module
+
+
+def test_run_main(jit):
+    data = (
+        "int main():\n"
+        " int x = 2\n"
+        " x += 3\n"
+        " when x > 4:\n"
+        "  x = 1\n"
+        " return x\n"
+    )
+    assert jit.run(module(data)) == 1
+
+
+def test_function_with_args(jit):
+    compiled = jit.compile(module("int add(int a, int b):\n return a * b - 1\n"))
+    assert compiled["add"](6, 7) == 41
+    assert compiled["add"].argtypes == (ctypes.c_int32, ctypes.c_int32)
+
+
+def test_run_ir_text(jit):
+    ir_text = IRGenerator().generate(analyzed("int twice(int x):\n return x * 2\n"))
+    assert jit.run(ir_text, 21, entry="twice") == 42
+
+
+def test_compiled_modules_are_cached(jit):
+    first = jit.compile(module("int main():\n return 7\n"))
+    second = jit.compile(module("int main():\n return 7\n"))
+    assert first is second
+    assert jit.function(first.module, "main") is jit.function(second.module, "main")
+
+
+def test_entry_points_keep_their_module_alive():
+    function = JIT().function(module("int main():\n return 5\n"))
+    gc.collect()
+    assert function() == 5
+    compiled = JIT(2).compile(module("int f(int x):\n return x + 1\n"))["f"]
+    gc.collect()
+    assert compiled(1) == 2
+
+
+def test_compiled_modules_are_bounded():
+    jit = JIT(capacity=2)
+    first = jit.function(module("int main():\n return 1\n"))
+    jit.run(module("int main():\n return 2\n"))
+    jit.run(module("int main():\n return 1\n"))
+    jit.run(module("int main():\n return 3\n"))
+    assert len(jit.modules) == 2
+    assert first.owner in jit.modules.values()
+    jit.run(module("int main():\n return 4\n"))
+    assert first.owner not in jit.modules.values()
+    gc.collect()
+    assert first() == 1
+
+
+def test_modules_do_not_share_symbols(jit):
+    assert jit.run(module("int main():\n return 1\n")) == 1
+    assert jit.run(module("int main():\n return 2\n")) == 2
+
+
+def test_unoptimized(jit):
+    assert JIT(level=0).run(module("int main():\n int a = 20\n a *= 2\n return a + 2\n")) == 42
+
+
+def test_typed_arithmetic(jit):
+    tree = parser.parse("double half(int a):\n double b = a / 2\n return b + 0.25\n")
+    SemanticAnalyzer().analyze(tree)
+    generator = IRGenerator()
+    ir_text = generator.generate(tree.body)
+    assert "sdiv" in ir_text and "sitofp" in ir_text and "fadd" in ir_text
+    assert jit.run(ir_text, 7, entry="half") == 3.25
+
+
+def test_integer_powers(jit):
+    compiled = jit.compile(module("int p(int a, int b):\n return a ** b\n"))
+    for a, b in [(2, 10), (3, 21), (-3, 3), (5, 0), (0, 0), (2, -1), (1, -5), (-1, -3), (-1, 4)]:
+        assert compiled["p"](a, b) == folder.evaluate("**", a, b)
+    assert folder.evaluate("**", 2, 10) == 1024
+
+
+def test_unanalyzed_trees_are_rejected():
+    with pytest.raises(Exception) as excinfo:
+        IRGenerator().generate(parser.parse("int f(int a):\n return a + 1\n").body)
+    assert "not analyzed" in str(excinfo.value)
+
+
+def test_short_circuit(jit):
+    tree = parser.parse("int f(int n):\n when (n != 0) && (10 / n > 1):\n  return 1\n"
+                        " return ((n > 3) || (n < 0)) ? 7 ! 8\n")
+    SemanticAnalyzer().analyze(tree)
+    compiled = jit.compile(IRGenerator().generate(tree.body))
+    assert [compiled["f"](n) for n in (0, 2, 20, -1)] == [8, 1, 7, 7]
+
+
+def test_range_loops(jit):
+    source = ("int f(int n):\n int total = 0\n for int i in [0 ... n]:\n  when i == 7:\n   escape\n"
+              "  when i % 2 == 0:\n   skip\n  total += i\n return total\n")
+    compiled = jit.compile(module(source))
+    assert [compiled["f"](n) for n in (0, 5, 100)] == [0, 4, 9]
+
+
+def test_comprehension_is_fused(jit):
+    source = ("int f(int n):\n int total = 0\n"
+              " for int x in [i * i for int i in [0 ... n] when i % 3 == 0]:\n  total += x\n"
+              " return total\n")
+    ir_text = IRGenerator().generate(analyzed(source))
+    assert ir_text.count("\nloop:") == 1
+    assert jit.run(ir_text, 10, entry="f") == 0 + 9 + 36 + 81
+
+
+def test_nested_loops(jit):
+    source = ("int f(int n):\n int total = 0\n for int r in [0 ... 3]:\n  for int i in [0 ... n]:\n"
+              "   total += r\n return total\n")
+    assert jit.run(module(source), 5, entry="f") == (0 + 1 + 2) * 5
+
+
+def test_classes_are_defined_per_module(jit):
+    source = "class P:\n int x = 0\n P(int a):\n  x = a\n int get():\n  return x\n"
+    first, second = module(source), module(source)
+    assert '%"P" = type {i32}' in str(first) and '%"P" = type {i32}' in str(second)
+    assert jit.compile(second)["P_get"] is not None
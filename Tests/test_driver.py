@@ -0,0 +1,106 @@
+import os
+
+import pytest
+from Compiler.codegen import JIT
+from Compiler.driver import Driver, dependency_graph, includes, main
+
+
+@pytest.fixture
+def project(tmp_path):
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "lib" / "math.ol").write_text(
+        "int add(int a, int b):\n"
+        " return a + b\n"
+        "int twice(int a):\n"
+        " return a * 2\n"
+    )
+    (tmp_path / "util.ol").write_text(
+        'include "lib"."math"\n'
+        "int scale(int a):\n"
+        " twice(a)\n"
+        " return a * 3\n"
+    )
+    (tmp_path / "main.ol").write_text(
+        'include "lib"."math"\n'
+        'include "util"\n'
+        "int main():\n"
+        " add(1, 2)\n"
+        " return 42\n"
+    )
+    return tmp_path
+
+
+def test_includes():
+    assert includes('include "a"."b"\nint x = 1\n include "c"\n') == [["a", "b"], ["c"]]
+
+
+def test_dependency_graph(project):
+    graph = dependency_graph([str(project / "main.ol")])
+    math = str(project / "lib" / "math.ol")
+    util = str(project / "util.ol")
+    assert graph[str(project / "main.ol")] == [math, util]
+    assert graph[util] == [math]
+    assert graph[math] == []
+
+
+def test_missing_include(tmp_path):
+    (tmp_path / "main.ol").write_text('include "nowhere"\n')
+    with pytest.raises(Exception) as excinfo:
+        dependency_graph([str(tmp_path / "main.ol")])
+    assert "Cannot find module 'nowhere'" in str(excinfo.value)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_compile_and_link(project, jobs):
+    module = Driver(level=1, jobs=jobs).compile([str(project / "main.ol")])
+    names = {function.name for function in module.functions if not function.is_declaration}
+    assert names == {"add", "twice", "scale", "main"}
+    compiled = JIT().compile(str(module))
+    assert compiled() == 42
+    assert compiled["scale"](5) == 15
+
+
+def test_cached_build(project, tmp_path):
+    cache = str(tmp_path / "cache")
+    first = Driver(jobs=1, cache_directory=cache).compile([str(project / "main.ol")])
+    second = Driver(jobs=1, cache_directory=cache).compile([str(project / "main.ol")])
+    assert str(first) == str(second)
+
+
+def test_syntax_error(tmp_path, capsys):
+    (tmp_path / "main.ol").write_text("int = 1\n")
+    with pytest.raises(Exception) as excinfo:
+        Driver(jobs=1).compile([str(tmp_path / "main.ol")])
+    assert "syntax error at line 1" in str(excinfo.value)
+
+
+def test_cli(project):
+    output = str(project / "main.ll")
+    assert main([str(project / "main.ol"), "-O1", "-j", "1", "-o", output]) == 0
+    with open(output) as file:
+        assert 'define' in file.read()
+    assert os.path.exists(output)
+
+
+def test_calls_are_checked_against_includes(project, tmp_path):
+    cache = str(tmp_path / "cache")
+    Driver(jobs=1, cache_directory=cache).compile([str(project / "main.ol")])
+    (project / "lib" / "math.ol").write_text("int add(int a, int b):\n return a + b\n")
+    # util.ol is unchanged, but what it includes no longer exports twice.
+    with pytest.raises(Exception) as excinfo:
+        Driver(jobs=1, cache_directory=cache).compile([str(project / "main.ol")])
+    assert str(excinfo.value) == f"{project / 'util.ol'}: Undefined function 'twice'"
+    (project / "util.ol").write_text("int scale(int a):\n return add(a, a)\n")
+    with pytest.raises(Exception) as excinfo:
+        Driver(jobs=1).compile([str(project / "util.ol")])
+    assert "Undefined function 'add'" in str(excinfo.value)
+
+
+def test_private_functions_do_not_clash(tmp_path):
+    for name in ("a", "b"):
+        (tmp_path / f"{name}.ol").write_text(
+            f"int[] pair(int x):\n return [x, x]\n"
+            f"int {name}(int x):\n int[] p = pair(x)\n return p[0] + p[1]\n")
+    (tmp_path / "main.ol").write_text('include "a"\ninclude "b"\nint main():\n return a(1) + b(2)\n')
+    module = Driver(level=0, jobs=1).compile([str(tmp_path / "main.ol")])
+    assert JIT().compile(str(module))() == 6
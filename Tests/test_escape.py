@@ -0,0 +1,108 @@
+from Compiler.codegen import JIT
+from Compiler.ir_generator import IRGenerator
+from Parser.parser import parse_arena, parser
+from Semantic.analyzer import SemanticAnalyzer
+from Semantic.escape import EscapeAnalyzer
+
+CLASS = ("class Point:\n int x = 0\n int y = 0\n Point(int a, int b):\n  x = a\n  y = b\n"
+         " int sum():\n  return x + y\n")
+
+
+def sites(tree, name):
+    # Constructions of the function named name, in source order.
+    found = []
+    stack = [next(node for node in tree[1] if node[0] == "fun_def" and node[3] == name)]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+        elif isinstance(node, tuple) or hasattr(node, "view"):
+            if node and node[0] == "fun_call" and node[1] == "Point":
+                found.append(node)
+            stack.extend(reversed([value for value in node[1:] if not isinstance(value, str)]))
+    return found
+
+
+def stack_allocated(source, name):
+    tree = parser.parse(CLASS + source)
+    stack = EscapeAnalyzer().analyze(tree)
+    return [id(site) in stack for site in sites(tree, name)]
+
+
+def test_local_instances_stay_on_the_stack():
+    assert stack_allocated("int f():\n Point p = Point(1, 2)\n Point q = Point(3, 4)\n"
+                           " return p == q ? 1 ! 0\n", "f") == [True, True]
+
+
+def test_returned_and_stored_instances_escape():
+    assert stack_allocated("Point f():\n Point p = Point(1, 2)\n return p\n", "f") == [False]
+    assert stack_allocated("str:Point f():\n str:Point m = {}\n Point p = Point(1, 2)\n"
+                           ' put(m, "p", p)\n return m\n', "f") == [False]
+    assert stack_allocated("int f():\n Point p = Point(1, 2)\n Point q = p\n return 0\n",
+                           "f") == [False]
+
+
+def test_parameters_are_summarized():
+    source = ("bool same(Point a, Point b):\n return a == b\n"
+              "Point first(Point a, Point b):\n return a\n"
+              "int f():\n Point p = Point(1, 2)\n same(p, Point(3, 4))\n"
+              " Point q = Point(5, 6)\n first(Point(7, 8), q)\n return 0\n")
+    assert stack_allocated(source, "f") == [True, True, True, False]
+
+
+def test_arguments_of_async_functions_escape():
+    source = "async void g(Point a):\n await sleep(1)\nint f():\n g(Point(1, 2))\n return 0\n"
+    assert stack_allocated(source, "f") == [False]
+
+
+def test_summaries_reach_a_fixed_point():
+    # g is called before it is analyzed and only escapes through h.
+    source = ("int f():\n Point p = Point(1, 2)\n g(p)\n return 0\n"
+              "void g(Point a):\n h(a)\nPoint h(Point b):\n return b\n")
+    assert stack_allocated(source, "f") == [False]
+
+
+def test_instances_are_constructed():
+    source = ("int f(int n):\n int total = 0\n for int i in [0 ... n]:\n  Point p = Point(i, 1)\n"
+              "  Point q = Point(i, 1)\n  when p != q:\n   total += 1\n return total\n")
+    tree = parser.parse(CLASS + source)
+    SemanticAnalyzer().analyze(tree)
+    ir_text = IRGenerator().generate(tree)
+    assert 'call void @"Point_init"(%"Point"* %"point"' in ir_text
+    body = ir_text[ir_text.index('define i32 @"f"'):]
+    assert "o_alloc" not in body
+    assert JIT().run(ir_text, 4, entry="f") == 4
+    assert 'define %"Point"* @"Point_ctor"(i32 %".1", i32 %".2")' in ir_text
+
+
+def owned(source):
+    tree = parser.parse(source)
+    analyzer = EscapeAnalyzer()
+    analyzer.analyze(tree)
+    body = tree[1][0][5]
+    return [statement[2] for statement in body
+            if statement[0] == "var_def" and id(statement) in analyzer.owned]
+
+
+def test_local_arrays_are_owned():
+    assert owned("int f(int[] p):\n int[] a = [1, 2]\n int[] b = [0 ... 3]\n push(b, a[0])\n"
+                 " int[] c = a\n int[] d = [1]\n d = p\n int[] e = [2]\n return e[0] + b[3]\n") \
+        == ["b", "e"]
+    assert owned("int[] f():\n int[] a = [1]\n a = [2]\n return a\n") == []
+    assert owned("int[] f():\n int[] a = [1]\n a = [2]\n return [3]\n") == ["a"]
+
+
+def test_arena_programs_are_analyzed_alike():
+    source = CLASS + ("int f(int n):\n int total = 0\n for int i in [0 ... n]:\n  Point p = Point(i, 1)\n"
+                      "  Point q = Point(i, 2)\n  int[] row = [i, i]\n  when p != q:\n   total += row[0]\n"
+                      " return total\n"
+                      "Point g():\n return Point(1, 2)\n")
+    texts = []
+    for tree in (parser.parse(source), parse_arena(source)):
+        SemanticAnalyzer().analyze(tree)
+        texts.append(IRGenerator().generate(tree.body))
+    assert texts[0] == texts[1]
+    body = texts[1][texts[1].index('define i32 @"f"'):]
+    assert 'alloca %"Point"' in body and "o_array_free" in body
+    g = texts[1][texts[1].index('define %"Point"* @"g"'):]
+    assert 'alloca %"Point"' not in g[:g.index("\n}")]
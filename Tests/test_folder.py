@@ -0,0 +1,117 @@
+import pytest
+from Compiler.codegen import JIT
+from Compiler.ir_generator import IRGenerator
+from Parser.nodes import astuple
+from Parser.parser import parser
+from Semantic.analyzer import SemanticAnalyzer
+from Semantic.folder import ConstantFolder
+
+
+@pytest.fixture
+def folder():
+    return ConstantFolder()
+
+
+def fold(source):
+    tree = parser.parse(source)
+    SemanticAnalyzer().analyze(tree)
+    return astuple(ConstantFolder().fold(tree))
+
+
+def test_arithmetic(folder):
+    node = ("binop", "+", ("integer", "2"), ("binop", "*", ("integer", "3"), ("integer", "4")))
+    assert folder.fold(node) == ("integer", "14")
+
+
+def test_integer_semantics(folder):
+    assert folder.fold(("binop", "/", ("integer", "7"), ("integer", "2"))) == ("integer", "3")
+    assert folder.fold(("binop", "*", ("integer", "65536"), ("integer", "65536"))) == ("integer", "0")
+    node = ("binop", "/", ("integer", "1"), ("integer", "0"))
+    assert folder.fold(node) is node
+    assert folder.fold(("binop", "**", ("integer", "3"), ("integer", "21"))) == ("integer", str(3 ** 21 - 2 ** 33))
+    assert folder.fold(("binop", "**", ("integer", "-1"), ("integer", "-3"))) == ("integer", "-1")
+    assert folder.fold(("binop", "**", ("integer", "2"), ("integer", "-1"))) == ("integer", "0")
+
+
+def test_comparisons_and_logic(folder):
+    node = ("logical_and", ("comparison", "<", ("integer", "1"), ("double", "2.5")),
+            ("boolean", "False"))
+    assert folder.fold(node) == ("boolean", "False")
+    node = ("inline_condition", ("boolean", "True"), ("integer", "1"), ("integer", "2"))
+    assert folder.fold(node) == ("integer", "1")
+
+
+def test_calls_are_kept(folder):
+    node = ("logical_or", ("fun_call", "f", []), ("boolean", "True"))
+    assert folder.fold(node) is node
+    node = ("logical_or", ("boolean", "True"), ("fun_call", "f", []))
+    assert folder.fold(node) == ("boolean", "True")
+
+
+def test_widening_follows_annotation():
+    tree = fold("double f():\n return True ? 1 ! 2.5\n")
+    assert tree[1][0][5] == [("return", ("double", "1.0"))]
+
+
+def test_propagation():
+    body = fold("int f(int x):\n int a = 6\n int b = a * 7\n int c = 0\n c += b\n"
+                " return x + c\n")[1][0][5]
+    assert body[1] == ("var_def", "int", "b", ("integer", "42"))
+    assert body[3] == ("assignment", "+=", "c", ("integer", "42"))
+    assert body[4] == ("return", ("binop", "+", ("identifier", "x"), ("identifier", "c")))
+
+
+def test_parameters_shadow_constants():
+    tree = fold("int x = 1\nint f(int x):\n return x\n")
+    assert tree[1][1][5] == [("return", ("identifier", "x"))]
+
+
+def test_template_strings():
+    body = fold('int f(int n):\n int a = 1\n str s = t"{a} of {n}"\n'
+                ' str t = t"{a}"\n return n\n')[1][0][5]
+    assert body[1] == ("var_def", "str", "s", ("template_string", "1 of {n}"))
+    assert body[2] == ("var_def", "str", "t", ("string", "1"))
+
+
+def test_dead_branches():
+    source = ("int f(int n):\n when 1 > 2:\n  n = 1\n when n > 0:\n  n = 2\n"
+              " when 2 > 1:\n  n = 3\n otherwise:\n  n = 4\n return n\n")
+    cases = fold(source)[1][0][5][0][1:]
+    assert cases == (("when", ("comparison", ">", ("identifier", "n"), ("integer", "0")),
+                      [("assignment", "=", "n", ("integer", "2"))]),
+                     ("otherwise", [("assignment", "=", "n", ("integer", "3"))]))
+    body = fold("int f(int n):\n when False:\n  n = 1\n otherwise:\n  n = 4\n return n\n")[1][0][5]
+    assert body == [("assignment", "=", "n", ("integer", "4")), ("return", ("identifier", "n"))]
+
+
+def test_folded_programs_compute_the_same():
+    source = ("int f(int n):\n int a = 17 % 5 - 9 / 2\n double d = a ** 2\n"
+              " when d > 3.5 && n > 0:\n  n += a * 1000\n when a == 0:\n  n = 0\n"
+              " otherwise:\n  n += 1\n return n + (a < 0 ? 100 ! 200)\n")
+    tree = parser.parse(source)
+    SemanticAnalyzer().analyze(tree)
+    plain = IRGenerator().generate(tree)
+    folded = IRGenerator().generate(ConstantFolder().fold(tree))
+    assert len(folded) < len(plain)
+    jit = JIT(level=0)
+    for n in (-3, 0, 5):
+        assert jit.run(plain, n, entry="f") == jit.run(folded, n, entry="f")
+
+
+def test_statements_after_an_inlined_return_are_dropped():
+    body = fold("int main():\n when 1 < 2:\n  return 3\n return 4\n")[1][0][5]
+    assert body == [("return", ("integer", "3"))]
+    body = fold("int main():\n int a = 1\n when a < 2:\n  return 3\n return 4\n")[1][0][5]
+    assert body == [("var_def", "int", "a", ("integer", "1")), ("return", ("integer", "3"))]
+    jit = JIT(level=0)
+    for source in ("int main():\n when 1 < 2:\n  return 3\n return 4\n",
+                   "int main():\n int a = 1\n when a < 2:\n  return 3\n return 4\n"):
+        tree = parser.parse(source)
+        SemanticAnalyzer().analyze(tree)
+        assert jit.run(IRGenerator().generate(ConstantFolder().fold(tree).body)) == 3
+
+
+def test_bodies_that_declare_stay_blocks():
+    body = fold("int f(int n):\n when True:\n  int b = 3\n  n = b\n return n\n")[1][0][5]
+    assert body[0] == ("when_stmts", ("otherwise", [("var_def", "int", "b", ("integer", "3")),
+                                                     ("assignment", "=", "n", ("integer", "3"))]))
@@ -0,0 +1,90 @@
+import pytest
+from Parser.incremental import Document, segment
+from Parser.parser import parser
+
+SOURCE = (
+    "int a = 1\n"
+    "int f(int x):\n"
+    " int y = x * 2\n"
+    "\n"
+    " return y\n"
+    "when a > 1:\n"
+    " a = 2\n"
+    "when a > 3:\n"
+    " a = 4\n"
+    "otherwise:\n"
+    " a = 5\n"
+    "@dec\n"
+    "int g():\n"
+    " return 1\n"
+)
+
+
+@pytest.fixture
+def document():
+    return Document(SOURCE)
+
+
+def linenos(tree):
+    result = []
+    stack = [tree]
+    while stack:
+        value = stack.pop()
+        if hasattr(value, "lineno") and hasattr(value, "fields"):
+            result.append((value.tag, value.lineno))
+            stack.extend(getattr(value, field) for field in value.fields)
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return result
+
+
+def test_segments_top_level_statements():
+    starts = [lineno for _, _, lineno in segment(SOURCE)]
+    assert starts == [1, 2, 6, 12]
+
+
+def test_initial_parse_matches_parser(document):
+    assert document.tree == parser.parse(SOURCE)
+    assert linenos(document.tree) == linenos(parser.parse(SOURCE))
+
+
+def test_edit_reparses_one_statement(document):
+    untouched = document.chunks[-1].statements[0]
+    start = SOURCE.index("x * 2") + 4
+    tree = document.edit(start, start + 1, "3")
+    assert document.reparsed == 1
+    assert tree == parser.parse(document.text)
+    assert document.tree.body[-1] is untouched
+
+
+def test_inserted_lines_shift_later_statements(document):
+    untouched = document.chunks[-1].statements[0]
+    tree = document.edit(0, 0, "int b = 2\n\n")
+    expected = parser.parse(document.text)
+    assert tree == expected
+    assert linenos(tree) == linenos(expected)
+    assert document.tree.body[-1] is untouched
+    assert untouched.lineno == 15
+
+
+def test_when_chain_continues_across_edit(document):
+    start = SOURCE.index("when a > 3")
+    tree = document.edit(start, start, "when a > 2:\n a = 3\n")
+    assert document.reparsed == 1
+    assert tree == parser.parse(document.text)
+    assert len(tree.body[2].cases) == 4
+
+
+def test_syntax_error_is_local(document, capsys):
+    start = SOURCE.index("when a > 1")
+    document.edit(start, start + 4, "wen")
+    assert document.errors == [6]
+    assert [node.tag for node in document.tree.body] == ["var_def", "fun_def", "when_stmts", "fun_def"]
+    assert len(document.tree.body[2].cases) == 2
+    document.edit(start, start + 3, "when")
+    assert document.errors == []
+    assert document.tree == parser.parse(SOURCE)
+
+
+def test_offset(document):
+    assert document.offset(2, 4) == SOURCE.index("f(int")
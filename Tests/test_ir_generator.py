@@ -1,38 +1,56 @@
-import pytest
+import re
+
+from Compiler.codegen import JIT
 from Compiler.ir_generator import IRGenerator
 from llvmlite import ir
+from Parser.nodes import NODES, Program
+from Semantic.analyzer import SemanticAnalyzer
+
+
+def build(value):
+    # Turns tuples into nodes so the analyzer can annotate them; tuples
+    # that do not start with a tag, such as parameters, stay tuples.
+    if isinstance(value, list):
+        return [build(item) for item in value]
+    if isinstance(value, tuple) and value and value[0] in NODES:
+        return NODES[value[0]](*map(build, value[1:]))
+    return value
 
 
-@pytest.fixture
-def generator():
-    return IRGenerator()
+def generate(ast):
+    tree = Program(build(ast))
+    SemanticAnalyzer().analyze(tree)
+    return IRGenerator().generate(tree.body)
 
 
-def test_var_def(generator):
+def test_var_def():
     ast = [
         ('fun_def', [], 'int', 'main', [], [
             ('var_def', 'str', 'a', ('string', 'hello'))
         ])
     ]
-    results = generator.generate(ast)
+    results = generate(ast)
     assert '%"a" = alloca i8*' in results
-    assert 'store i8* hello, i8** %"a"' in results
+    assert ('store i8* getelementptr ({i64, [6 x i8]}, {i64, [6 x i8]}* @".str.0", i32 0, i32 1, i32 0), '
+            'i8** %"a"') in results
+    assert '@".str.0" = private unnamed_addr constant {i64, [6 x i8]} {i64 5, [6 x i8] c"hello\\00"}' \
+        in results
 
 
-def test_assignment(generator):
+def test_assignment():
     ast = [
         ('fun_def', [], 'int', 'main', [], [
             ('var_def', 'int', 'a', ('integer', '2')),
             ("assignment", "+=", "a", ("integer", "4"))
         ])
     ]
-    results = generator.generate(ast)
+    results = generate(ast)
     assert '%"a" = alloca i32' in results
     assert 'store i32 2, i32* %"a"' in results
     assert '%"a_add" = add i32 %"a.1", 4' in results
 
 
-def test_comparison_equal(generator):
+def test_comparison_equal():
     ast = [
         ('fun_def', [], 'int', 'main', [], [
             ('var_def', 'int', 'a', ('integer', '1')),
@@ -47,11 +65,11 @@ def test_comparison_equal(generator):
             ])
         ])
     ]
-    results = generator.generate(ast)
+    results = generate(ast)
     assert '%".4" = icmp eq i32 %"a.1", %"b.1"' in results
 
 
-def test_fun_call(generator):
+def test_fun_call():
     ast = [
         ('fun_def', [], 'int', 'main', [], [
             ('fun_def', [], 'int', 'foo', [], [
@@ -60,13 +78,13 @@ def test_fun_call(generator):
             ('fun_call', 'foo', [])
         ])
     ]
-    results = generator.generate(ast)
+    results = generate(ast)
     assert 'define i32 @"foo"()' in results
     assert 'ret i32 42' in results
     assert '%"foo_call" = call i32 @"foo"()' in results
 
 
-def test_fun_call_with_args(generator):
+def test_fun_call_with_args():
     ast = [
         ('fun_def', [], 'int', 'main', [], [
             ('fun_def', [], 'int', 'add', [('int', 'a'), ('int', 'b')], [
@@ -74,12 +92,12 @@ def test_fun_call_with_args(generator):
             ]),
         ])
     ]
-    results = generator.generate(ast)
+    results = generate(ast)
     assert 'define i32 @"add"(i32 %".1", i32 %".2")' in results
-    assert '%".8" = add i32 %"a", %"b"' in results
+    assert '%".6" = add i32 %"a.1", %"b.1"' in results
 
 
-def test_class_def(generator):
+def test_class_def():
     ast = [
         ('class_def', [], 'MyClass', None, [
             ('var_def', 'int', 'x', ('integer', '0')),
@@ -96,14 +114,14 @@ def test_class_def(generator):
             ])
         ])
     ]
-    results = generator.generate(ast)
+    results = generate(ast)
     assert '%"MyClass" = type {i32, double}' in results
     assert 'define %"MyClass"* @"MyClass_ctor"(i32 %".1", double %".2")' in results
     assert 'define i32 @"MyClass_get_x"(%"MyClass"* %".1")' in results
     assert 'define double @"MyClass_get_y"(%"MyClass"* %".1")' in results
 
 
-def test_when_stmts(generator):
+def test_when_stmts():
     ast = [
         ('fun_def', [], 'int', 'main', [], [
             ('when_stmts', [
@@ -116,11 +134,11 @@ def test_when_stmts(generator):
             ])
         ])
     ]
-    results = generator.generate(ast)
+    results = generate(ast)
     assert '%".2" = icmp eq i32 1, 1' in results
 
 
-def test_for_stmt(generator):
+def test_for_stmt():
     ast = [
         ('fun_def', [], 'int', 'main', [], [
             ('for_stmt', ('int', 'i'), ('array_literal', [('integer', '2'), ('integer', '3')]), [
@@ -128,15 +146,29 @@ def test_for_stmt(generator):
             ])
         ])
     ]
-    results = generator.generate(ast)
+    results = generate(ast)
     assert '%"index" = alloca i32' in results
-    assert 'br label %"loop"' in results
+    # One branch enters the loop and one repeats it.
+    assert len(re.findall(r'br i1 %"[^"]+", label %"loop", label %"after_loop"', results)) == 2
     assert 'loop:' in results
     assert '%"next_index" = add i32 %"index.1", 1' in results
-    assert 'br i1 %".10", label %"loop", label %"after_loop"' in results
 
 
-def test_switch_stmt(generator):
+def test_range_is_a_counted_loop():
+    ast = [
+        ('fun_def', [], 'int', 'main', [], [
+            ('for_stmt', ('int', 'i'), ('array_range', ('integer', '0'), ('integer', '10000000')), [
+                ('pass',)
+            ])
+        ])
+    ]
+    results = generate(ast)
+    assert '[' not in results.split('define')[1]
+    assert '%"next_index" = add i32 %"index.1", 1' in results
+    assert 'icmp slt i32 %"next_index", 10000000' in results
+
+
+def test_switch_stmt():
     ast = [
         ('fun_def', [], 'int', 'main', [], [
             ('var_def', 'int', 'a', ('integer', '1')),
@@ -150,5 +182,63 @@ def test_switch_stmt(generator):
             )
         ])
     ]
-    results = generator.generate(ast)
-    assert 'switch i32 %"a.1", label %"switch_default" [i32 4, label %"case_4" i32 1, label %"case_1"]' in results
\ No newline at end of file
+    results = generate(ast)
+    # Two cases are compared in order of their values, and a value no
+    # case matches goes on after the switch.
+    assert 'switch i32' not in results
+    assert re.findall(r'icmp eq i32 %"[^"]+", (\d+)', results) == ['1', '4']
+    assert re.findall(r'label %"(case_\d+)", label %"(switch_\w+)"', results) == [
+        ('case_1', 'switch_next'), ('case_4', 'switch_end')]
+    assert 'switch_end:\n  ret i32 0' in results
+
+
+def test_dense_switches_are_tables():
+    def cases(values, body):
+        return [("case", ("integer", str(value)), body(value)) for value in values]
+
+    ast = [
+        ('fun_def', [], 'int', 'jump', [('int', 'a')], [
+            ('var_def', 'int', 'r', ('integer', '0')),
+            ("switch_stmt", ("identifier", "a"),
+             cases([3, 1, 2, 5], lambda value: [('assignment', '+=', 'r', ('integer', str(value)))])),
+            ('return', ('identifier', 'r')),
+        ]),
+        ('fun_def', [], 'int', 'lookup', [('int', 'a')], [
+            ("switch_stmt", ("identifier", "a"),
+             cases([3, 1, 2, 5], lambda value: [('return', ('integer', str(value * 10)))])),
+            ('return', ('integer', '0')),
+        ]),
+    ]
+    results = generate(ast)
+    assert re.search(r'switch i32 %"[^"]+", label %"switch_end" \[i32 1, label %"case_1" i32 2, label %"case_2" '
+                     r'i32 3, label %"case_3" i32 5, label %"case_5"\]', results)
+    assert results.count('br label %"switch_end"') == 4
+    lookup = results[results.index('define i32 @"lookup"'):]
+    assert 'switch i32' not in lookup and 'case_' not in lookup
+    # 4 has no case, so its bit is clear in the mask.
+    assert 'lshr i64 23,' in lookup
+    assert '@"switch.table" = private unnamed_addr constant [5 x i32] [i32 10, i32 20, i32 30, i32 0, i32 50]' \
+        in results
+    compiled = JIT().compile(results)
+    for n in range(-2, 8):
+        assert compiled["jump"](n) == (n if n in (1, 2, 3, 5) else 0)
+        assert compiled["lookup"](n) == (n * 10 if n in (1, 2, 3, 5) else 0)
+
+
+def test_try_invokes_only_in_its_body():
+    ast = [
+        ('fun_def', [], 'int', 'f', [], [('return', ('integer', '1'))]),
+        ('fun_def', [], 'int', 'main', [], [
+            ('var_def', 'int', 'a', ('fun_call', 'f', [])),
+            ('try', [('assignment', '=', 'a', ('fun_call', 'f', []))], [
+                ('except', 'Overflow', [('assignment', '=', 'a', ('fun_call', 'f', []))]),
+            ]),
+            ('return', ('identifier', 'a')),
+        ])
+    ]
+    results = generate(ast)
+    assert 'define i32 @"main"() uwtable personality i32 (...)* @"__gxx_personality_v0"' in results
+    assert results.count('call i32 @"f"()') == 2
+    assert 'invoke i32 @"f"()\n      to label %"invoke_next" unwind label %"landing"' in results
+    assert 'catch i8* bitcast ({i8*, i8*}* @"o.exception.Overflow" to i8*)' in results
+    assert 'resume {i8*, i32}' in results
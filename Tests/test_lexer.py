@@ -1,5 +1,10 @@
+import io
+import mmap
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
-from Parser.lexer import lexer
+from Parser.lexer import Lexer, lexer
 
 def test_var_def():
     data = '''str a = "hello"'''
@@ -46,3 +51,86 @@ def test_inline_condition():
     assert len(tokens) == 7
     assert tokens[3].type == "QUESTION"
     assert tokens[5].type == "EXCLAMATION"
+
+
+SOURCES = [
+    "int main():\n int a = 0\n when a == 0:\n  a += 1\n return a\n",
+    "class A:\n int x = 0\n int get():\n  return x\nint b = 1\n",
+    "for int i in [1...10]:\n when i > 2:\n  pass\n otherwise:\n  pass\n",
+    "switch y:\n case 1:\n  pass\n case 2:\n  pass\n",
+    'str s = t"Hello! {name}"\nbool b = a == b ? x ! y\n',
+]
+
+
+def tokenize(data):
+    instance = Lexer()
+    instance.input(data)
+    return [(t.type, t.value, t.lineno, t.lexpos) for t in instance]
+
+
+def test_lexer_instances_are_independent():
+    first = Lexer()
+    second = Lexer()
+    first.input(SOURCES[0])
+    second.input(SOURCES[1])
+    assert first.lexer.indentation_stack is not second.lexer.indentation_stack
+    assert [t.type for t in first] == [t[0] for t in tokenize(SOURCES[0])]
+    assert [t.type for t in second] == [t[0] for t in tokenize(SOURCES[1])]
+
+
+def test_lexer_recovers_after_error():
+    instance = Lexer()
+    instance.input("int main():\n  int a = $")
+    with pytest.raises(Exception):
+        list(instance)
+    instance.input(SOURCES[0])
+    tokens = [(t.type, t.value, t.lineno, t.lexpos) for t in instance]
+    assert tokens == tokenize(SOURCES[0])
+
+
+def test_concurrent_tokenize_matches_serial():
+    sources = SOURCES * 200
+    serial = [tokenize(source) for source in sources]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        parallel = list(pool.map(tokenize, sources))
+    assert parallel == serial
+
+
+def test_stream_matches_input():
+    for source in SOURCES + ["\n\n  \n  a = 1\n   \n\n\nb = 2", "a\n  \n", "   "]:
+        streamed = [(t.type, t.value, t.lineno, t.lexpos)
+                    for t in Lexer().stream(io.StringIO(source))]
+        assert streamed == tokenize(source)
+
+
+def test_stream_from_mmap(tmp_path):
+    path = tmp_path / "source.o"
+    path.write_text(SOURCES[0])
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        streamed = [(t.type, t.value, t.lineno, t.lexpos) for t in Lexer().stream(data)]
+    assert streamed == tokenize(SOURCES[0])
+
+
+def test_stream_memory_is_flat(tmp_path):
+    def peak(lines):
+        path = tmp_path / f"source_{lines}.o"
+        path.write_text(SOURCES[0] * lines)
+        tracemalloc.start()
+        with open(path) as f:
+            for _ in Lexer().stream(f):
+                pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak
+
+    small = peak(100)
+    large = peak(5000)
+    assert large < small * 2
+
+
+def test_each_closed_block_dedents():
+    data = "for int r in x:\n for int i in y:\n  pass\nint a = 0\n"
+    lexer.input(data)
+    types = [token.type for token in lexer]
+    assert types.count("DEDENT") == types.count("INDENT") == 2
+    assert types[types.index("DEDENT"):types.index("DEDENT") + 3] == ["DEDENT", "DEDENT", "INTEGER"]
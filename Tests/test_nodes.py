@@ -0,0 +1,124 @@
+import pickle
+
+import pytest
+from Parser import nodes
+from Parser.parser import parser
+
+
+def test_tuple_view():
+    node = nodes.Binop("+", nodes.Identifier("a"), nodes.Integer("1"))
+    _, op, left, right = node
+    assert op == "+"
+    assert node[0] == "binop"
+    assert node[1:] == ("+", ("identifier", "a"), ("integer", "1"))
+    assert len(node) == 4
+    assert node == ("binop", "+", ("identifier", "a"), ("integer", "1"))
+
+
+def test_optional_field_is_left_out_of_view():
+    assert nodes.VarDef("int", "a") == ("var_def", "int", "a")
+    assert nodes.VarDef("int", "a", nodes.Integer("0")) == (
+        "var_def", "int", "a", ("integer", "0"))
+
+
+def test_variadic_field_is_flattened_in_view():
+    node = nodes.WhenStmts(nodes.When(nodes.Identifier("a"), []), nodes.Otherwise([]))
+    assert node.cases[1].tag == "otherwise"
+    assert node[1:] == (("when", ("identifier", "a"), []), ("otherwise", []))
+
+
+def test_indexing_matches_view(monkeypatch):
+    samples = [
+        nodes.Binop("+", nodes.Identifier("a"), nodes.Integer("1")),
+        nodes.VarDef("int", "a"),
+        nodes.VarDef("int", "a", nodes.Integer("0")),
+        nodes.WhenStmts(nodes.When(nodes.Identifier("a"), []), nodes.Otherwise([])),
+        nodes.WhenStmts(),
+        nodes.Pass(),
+    ]
+    views = [node.view() for node in samples]
+    for cls in {type(node) for node in samples}:
+        monkeypatch.setattr(cls, "view", lambda self: pytest.fail("view built"))
+    for node, view in zip(samples, views):
+        assert len(node) == len(view)
+        for index in range(-len(view), len(view)):
+            assert node[index] == view[index]
+        for index in (len(view), -len(view) - 1):
+            with pytest.raises(IndexError):
+                node[index]
+
+
+def test_nodes_are_slotted():
+    node = nodes.Identifier("a", lineno=3)
+    assert not hasattr(node, "__dict__")
+    with pytest.raises(AttributeError):
+        node.other = 1
+    assert node.lineno == 3
+
+
+def test_only_expressions_have_a_type_slot():
+    assert nodes.Identifier.__slots__ == ("name", "type")
+    assert nodes.Return.__slots__ == ("value",)
+    statement = nodes.Return(nodes.Integer("1"))
+    assert statement.type is None and statement.value.type is None
+    with pytest.raises(AttributeError):
+        statement.type = "int"
+
+
+def test_kinds_are_small_and_unique():
+    kinds = [cls.kind for cls in nodes.NODE_TYPES]
+    assert kinds == list(range(len(nodes.SPEC)))
+    assert nodes.NODES["fun_def"].kind == nodes.KINDS["fun_def"]
+    assert nodes.NODE_TYPES[nodes.KINDS["class_def"]] is nodes.ClassDef
+
+
+def test_astuple():
+    tree = parser.parse("int a():\n return 0")
+    assert tree.astuple() == (
+        "program",
+        [("fun_def", [], "int", "a", [], [("return", ("integer", "0"))])],
+    )
+    assert type(tree.astuple()[1][0]) is tuple
+
+
+def test_pickle_roundtrip():
+    tree = parser.parse("when a:\n pass\notherwise:\n int b = 1")
+    copy = pickle.loads(pickle.dumps(tree))
+    assert copy == tree
+    assert copy[1][0].cases[1].body[0].lineno == 4
+
+
+def test_positions():
+    tree = parser.parse("\nint a = 0\n\nint f():\n return a + 1")
+    var_def, fun_def = tree.body
+    assert var_def.lineno == 2
+    assert fun_def.lineno == 4
+    assert fun_def.body[0].value.lineno == 5
+
+
+def test_class_def_layout():
+    tree = parser.parse("@d\nclass A extends B:\n int x = 0")
+    class_def = tree.body[0]
+    assert class_def.decorators == [("decorator", "d")]
+    assert (class_def.name, class_def.base) == ("A", "B")
+    assert class_def.body == [("var_def", "int", "x", ("integer", "0"))]
+
+
+def test_dispatch_table():
+    class Visitor:
+        def visit_integer(self, node):
+            return "integer"
+
+        def visit_custom(self, node):
+            return "custom"
+
+        def generic(self, node):
+            return "generic"
+
+    visitor = Visitor()
+    table = nodes.dispatch_table(visitor, "visit_", visitor.generic)
+    assert table[nodes.Integer](None) == "integer"
+    assert table["integer"](None) == "integer"
+    assert table["custom"](None) == "custom"
+    assert table[nodes.Binop](None) == "generic"
+    assert "binop" not in table
@@ -0,0 +1,68 @@
+import pytest
+from Compiler.ir_generator import IRGenerator
+from Compiler.optimizer import PIPELINES, Optimizer, optimization_level
+from Parser.parser import parser
+from Semantic.analyzer import SemanticAnalyzer
+
+
+@pytest.fixture
+def ir_text():
+    data = (
+        "int add(int a, int b):\n"
+        " return a + b\n"
+        "int main():\n"
+        " int x = 2\n"
+        " x += 3\n"
+        " when x > 4:\n"
+        "  x = 1\n"
+        " return x\n"
+    )
+    tree = parser.parse(data)
+    SemanticAnalyzer().analyze(tree)
+    return IRGenerator().generate(tree.body)
+
+
+def test_o0_keeps_allocas(ir_text):
+    result = Optimizer(0).optimize(ir_text)
+    assert "alloca i32" in result
+
+
+def test_mem2reg_promotes_allocas(ir_text):
+    result = Optimizer(passes=["mem2reg"]).optimize(ir_text)
+    assert "alloca" not in result
+    assert "load" not in result
+
+
+@pytest.mark.parametrize("level", [1, 2, 3])
+def test_levels_fold_main(ir_text, level):
+    result = Optimizer(level).optimize(ir_text)
+    assert "alloca" not in result
+    assert "ret i32 1" in result
+    assert "add i32 %.2, %.1" in result or "add i32 %.1, %.2" in result
+
+
+def test_level_names():
+    assert optimization_level("O3") == 3
+    assert optimization_level("-O1") == 1
+    assert optimization_level(2) == 2
+    with pytest.raises(ValueError):
+        optimization_level("O4")
+
+
+def test_unknown_pass():
+    with pytest.raises(ValueError):
+        Optimizer(passes=["mem2reg", "vectorize-everything"])
+
+
+def test_stats_report(ir_text):
+    optimizer = Optimizer(2, stats=True)
+    optimizer.optimize(ir_text)
+    names = [report.name for report in optimizer.report]
+    assert names == PIPELINES[2][:-1] + ["default<O2>"]
+    assert optimizer.report[0].before > optimizer.report[-1].after
+    for previous, report in zip(optimizer.report, optimizer.report[1:]):
+        assert report.before == previous.after
+        assert report.seconds >= 0
+    summary = optimizer.summary()
+    assert "mem2reg" in summary
+    assert summary.splitlines()[-1].startswith("total")
@@ -1,5 +1,8 @@
+import io
+
 import pytest
-from Parser.parser import parser
+from Parser.lexer import Lexer
+from Parser.parser import parse_arena, parse_stream, parser, parser_function, syntax_errors
 
 
 def test_var_def():
@@ -179,16 +182,46 @@ def test_array_def():
          ("integer", "4"), ("integer", "9")]),
     )
 
-# TODO: Fix object def
-# def test_object_def():
-#     data = 'str:int sizes = {"L": 6}'
-#     results = parser.parse(data)
-#     assert results[1][0] == (
-#         "var_def",
-#         "{str: int}",
-#         "sizes",
-#         ("object_literal", [("keypair", "L", ("integer", "6"))]),
-#     )
+def test_object_def():
+    data = 'str:int sizes = {"L": 6}'
+    results = parser.parse(data)
+    assert results[1][0] == (
+        "var_def",
+        "{str: int}",
+        "sizes",
+        ("object_literal", [("keypair", "L", ("integer", "6"))]),
+    )
+
+
+def test_index():
+    data = "a[1] + b[c][2]"
+    results = parser.parse(data)
+    assert results[1][0] == (
+        "binop",
+        "+",
+        ("index", ("identifier", "a"), ("integer", "1")),
+        ("index", ("index", ("identifier", "b"), ("identifier", "c")), ("integer", "2")),
+    )
+
+
+def test_instances():
+    data = "Point p = Point(1, f(x) + 2)\nPoint q\n"
+    results = parser.parse(data)
+    assert results[1] == [
+        ("var_def", "Point", "p", ("fun_call", "Point", [
+            ("integer", "1"),
+            ("binop", "+", ("fun_call", "f", [("identifier", "x")]), ("integer", "2")),
+        ])),
+        ("var_def", "Point", "q"),
+    ]
+
+
+def test_log():
+    results = parser.parse('log("a", b + 1)\nlog()\n')
+    assert results[1] == [
+        ("log", [("string", "a"), ("binop", "+", ("identifier", "b"), ("integer", "1"))]),
+        ("log", []),
+    ]
 
 
 def test_lambda_def():
@@ -308,6 +341,19 @@ def test_try_multiple_except():
     )
 
 
+def test_await():
+    results = parser.parse("async int f():\n int r = await g(1)\n await sleep(r)\n return r")
+    assert results[1][0][1][5][:2] == [
+        ("var_def", "int", "r", ("await", ("fun_call", "g", [("integer", "1")]))),
+        ("await", ("fun_call", "sleep", [("identifier", "r")])),
+    ]
+
+
+def test_raise():
+    results = parser.parse("try:\n raise Overflow\nexcept Overflow:\n pass")
+    assert results[1][0] == ("try", [("raise", "Overflow")], [("except", "Overflow", [("pass",)])])
+
+
 def test_array_range():
     data = "[1...10]"
     results = parser.parse(data)
@@ -373,4 +419,35 @@ def test_array_comprehension_with_condition():
         ("array_literal", [("integer", "1"),
          ("integer", "2"), ("integer", "3")]),
         ("comparison", ">", ("identifier", "x"), ("integer", "1")),
-    )
\ No newline at end of file
+    )
+
+def test_parse_stream():
+    data = "int a = 0\nwhen a == 0:\n pass\nint b = 1"
+    assert parse_stream(io.StringIO(data)) == parser.parse(data)
+
+
+def test_long_lists_keep_order():
+    names = [f"A{i}" for i in range(1000)]
+    data = "enum a { %s }\nb(%s)" % (", ".join(names), ", ".join(map(str, range(1000))))
+    results = parser.parse(data)
+    assert results[1][0] == ("enum_def", "a", names)
+    assert results[1][1] == ("fun_call", "b", [("integer", str(i)) for i in range(1000)])
+
+
+def test_syntax_errors_are_recorded(capsys):
+    lexer = Lexer()
+    parser_function("int a = 1\nint = 2\n", lexer=lexer)
+    assert lexer.errors == [(2, "=")]
+    assert capsys.readouterr().out == ""
+
+
+def test_syntax_errors_are_raised():
+    for parse in (parser.parse, lambda data: parse_stream(io.StringIO(data)), parse_arena):
+        with pytest.raises(SyntaxError) as excinfo:
+            parse("int a = 1\nint = 2\nint b = 3\n")
+        assert excinfo.value.lineno == 2 and str(excinfo.value) == "Syntax error at '=' (line 2)"
+        with pytest.raises(SyntaxError) as excinfo:
+            parse("int a = 1\nwhen a:\n")
+        assert str(excinfo.value) == "Syntax error at EOF (line 3)"
+    lexer = Lexer()
+    assert syntax_errors(parser_function("int a = (", lexer=lexer), lexer) == [(1, None)]
@@ -0,0 +1,247 @@
+import ctypes
+import os
+import threading
+import time
+
+import llvmlite.binding as llvm
+import llvmlite.ir as ir
+import pytest
+from Compiler import runtime
+from Compiler.codegen import JIT
+from Compiler.ir_generator import IRGenerator
+from Parser.parser import parser
+from Semantic.analyzer import SemanticAnalyzer
+
+
+@pytest.fixture
+def jit():
+    return JIT()
+
+
+def compile(jit, source):
+    tree = parser.parse(source)
+    SemanticAnalyzer().analyze(tree)
+    return jit.compile(IRGenerator().generate(tree.body))
+
+
+def test_array_type():
+    array = runtime.array_type(ir.DoubleType()).as_pointer()
+    assert runtime.is_array(array)
+    assert runtime.element_type(array) == ir.DoubleType()
+    assert not runtime.is_array(ir.IntType(8).as_pointer())
+
+
+def test_push_grows_the_array(jit):
+    compiled = compile(jit, "int f(int n):\n int[] values = []\n for int i in [0 ... n]:\n"
+                            "  push(values, i)\n int total = 0\n for int v in values:\n"
+                            "  total += v % 7\n return total\n")
+    assert compiled["f"](0) == 0
+    assert compiled["f"](1000000) == sum(i % 7 for i in range(1000000))
+
+
+def test_arrays_from_ranges_and_comprehensions(jit):
+    compiled = compile(jit, "double f(int n):\n int[] r = [0 ... n]\n"
+                            " double[] d = [i * 0.5 for int i in r when i % 2 == 1]\n"
+                            " double total = 0\n for double x in d:\n  total += x\n return total\n")
+    assert compiled["f"](10) == sum(i * 0.5 for i in range(10) if i % 2 == 1)
+
+
+def test_push_is_checked():
+    with pytest.raises(Exception) as excinfo:
+        SemanticAnalyzer().analyze(parser.parse('int[] a = []\npush(a, "x")\n'))
+    assert "cannot push str onto int[]" in str(excinfo.value)
+
+
+def test_literals_widen_elements(jit):
+    compiled = compile(jit, "double f():\n double total = 0\n for double x in [1, 2.5]:\n"
+                            "  total += x\n return total\n")
+    assert compiled["f"]() == 3.5
+
+
+def test_runtime_is_shared_when_linking():
+    trees = [parser.parse(f"int {name}():\n int[] a = [1]\n return 0\n") for name in ("f", "g")]
+    for tree in trees:
+        SemanticAnalyzer().analyze(tree)
+    first, second = (IRGenerator().generate(tree.body) for tree in trees)
+    assert 'define linkonce_odr {i64, i64, i8*}* @"o_array_new"' in first
+    linked = llvm.parse_assembly(first)
+    linked.link_in(llvm.parse_assembly(second))
+    linked.verify()
+
+
+def test_maps(jit):
+    compiled = compile(jit, "int f(int n):\n int:int squares = {}\n for int i in [0 ... n]:\n"
+                            "  put(squares, i, i * i)\n int total = 0\n for int k in squares:\n"
+                            "  total += squares[k] % 1000\n return total\n")
+    assert compiled["f"](0) == 0
+    assert compiled["f"](20000) == sum(i * i % 1000 for i in range(20000))
+
+
+def test_object_literals_and_unpacking(jit):
+    compiled = compile(jit, 'double f():\n str:double prices = {"apple": 1, "pear": 2.5}\n'
+                            ' str:double more = {**prices, "fig": 4, "apple": 3}\n int count = 0\n'
+                            ' for str k in more:\n  count += 1\n'
+                            ' return count * 1000 + more["apple"] * 100 + more["pear"] + prices["apple"]\n')
+    assert compiled["f"]() == 3000 + 300 + 2.5 + 1
+
+
+def test_object_literals_are_presized():
+    tree = parser.parse('int f():\n str:int sizes = {"S": 1, "M": 2, "L": 3}\n return 0\n')
+    SemanticAnalyzer().analyze(tree)
+    ir_text = IRGenerator().generate(tree.body)
+    assert "@\"o_map_str_new\"(i64 ptrtoint (i32* getelementptr (i32, i32* null, i32 1) to i64), i64 3)" \
+        in ir_text
+    assert ir_text.count("call i8* @\"o_map_str_slot\"") == 3
+
+
+def test_map_types_are_checked():
+    analyzer = SemanticAnalyzer()
+    with pytest.raises(Exception) as excinfo:
+        analyzer.analyze(parser.parse('int:int m = {"a": 1}\n'))
+    assert "key 'a' is not int" in str(excinfo.value)
+    with pytest.raises(Exception) as excinfo:
+        analyzer.analyze(parser.parse('str:int n = {"a": 1}\nput(n, "b", 2.5)\n'))
+    assert "cannot put double into {str: int}" in str(excinfo.value)
+
+
+def string_at(pointer):
+    return ctypes.string_at(pointer), ctypes.c_int64.from_address(pointer - 8).value
+
+
+def test_template_strings(jit):
+    compiled = compile(jit, 'str f(int n, double d):\n str name = "o\\tk"\n bool big = n > 9\n'
+                            ' return t"{n}/{d} {big} [{name}]"\n')
+    assert string_at(compiled["f"](-2147483648, 2.5)) == (b"-2147483648/2.5 False [o\tk]", 27)
+    assert string_at(compiled["f"](10, 0.125)) == (b"10/0.125 True [o\tk]", 19)
+
+
+def test_doubles_round_trip(jit):
+    compiled = compile(jit, 'str f(double d):\n return t"{d}"\n')
+    for value in [0.1, 1 / 3, 2.5, 123456789.125, 1e300, -5e-324, 0.1 + 0.2]:
+        text, length = string_at(compiled["f"](value))
+        assert float(text) == value and length == len(text)
+    assert string_at(compiled["f"](0.1))[0] == b"0.1"
+    assert string_at(compiled["f"](0.1 + 0.2))[0] == b"0.30000000000000004"
+
+
+def test_concatenations_allocate_once(jit):
+    source = ('str f(str a):\n str b = a + "-" + a + "!"\n b += "?"\n return b\n'
+              'str g():\n return f(f("ab"))\n')
+    tree = parser.parse(source)
+    SemanticAnalyzer().analyze(tree)
+    ir_text = IRGenerator().generate(tree.body)
+    body = ir_text[ir_text.index('define i8* @"f"'):]
+    assert body[:body.index("\n}")].count('call i8* @"o_str_new"') == 2
+    compiled = jit.compile(ir_text)
+    assert string_at(compiled["g"]()) == (b"ab-ab!?-ab-ab!?!?", 17)
+
+
+def test_log_is_buffered(jit, capfd):
+    compiled = compile(jit, 'int f(int n):\n log("n is", n, n / 2.0, n > 1)\n return n\n')
+    compiled["f"](3)
+    compiled["f"](-1)
+    assert capfd.readouterr().out == ""
+    compiled["o_log_flush"]()
+    assert capfd.readouterr().out == "n is 3 1.5 True\nn is -1 -0.5 False\n"
+
+
+def test_log_flushes_at_exit(jit, capfd):
+    source = ('int f():\n log("from a thread")\n return 0\n'
+              'int main():\n str s = "x"\n for int i in [0 ... 17]:\n  s += s\n'
+              ' log("start")\n log(s)\n log()\n return 0\n')
+    compiled = compile(jit, source)
+    thread = threading.Thread(target=compiled["f"])
+    thread.start()
+    thread.join()
+    # The buffer is flushed as the thread exits, which join does not wait for.
+    out = ""
+    for _ in range(100):
+        out += capfd.readouterr().out
+        if out:
+            break
+        time.sleep(0.01)
+    assert out == "from a thread\n"
+    # The second message is larger than the whole buffer.
+    assert compiled["main"]() == 0
+    assert capfd.readouterr().out == "start\n" + "x" * (1 << 17) + "\n\n"
+
+
+def test_exceptions(jit):
+    source = ('int check(int n):\n when n > 10:\n  raise TooBig\n when n < 0:\n  raise Negative\n return n\n'
+              'int f(int n):\n int r = 0\n try:\n  try:\n   r = check(n)\n  except Negative:\n   r = 0 - 1\n'
+              '   r += check(n + 20)\n except TooBig:\n  r += 100\n return r\n'
+              'int g(int n):\n try:\n  return f(n - 100)\n except:\n  return 0 - 2\n'
+              'int h(int n):\n try:\n  return f(n)\n except Negative:\n  return 0 - 3\n')
+    compiled = compile(jit, source)
+    assert [compiled["f"](n) for n in (3, -15, 50)] == [3, 4, 100]
+    # Handlers run outside of their try: what the one for Negative raises
+    # is caught by the try around it, or else by the caller.
+    assert compiled["f"](-5) == 99
+    assert compiled["g"](1) == -2
+    assert compiled["h"](-500) == -3
+
+
+@pytest.mark.parametrize("level", [0, 2])
+def test_async_tasks(level, capfd):
+    source = ('async int square(int n):\n await sleep(1)\n return n * n\n'
+              'async void worker(str name, int delay):\n await sleep(delay)\n'
+              ' int s = await square(delay)\n log(name, s)\n'
+              'async void reader(int fd):\n await readable(fd)\n log("readable")\n'
+              'int main(int fd):\n worker("slow", 40)\n worker("fast", 10)\n reader(fd)\n'
+              ' log("started")\n return 0\n')
+    compiled = compile(JIT(level), source)
+    read_end, write_end = os.pipe()
+    try:
+        os.write(write_end, b"x")
+        # main runs the tasks it started before it returns.
+        assert compiled["main"](read_end) == 0
+    finally:
+        os.close(read_end)
+        os.close(write_end)
+    assert capfd.readouterr().out == "started\nreadable\nfast 100\nslow 1600\n"
+
+
+@pytest.mark.parametrize("level", [0, 2])
+def test_switches(level):
+    source = ('int run(int op):\n int r = 0\n switch op:\n  case 7:\n   r = 70\n  case 1:\n   r = 10\n'
+              '  case 2:\n   r = 20\n  case 3:\n   r += 30\n  case 5:\n   r = 50\n  case 1000:\n   r = 7\n'
+              '  case 20000:\n   r = 8\n  case 300:\n   return 9\n return r + 1\n'
+              'double table(int n):\n switch n:\n  case 10:\n   return 1.5\n  case 11:\n   return 2.5\n'
+              '  case 13:\n   return 3.5\n  case 14:\n   return 4.5\n  case 90:\n   return 9.5\n return 0.0\n')
+    compiled = compile(JIT(level), source)
+    expected = {7: 71, 1: 11, 2: 21, 3: 31, 5: 51, 1000: 8, 20000: 9, 300: 9}
+    for n in [*range(-5, 1100), 19999, 20000, 20001, -2 ** 31, 2 ** 31 - 1]:
+        assert compiled["run"](n) == expected.get(n, 1)
+    expected = {10: 1.5, 11: 2.5, 13: 3.5, 14: 4.5, 90: 9.5}
+    for n in range(-100, 200):
+        assert compiled["table"](n) == expected.get(n, 0.0)
+
+
+@pytest.mark.parametrize("level", [0, 2])
+def test_owned_arrays_are_freed(level):
+    source = ('int f(int n):\n int total = 0\n for int i in [0 ... n]:\n  int[] row = [0 ... 1000]\n'
+              '  push(row, i)\n  row = [i, i]\n  total += row[1] % 7\n return total\n'
+              'async int g(int n):\n int[] a = [n, n]\n await sleep(1)\n return a[1]\n'
+              'int main():\n g(3)\n return 0\n')
+    tree = parser.parse(source)
+    SemanticAnalyzer().analyze(tree)
+    ir_text = IRGenerator().generate(tree.body)
+    body = ir_text[ir_text.index('define i32 @"f"'):]
+    assert body[:body.index("\n}")].count('call void @"o_array_free"') == 3
+    compiled = JIT(level).compile(ir_text)
+    assert compiled["f"](100000) == sum(i % 7 for i in range(100000))
+    assert compiled["main"]() == 0
+
+
+@pytest.mark.parametrize("level", [0, 2])
+def test_uncaught_exceptions_reach_python(level):
+    source = ('int main():\n raise Boom\n'
+              'int fail(int n):\n when n > 1:\n  raise TooBig\n return n\n'
+              'int f(int n):\n try:\n  fail(n)\n except TooBig:\n  return 0 - 1\n return n\n')
+    compiled = compile(JIT(level), source)
+    for call, name in [(lambda: compiled["main"](), "Boom"), (lambda: compiled["fail"](5), "TooBig")]:
+        with pytest.raises(Exception) as excinfo:
+            call()
+        assert str(excinfo.value) == f"Uncaught exception: {name}"
+    assert compiled["fail"](1) == 1
+    assert [compiled["f"](n) for n in (1, 2)] == [1, -1]
@@ -0,0 +1,19 @@
+from Compiler.switch import Branch, Leaf, Table, clusters, plan
+
+
+def test_dense_runs_become_tables():
+    cases = [(1, 0), (2, 1), (3, 2), (5, 3), (7, 4), (300, 5), (1000, 6)]
+    assert clusters(cases) == [Table(1, 7, cases[:5]), Leaf([(300, 5)]), Leaf([(1000, 6)])]
+    # Three cases are too few for a table, and four spread over more than
+    # ten values too sparse.
+    assert clusters([(1, 0), (2, 1), (3, 2)]) == [Leaf([(1, 0)]), Leaf([(2, 1)]), Leaf([(3, 2)])]
+    assert all(isinstance(cluster, Leaf) for cluster in clusters([(0, 0), (4, 1), (8, 2), (12, 3)]))
+
+
+def test_sparse_cases_become_a_search_tree():
+    assert plan([(4, 0), (1, 1)]) == Leaf([(1, 1), (4, 0)])
+    cases = [(value, index) for index, value in enumerate([90, 10, 70, 50, 30])]
+    assert plan(cases) == Branch(50, Leaf([(10, 1), (30, 4)]), Leaf([(50, 3), (70, 2), (90, 0)]))
+    tree = plan([(value, value) for value in [1, 2, 3, 4, 300, 1000, 20000]])
+    assert tree == Branch(1000, Branch(300, Table(1, 4, [(1, 1), (2, 2), (3, 3), (4, 4)]), Leaf([(300, 300)])),
+                          Leaf([(1000, 1000), (20000, 20000)]))
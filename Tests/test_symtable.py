@@ -0,0 +1,92 @@
+import pytest
+from Compiler.scope import ScopeStack
+from Semantic.symtable import SymbolTable
+
+
+@pytest.fixture
+def table():
+    return SymbolTable()
+
+
+def test_shadowing_and_undo(table):
+    table.define("x", "int")
+    table.enter()
+    table.define("x", "str")
+    table.define("y", "bool")
+    assert table.resolve("x").type == "str"
+    assert table.global_scope.resolve("x").type == "int"
+    assert table.global_scope.resolve("y") is None
+    table.leave()
+    assert table.resolve("x").type == "int"
+    assert table.resolve("y") is None
+    assert "y" not in table.bindings
+
+
+def test_redefinition_replaces_binding(table):
+    table.enter()
+    table.define("x", "int")
+    table.define("x", "double")
+    assert list(table.current_scope.symbols) == ["x"]
+    assert table.resolve("x").type == "double"
+    table.leave()
+    assert table.resolve("x") is None
+
+
+def test_scopes_keep_their_own_symbols(table):
+    outer = table.define("x", "int")
+    table.enter()
+    inner = table.define("x", "str")
+    assert table.global_scope.symbols == {"x": outer}
+    assert table.current_scope.symbols == {"x": inner}
+    scope = table.leave()
+    assert scope.symbols == {"x": inner}
+    assert "str" in repr(scope)
+
+
+def test_symbols_are_hash_consed(table):
+    table.enter()
+    first = table.define("a", "int")
+    table.leave()
+    table.enter()
+    assert table.define("a", "int") is first
+    assert table.define("a", "double") is not first
+    assert table.define("f", ("function", "int"), ["int"]) is not table.define("f", ("function", "int"), ["int"])
+    table.leave()
+    assert table.define("a", "int") is not first
+
+
+def test_deep_nesting(table):
+    for depth in range(20000):
+        table.enter()
+        table.define(f"v{depth % 7}", depth)
+    assert table.resolve("v3").type == 19995
+    assert table.global_scope.resolve("v3") is None
+    for _ in range(20000):
+        table.leave()
+    assert table.bindings == {}
+
+
+def test_symbols_are_slotted(table):
+    symbol = table.define("x", "int")
+    assert not hasattr(symbol, "__dict__")
+    assert symbol.depth == 0
+    assert table.global_scope.symbols == {"x": symbol}
+
+
+def test_only_innermost_scope_defines(table):
+    table.enter()
+    with pytest.raises(Exception):
+        table.global_scope.define("x", "int")
+
+
+def test_scope_stack():
+    scopes = ScopeStack()
+    scopes.define("a", 1)
+    scopes.enter()
+    scopes.define("a", 2)
+    assert scopes.resolve("a") == 2
+    assert scopes.current() == {"a": 2}
+    scopes.leave()
+    assert scopes.resolve("a") == 1
+    with pytest.raises(NameError):
+        scopes.resolve("b")
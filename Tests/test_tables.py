@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+import Parser.lexer
+import Parser.parser
+from Parser import tables
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("O_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_cache_dir(cache):
+    assert tables.cache_dir() == str(cache)
+
+
+def test_signature_is_stable():
+    first = tables.signature(Parser.parser, "p_", "tokens", "precedence")
+    second = tables.signature(Parser.parser, "p_", "tokens", "precedence")
+    assert first == second
+
+
+def test_signature_tracks_grammar(monkeypatch):
+    before = tables.signature(Parser.parser, "p_", "tokens", "precedence")
+    monkeypatch.setattr(Parser.parser.p_statements, "__doc__",
+                        "statements : statement")
+    after = tables.signature(Parser.parser, "p_", "tokens", "precedence")
+    assert before != after
+
+
+def test_signature_tracks_tokens(monkeypatch):
+    before = tables.signature(Parser.lexer, "t_", "tokens")
+    monkeypatch.setattr(Parser.lexer, "tokens", Parser.lexer.tokens + ("X",))
+    after = tables.signature(Parser.lexer, "t_", "tokens")
+    assert before != after
+
+
+def test_build_writes_tables(cache):
+    tables.build_lexer(Parser.lexer)
+    tables.build_parser(Parser.parser)
+    names = sorted(name.split("_")[0] for name in os.listdir(cache))
+    assert names == ["lextab", "parsetab"]
+
+
+def test_build_loads_cached_tables(cache):
+    tables.build_parser(Parser.parser)
+    (written,) = os.listdir(cache)
+    parser = tables.build_parser(Parser.parser)
+    assert os.listdir(cache) == [written]
+    result = parser.parse("a = 5\n", lexer=Parser.lexer.Lexer())
+    assert result[1][0] == ("assignment", "=", "a", ("integer", "5"))
+
+
+def test_cached_table_is_not_imported(cache):
+    tables.build_lexer(Parser.lexer)
+    assert not [name for name in sys.modules if name.startswith("lextab_")]